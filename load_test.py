@@ -0,0 +1,334 @@
+"""Нагрузочный тест API dogsHelp.
+
+Виртуальные пользователи параллельно выполняют настоящие сценарии: регистрацию
+и вход, регистрацию собак, создание, получение и взятие заданий, отклики,
+координаты собак места и данные ошейника. По каждому маршруту считаются
+пропускная способность, ошибки и задержки p50/p95/p99; итог печатается в JSON,
+чтобы результаты разных коммитов можно было сравнивать.
+
+    python load_test.py --spawn --concurrency 50 --duration 30 --output result.json
+    python load_test.py --url http://127.0.0.1:8001 --mix task_list=10,coordinates=5,task_take=1
+
+--spawn поднимает uvicorn с отдельной временной базой; без него тест идёт на
+уже запущенный сервер по --url. Админ берётся из учётной записи BigAdmin
+(регистрируется, если её ещё нет).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from secrets import token_hex
+from typing import Optional
+
+import httpx
+
+DEFAULT_MIX = ("register=1,login=1,dogs_register=1,task_create=3,task_list=10,task_take=3,"
+               "response_give=2,response_list=3,coordinates=10,dogs_info=3")
+PLACES = ["Иркутск", "Шелехов", "Ангарск"]
+
+
+def percentile(values: list, q: float) -> float:
+    # Линейная интерполяция между соседними рангами, values отсортирован
+    if not values:
+        return 0.0
+    position = (len(values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+@dataclass
+class RouteStats:
+    latencies: list = field(default_factory=list)
+    errors: int = 0
+    statuses: dict = field(default_factory=dict)
+
+    def summary(self, duration: float) -> dict:
+        values = sorted(self.latencies)
+        return {
+            "count": len(values),
+            "errors": self.errors,
+            "statuses": self.statuses,
+            "rps": round(len(values) / duration, 2) if duration else 0.0,
+            "mean_ms": round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+            "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+            "max_ms": round(values[-1] * 1000, 3) if values else 0.0,
+        }
+
+
+@dataclass
+class State:
+    """Данные, созданные во время теста: на них опираются следующие запросы."""
+    admin: str = ""
+    users: list = field(default_factory=list)         # accessToken
+    login_users: list = field(default_factory=list)   # логины только для сценария входа
+    dogs: list = field(default_factory=list)          # (dogid, place)
+    tasks: list = field(default_factory=list)         # (task_id, accessToken автора)
+    taken: list = field(default_factory=list)         # (accessToken, task_id)
+    stats: dict = field(default_factory=dict)
+    recording: bool = False
+
+
+async def call(client: httpx.AsyncClient, state: State, path: str, payload: dict) -> Optional[dict]:
+    started = time.perf_counter()
+    try:
+        response = await client.post(path, json=payload)
+        status = response.status_code
+    except httpx.HTTPError:
+        response, status = None, "error"
+    elapsed = time.perf_counter() - started
+
+    if state.recording:
+        stats = state.stats.setdefault("POST " + path, RouteStats())
+        stats.latencies.append(elapsed)
+        stats.statuses[str(status)] = stats.statuses.get(str(status), 0) + 1
+        if status != 200:
+            stats.errors += 1
+    if status != 200:
+        return None
+    return response.json()
+
+
+async def register(client, state, rnd):
+    body = await call(client, state, "/user/register", {"login": "load" + token_hex(6), "password": "qwerty"})
+    if body:
+        state.users.append(body["accessToken"])
+
+
+async def login(client, state, rnd):
+    # Вход меняет токен, поэтому для него заведены отдельные пользователи
+    if state.login_users:
+        await call(client, state, "/user/login", {"login": rnd.choice(state.login_users), "password": "qwerty"})
+
+
+async def dogs_register(client, state, rnd):
+    place = rnd.choice(PLACES)
+    body = await call(client, state, "/dogs/register", {
+        "accessToken": state.admin, "characteristic": "нагрузочный тест", "place": place,
+        "photo": "dog.img", "name": "Шарик"})
+    if body:
+        state.dogs.append((body["dogid"], place))
+
+
+async def task_create(client, state, rnd):
+    token = rnd.choice(state.users)
+    body = await call(client, state, "/dogs/task/create", {
+        "accessToken": token, "dog_id": rnd.choice(state.dogs)[0], "goal": "Покормить"})
+    if body:
+        state.tasks.append((body["task_id"], token))
+
+
+async def task_list(client, state, rnd):
+    await call(client, state, "/dogs/task/list", {"accessToken": rnd.choice(state.users), "dog_id": rnd.choice(state.dogs)[0]})
+
+
+async def task_take(client, state, rnd):
+    token = rnd.choice(state.users)
+    task_id = rnd.choice(state.tasks)[0]
+    if await call(client, state, "/dogs/task/take", {"accessToken": token, "task_id": task_id}):
+        state.taken.append((token, task_id))
+
+
+async def response_give(client, state, rnd):
+    if not state.taken:
+        return await task_take(client, state, rnd)
+    token, task_id = state.taken.pop(rnd.randrange(len(state.taken)))
+    await call(client, state, "/dogs/task/response/give", {
+        "accessToken": token, "task_id": task_id, "comment": "Сделано", "photo": "dog.img"})
+
+
+async def response_list(client, state, rnd):
+    task_id, token = rnd.choice(state.tasks)
+    await call(client, state, "/dogs/task/response/list", {"accessToken": token, "task_id": task_id})
+
+
+async def coordinates(client, state, rnd):
+    await call(client, state, "/dogs/coordinates", {"accessToken": rnd.choice(state.users), "place": rnd.choice(PLACES)})
+
+
+async def dogs_info(client, state, rnd):
+    await call(client, state, "/dogs/info", {"accessToken": state.admin, "dog_id": rnd.choice(state.dogs)[0]})
+
+
+SCENARIOS = {
+    "register": register,
+    "login": login,
+    "dogs_register": dogs_register,
+    "task_create": task_create,
+    "task_list": task_list,
+    "task_take": task_take,
+    "response_give": response_give,
+    "response_list": response_list,
+    "coordinates": coordinates,
+    "dogs_info": dogs_info,
+}
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for item in filter(None, (part.strip() for part in mix.split(","))):
+        name, _, weight = item.partition("=")
+        if name not in SCENARIOS:
+            raise ValueError(f"неизвестный сценарий {name}, доступны: {', '.join(SCENARIOS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+async def get_admin(client: httpx.AsyncClient, password: str) -> str:
+    response = await client.post("/user/login", json={"login": "BigAdmin", "password": password})
+    if response.status_code != 200:
+        response = await client.post("/user/register", json={"login": "BigAdmin", "password": password})
+    response.raise_for_status()
+    token = response.json()["accessToken"]
+    await client.post("/user/changeAdmin", json={"accessToken": token, "changed_user_login": "BigAdmin", "admin": True})
+    return token
+
+
+async def prepare(client: httpx.AsyncClient, state: State, args, rnd: random.Random):
+    state.admin = await get_admin(client, args.admin_password)
+    await asyncio.gather(*(register(client, state, rnd) for i in range(args.users)))
+    for i in range(args.users):
+        login_user = "loadlogin" + token_hex(6)
+        if await call(client, state, "/user/register", {"login": login_user, "password": "qwerty"}):
+            state.login_users.append(login_user)
+    await asyncio.gather(*(dogs_register(client, state, rnd) for i in range(args.dogs)))
+    await asyncio.gather(*(task_create(client, state, rnd) for i in range(args.dogs * 2)))
+    if not (state.users and state.dogs and state.tasks):
+        raise SystemExit("Не удалось подготовить данные: сервер отвечает ошибками")
+
+
+async def worker(client: httpx.AsyncClient, state: State, weights: dict, deadline: float, budget: list, seed: int):
+    rnd = random.Random(seed)
+    names, values = list(weights), list(weights.values())
+    while time.perf_counter() < deadline:
+        if budget[0] is not None:
+            if budget[0] <= 0:
+                return
+            budget[0] -= 1
+        await SCENARIOS[rnd.choices(names, values)[0]](client, state, rnd)
+
+
+async def run(args) -> dict:
+    weights = parse_mix(args.mix)
+    rnd = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        state = State()
+        await prepare(client, state, args, rnd)
+
+        state.recording = True
+        budget = [args.requests]
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(*(worker(client, state, weights, deadline, budget, args.seed + i)
+                               for i in range(args.concurrency)))
+        duration = time.perf_counter() - started
+
+    routes = {route: stats.summary(duration) for route, stats in sorted(state.stats.items())}
+    total = RouteStats()
+    for stats in state.stats.values():
+        total.latencies.extend(stats.latencies)
+        total.errors += stats.errors
+        for status, count in stats.statuses.items():
+            total.statuses[status] = total.statuses.get(status, 0) + count
+    return {
+        "commit": git_commit(),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {"url": args.url, "concurrency": args.concurrency, "duration": args.duration,
+                   "requests": args.requests, "mix": weights, "seed": args.seed,
+                   "users": args.users, "dogs": args.dogs, "server_workers": args.workers if args.spawn else None},
+        "duration_s": round(duration, 3),
+        "total": total.summary(duration),
+        "routes": routes,
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def spawn_server(workers: int, tmpdir: str) -> tuple[subprocess.Popen, str]:
+    # Отдельная база и лог, чтобы тест не трогал рабочие данные
+    port = free_port()
+    env = {**os.environ,
+           "DATABASE_URL": f"sqlite:///{os.path.join(tmpdir, 'load_test.db')}",
+           "LOG_FILE": os.path.join(tmpdir, "load_test.log"),
+           "LOG_TO_CONSOLE": "0"}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit("uvicorn завершился при запуске")
+        try:
+            httpx.get(url + "/metrics", timeout=1)
+            return server, url
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    server.terminate()
+    raise SystemExit("uvicorn не запустился за 30 секунд")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест API dogsHelp")
+    parser.add_argument("--url", default="http://127.0.0.1:8001", help="адрес сервера")
+    parser.add_argument("--spawn", action="store_true", help="запустить uvicorn с временной базой")
+    parser.add_argument("--workers", type=int, default=1, help="число воркеров uvicorn при --spawn")
+    parser.add_argument("--concurrency", type=int, default=20, help="число одновременных виртуальных пользователей")
+    parser.add_argument("--duration", type=float, default=30, help="длительность замера, секунд")
+    parser.add_argument("--requests", type=int, default=None, help="остановиться после стольких сценариев")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="веса сценариев: имя=вес через запятую")
+    parser.add_argument("--users", type=int, default=20, help="пользователей, созданных до замера")
+    parser.add_argument("--dogs", type=int, default=10, help="собак, созданных до замера")
+    parser.add_argument("--timeout", type=float, default=30, help="таймаут одного запроса, секунд")
+    parser.add_argument("--seed", type=int, default=1, help="seed выбора сценариев")
+    parser.add_argument("--admin-password", default="qwerty", help="пароль BigAdmin")
+    parser.add_argument("--output", help="записать JSON с результатами в файл")
+    args = parser.parse_args()
+    try:
+        parse_mix(args.mix)
+    except ValueError as error:
+        parser.error(str(error))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        server = None
+        if args.spawn:
+            server, args.url = spawn_server(args.workers, tmpdir)
+        try:
+            result = asyncio.run(run(args))
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    report = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(report)
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,53 @@
+import asyncio
+from contextlib import asynccontextmanager
+from anyio import to_thread
 from fastapi import FastAPI, APIRouter, Body, Query, HTTPException
+from fastapi.exception_handlers import http_exception_handler, request_validation_exception_handler
+from fastapi.exceptions import RequestValidationError
+from starlette.exceptions import HTTPException as StarletteHTTPException
 import uvicorn
+from src import config, metrics, profiler
 from src.database import BaseDBModel, engine
+from src.migrations import migrate
+from src.request_context import RequestContextMiddleware, instrument_engine
+import src.users.passwords as passwords
+import src.users.offline as offline
+import src.users.writebehind as writebehind
 from src.users.user_router import router as user_router
 
 BaseDBModel.metadata.create_all(bind=engine)
+migrate(engine)
+instrument_engine(engine)
+metrics.instrument_engine(engine)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Синхронные обработчики и зависимости FastAPI запускает в общем пуле потоков anyio
+    to_thread.current_default_thread_limiter().total_tokens = config.DB_THREADPOOL_SIZE
+    offline_check = asyncio.create_task(offline.run())
+    if config.WRITE_BEHIND:
+        writebehind.buffer.start()
+    yield
+    offline_check.cancel()
+    # Запросы уже завершены: дописываем в базу то, что осталось в буфере
+    await to_thread.run_sync(writebehind.buffer.stop)
+    passwords.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(RequestContextMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+if config.SQL_PROFILER:
+    app.add_middleware(profiler.SQLProfilerMiddleware)
+
+@app.exception_handler(StarletteHTTPException)
+async def count_http_exception(request, exc):
+    metrics.EXCEPTIONS.inc(route=metrics.route_label(request.scope), exception=type(exc).__name__)
+    return await http_exception_handler(request, exc)
+
+@app.exception_handler(RequestValidationError)
+async def count_validation_exception(request, exc):
+    metrics.EXCEPTIONS.inc(route=metrics.route_label(request.scope), exception=type(exc).__name__)
+    return await request_validation_exception_handler(request, exc)
 
 app.include_router(user_router)
+app.include_router(metrics.router)
@@ -1,87 +1,248 @@
-import requests
+"""Симулятор парка ошейников.
+
+Регистрирует N ошейников одной пачкой запросов и затем одновременно
+ведёт их все: каждый ошейник двигается случайным блужданием и отправляет
+координаты на /dogs/update с заданным интервалом и разбросом, повторяя
+запрос при сетевых ошибках и ответах 5xx. Режим --burst-every время от
+времени заставляет все ошейники отправить координаты разом (например, после
+восстановления связи). Раз в --report-every секунд печатается пропускная
+способность и доля ошибок, в конце — итог в JSON.
+
+    python script_client.py --collars 1000 --interval 10 --jitter 0.2 --duration 120
+    python script_client.py --collars 5000 --save-collars collars.json ...
+    python script_client.py --load-collars collars.json --interval 5 --burst-every 60
+
+Ошейники регистрирует админ: токен передаётся через --admin-token, иначе
+используется учётная запись BigAdmin.
+"""
+import argparse
+import asyncio
 import json
-from time import sleep
+import math
 import random
-
-def requesterReg():
-    uri = 'http://127.0.0.1:8001/dogs/register'
-    adminToken = input('Введите токен админа: ')
-    charact = input('Введите характеристику собаки: ')
-    place = input('Введите местоположение собаки: ')
-    photo = input('Введите характеристику собаки: ')
-    name = input('Введите местоположение собаки: ')
-
-    dates = json.dumps({
-            'accessToken': adminToken,
-            'characteristic': charact,
-            'place': place,
-            'photo': photo,
-            'name': name
-        })
-
-    try:
-        response = requests.post(uri, data = dates)
-        print(response)
-        if (response.status_code == 200):
-            jsn = json.loads(response.text)
-            return [jsn["success"], jsn['dogid'], jsn['accessDogToken']]
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+import httpx
+
+from load_test import get_admin, percentile
+
+EARTH_RADIUS = 6371008.8
+
+
+@dataclass
+class Collar:
+    dogid: int
+    accessDogToken: str
+    lat: float
+    lon: float
+    heading: float = 0.0
+
+    def walk(self, seconds: float, rnd: random.Random, speed: float):
+        # Направление меняется плавно, скорость случайная до speed м/с
+        self.heading = (self.heading + rnd.gauss(0, 30)) % 360
+        distance = rnd.uniform(0, speed) * seconds
+        bearing = math.radians(self.heading)
+        self.lat += math.degrees(distance * math.cos(bearing) / EARTH_RADIUS)
+        self.lon += math.degrees(distance * math.sin(bearing) / (EARTH_RADIUS * math.cos(math.radians(self.lat))))
+        self.lat = max(-89.9, min(89.9, self.lat))
+        self.lon = (self.lon + 180) % 360 - 180
+
+
+@dataclass
+class FleetStats:
+    sent: int = 0
+    ok: int = 0
+    failed: int = 0
+    retries: int = 0
+    statuses: dict = field(default_factory=dict)
+    latencies: list = field(default_factory=list)
+
+    def summary(self, duration: float) -> dict:
+        values = sorted(self.latencies)
+        return {
+            "sent": self.sent,
+            "ok": self.ok,
+            "failed": self.failed,
+            "retries": self.retries,
+            "error_rate": round(self.failed / self.sent, 4) if self.sent else 0.0,
+            "fixes_per_s": round(self.ok / duration, 2) if duration else 0.0,
+            "statuses": self.statuses,
+            "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+        }
+
+
+def start_position(center: tuple, spread: float, rnd: random.Random) -> tuple[float, float]:
+    distance = spread * math.sqrt(rnd.random())
+    bearing = rnd.uniform(0, 2 * math.pi)
+    lat = center[0] + math.degrees(distance * math.cos(bearing) / EARTH_RADIUS)
+    lon = center[1] + math.degrees(distance * math.sin(bearing) / (EARTH_RADIUS * math.cos(math.radians(center[0]))))
+    return lat, lon
+
+
+async def register_collars(client: httpx.AsyncClient, args, rnd: random.Random) -> list[Collar]:
+    adminToken = args.admin_token or await get_admin(client, args.admin_password)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def register(i: int) -> Optional[Collar]:
+        async with semaphore:
+            response = await client.post("/dogs/register", json={
+                "accessToken": adminToken,
+                "characteristic": "симулятор ошейника",
+                "place": args.place,
+                "photo": "dog.img",
+                "name": f"Ошейник {i}"
+            })
+        if response.status_code != 200:
+            print(f"Ошейник {i} не зарегистрирован: {response.status_code} {response.text}")
+            return None
+        jsn = response.json()
+        lat, lon = start_position(args.center, args.spread, rnd)
+        return Collar(jsn["dogid"], jsn["accessDogToken"], lat, lon, rnd.uniform(0, 360))
+
+    collars = await asyncio.gather(*(register(i) for i in range(args.collars)))
+    return [collar for collar in collars if collar is not None]
+
+
+async def send_fix(client: httpx.AsyncClient, collar: Collar, stats: FleetStats, retries: int):
+    payload = {"accessDogToken": collar.accessDogToken, "dogid": collar.dogid,
+               "lat": round(collar.lat, 6), "lon": round(collar.lon, 6)}
+    stats.sent += 1
+    for attempt in range(retries + 1):
+        if attempt:
+            stats.retries += 1
+            await asyncio.sleep(min(0.5 * 2 ** (attempt - 1), 10))
+        started = time.perf_counter()
+        try:
+            response = await client.post("/dogs/update", json=payload)
+            status = str(response.status_code)
+        except httpx.HTTPError as exception:
+            status = type(exception).__name__
+        stats.latencies.append(time.perf_counter() - started)
+        stats.statuses[status] = stats.statuses.get(status, 0) + 1
+        if status == "200":
+            stats.ok += 1
+            return
+        # 4xx не исправится повтором: токен или данные неверны
+        if status.isdigit() and int(status) < 500:
+            break
+    stats.failed += 1
+
+
+async def drive(client, collar: Collar, args, stats: FleetStats, deadline: float, burst: asyncio.Event, rnd: random.Random):
+    # Первая отправка размазана по интервалу, чтобы ошейники не стартовали разом
+    await asyncio.sleep(rnd.uniform(0, args.interval))
+    last = time.monotonic()
+    while time.monotonic() < deadline:
+        now = time.monotonic()
+        collar.walk(now - last, rnd, args.speed)
+        last = now
+        await send_fix(client, collar, stats, args.retries)
+
+        delay = args.interval * (1 + rnd.uniform(-args.jitter, args.jitter))
+        try:
+            await asyncio.wait_for(burst.wait(), timeout=max(0.0, min(delay, deadline - time.monotonic())))
+        except asyncio.TimeoutError:
+            pass
+
+
+async def bursts(every: float, burst: asyncio.Event, deadline: float):
+    while time.monotonic() + every < deadline:
+        await asyncio.sleep(every)
+        burst.set()
+        await asyncio.sleep(0)
+        burst.clear()
+
+
+async def report(stats: FleetStats, every: float, started: float):
+    last_ok, last_time = 0, started
+    while True:
+        await asyncio.sleep(every)
+        now = time.monotonic()
+        rate = (stats.ok - last_ok) / (now - last_time)
+        error_rate = stats.failed / stats.sent if stats.sent else 0.0
+        print(f"{now - started:7.1f} с: отправлено {stats.sent}, принято {stats.ok}, "
+              f"{rate:.1f} коорд./с, ошибок {error_rate:.2%}, повторов {stats.retries}")
+        last_ok, last_time = stats.ok, now
+
+
+async def run(args) -> dict:
+    rnd = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        if args.load_collars:
+            with open(args.load_collars, encoding="utf-8") as file:
+                collars = [Collar(**item) for item in json.load(file)][:args.collars]
         else:
-            print('Ошибка')
-
-    except Exception as exception:
-        print(exception)
-        exit()
-
-
-def requesterUpdate(accessDogToken, dog_id, coordinates):
-    uri = 'http://127.0.0.1:8001/dogs/update'
-
-    try:
-        dates = json.dumps({
-            'accessDogToken': accessDogToken,
-            'dogid': dog_id,
-            "coordinates": coordinates
-        })
-
-        response = requests.post(uri, data=dates)
-        if (response.status_code == 200):
-            jsn = json.loads(response.text)
-            return jsn["success"]
-
-    except Exception as exception:
-        print(exception)
-        exit()
-
-
-flag = False
-while not(flag):
-    flag, dog_id, accessDogToken = requesterReg()
-
-coordinatesW = 52.250323
-coordinatesD = 143.413123
-
-while True:
-    coords = str(coordinatesW) + ', ' + str(coordinatesD)
-
-    requesterUpdate(accessDogToken, dog_id, coords)
-
-    coordinatesW += random.randint(-5, 5)
-    coordinatesD += random.randint(-5, 5)
-
-    sleep(60)
-
-flag = False
-while not(flag):
-    flag, dog_id, accessDogToken = requesterReg()
-
-coordinatesW = '52.250323'
-coordinatesD = '143.413123'
-
-while True:
-    coordinates = coordinatesW + coordinatesD
-    requesterUpdate(accessDogToken, dog_id, coordinates)
-
-    coordinatesW = str(int(coordinatesW) + 1)
-    coordinatesD = str(int(coordinatesD) + 1)
-
-    sleep(60)
\ No newline at end of file
+            registered = time.monotonic()
+            collars = await register_collars(client, args, rnd)
+            print(f"Зарегистрировано {len(collars)} ошейников за {time.monotonic() - registered:.1f} с")
+        if args.save_collars:
+            with open(args.save_collars, "w", encoding="utf-8") as file:
+                json.dump([collar.__dict__ for collar in collars], file, ensure_ascii=False)
+        if not collars:
+            raise SystemExit("Нет ни одного ошейника")
+
+        stats = FleetStats()
+        burst = asyncio.Event()
+        started = time.monotonic()
+        deadline = started + args.duration
+        helpers = [asyncio.create_task(report(stats, args.report_every, started))]
+        if args.burst_every:
+            helpers.append(asyncio.create_task(bursts(args.burst_every, burst, deadline)))
+        await asyncio.gather(*(drive(client, collar, args, stats, deadline, burst, random.Random(args.seed + collar.dogid))
+                               for collar in collars))
+        for helper in helpers:
+            helper.cancel()
+        duration = time.monotonic() - started
+
+    return {
+        "config": {"url": args.url, "collars": len(collars), "interval": args.interval, "jitter": args.jitter,
+                   "burst_every": args.burst_every, "retries": args.retries, "duration": args.duration},
+        "duration_s": round(duration, 3),
+        "ingest": stats.summary(duration),
+    }
+
+
+def parse_center(value: str) -> tuple[float, float]:
+    lat, lon = (float(part) for part in value.split(","))
+    return lat, lon
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Симулятор парка ошейников dogsHelp")
+    parser.add_argument("--url", default="http://127.0.0.1:8001", help="адрес сервера")
+    parser.add_argument("--collars", type=int, default=100, help="число ошейников")
+    parser.add_argument("--interval", type=float, default=60, help="интервал отправки координат, секунд")
+    parser.add_argument("--jitter", type=float, default=0.1, help="разброс интервала, доля от --interval")
+    parser.add_argument("--burst-every", type=float, default=0, help="раз в столько секунд все ошейники отправляют разом")
+    parser.add_argument("--retries", type=int, default=3, help="повторов при сетевой ошибке или ответе 5xx")
+    parser.add_argument("--duration", type=float, default=300, help="длительность симуляции, секунд")
+    parser.add_argument("--concurrency", type=int, default=500, help="одновременных соединений с сервером")
+    parser.add_argument("--timeout", type=float, default=30, help="таймаут одного запроса, секунд")
+    parser.add_argument("--place", default="Иркутск", help="место регистрации ошейников")
+    parser.add_argument("--center", type=parse_center, default=(52.250323, 104.264544), help="центр района: широта,долгота")
+    parser.add_argument("--spread", type=float, default=5000, help="радиус района в метрах")
+    parser.add_argument("--speed", type=float, default=1.5, help="наибольшая скорость собаки, м/с")
+    parser.add_argument("--report-every", type=float, default=5, help="как часто печатать промежуточный итог, секунд")
+    parser.add_argument("--seed", type=int, default=1, help="seed движения и интервалов")
+    parser.add_argument("--admin-token", help="токен админа для регистрации ошейников")
+    parser.add_argument("--admin-password", default="qwerty", help="пароль BigAdmin, если токен не задан")
+    parser.add_argument("--save-collars", help="сохранить зарегистрированные ошейники в JSON")
+    parser.add_argument("--load-collars", help="взять ошейники из JSON вместо регистрации")
+    parser.add_argument("--output", help="записать итог в JSON-файл")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    summary = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(summary)
+    print(summary)
+
+
+if __name__ == "__main__":
+    main()
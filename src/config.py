@@ -0,0 +1,70 @@
+import os
+
+# Кэш accessToken -> пользователь перед запросами авторизации
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "60"))
+
+# Обработчики и запросы к базе выполняются в пуле потоков этого размера
+DB_THREADPOOL_SIZE = int(os.getenv("DB_THREADPOOL_SIZE", "40"))
+
+# Хэширование паролей: метод и стоимость в формате werkzeug
+# ("scrypt", "scrypt:32768:8:1", "pbkdf2:sha256:600000") и пул, в котором оно выполняется
+PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt")
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Подключение к базе данных
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./user_devices.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "30"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+# PRAGMA, которые выставляются каждому новому соединению с SQLite
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+# Логирование: записи кладутся в очередь, файл пишет отдельный поток
+LOG_FILE = os.getenv("LOG_FILE", "./src/tmp/user_router.log")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_TO_CONSOLE = os.getenv("LOG_TO_CONSOLE", "1") == "1"
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+# Доля записей, которые попадают в лог: "маршрут:уровень=доля" через запятую,
+# "*" подходит к любому маршруту или уровню. Пример: "POST /dogs/update:INFO=0.01,*:DEBUG=0"
+LOG_SAMPLING = os.getenv("LOG_SAMPLING", "POST /dogs/update:INFO=0.01")
+
+# Профилировщик SQL по запросам: Server-Timing, поиск N+1 и отчёт о медленных выражениях
+SQL_PROFILER = os.getenv("SQL_PROFILER", "0") == "1"
+# Сколько выполнений одной формы выражения за запрос считается подозрением на N+1
+SQL_PROFILER_NPLUSONE = int(os.getenv("SQL_PROFILER_NPLUSONE", "3"))
+# Время SQL за запрос (мс), после которого отчёт пишется предупреждением
+SQL_PROFILER_SLOW_MS = float(os.getenv("SQL_PROFILER_SLOW_MS", "100"))
+SQL_PROFILER_TOP = int(os.getenv("SQL_PROFILER_TOP", "5"))
+
+# Первое сообщение подписки /dogs/stream содержит не больше STREAM_SNAPSHOT_LIMIT
+# собак; если в области их больше, снимок помечается truncated
+STREAM_SNAPSHOT_LIMIT = int(os.getenv("STREAM_SNAPSHOT_LIMIT", "5000"))
+
+# Ошейник считается молчащим, если координат не было дольше OFFLINE_AFTER секунд.
+# Фоновая задача обновляет список раз в OFFLINE_CHECK_INTERVAL секунд и раз в
+# OFFLINE_RESYNC секунд перечитывает его целиком
+OFFLINE_AFTER = float(os.getenv("OFFLINE_AFTER", "1800"))
+OFFLINE_CHECK_INTERVAL = float(os.getenv("OFFLINE_CHECK_INTERVAL", "60"))
+OFFLINE_RESYNC = float(os.getenv("OFFLINE_RESYNC", "3600"))
+
+# Собака попадает в /dogs/stationary, если дольше STATIONARY_AFTER секунд
+# не отходит дальше STATIONARY_RADIUS метров от точки, где остановилась
+STATIONARY_RADIUS = float(os.getenv("STATIONARY_RADIUS", "50"))
+STATIONARY_AFTER = float(os.getenv("STATIONARY_AFTER", "3600"))
+
+# Отложенная запись координат ошейников: буфер сбрасывается в базу одной
+# транзакцией раз в WRITE_BEHIND_INTERVAL_MS мс или при WRITE_BEHIND_MAX_ENTRIES
+# собаках. В буфере не больше WRITE_BEHIND_MAX_PENDING координат; когда он полон,
+# /dogs/update ждёт до WRITE_BEHIND_PUT_TIMEOUT секунд и отвечает 503
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "0") == "1"
+WRITE_BEHIND_INTERVAL_MS = float(os.getenv("WRITE_BEHIND_INTERVAL_MS", "500"))
+WRITE_BEHIND_MAX_ENTRIES = int(os.getenv("WRITE_BEHIND_MAX_ENTRIES", "5000"))
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "50000"))
+WRITE_BEHIND_PUT_TIMEOUT = float(os.getenv("WRITE_BEHIND_PUT_TIMEOUT", "2"))
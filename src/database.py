@@ -1,11 +1,39 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
 from sqlalchemy.ext.declarative import declarative_base
 
 from sqlalchemy.orm import sessionmaker
 
-DATABASE_URL = "sqlite:///./user_devices.db"
+from src import config
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+DATABASE_URL = config.DATABASE_URL
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # WAL: читатели не ждут пишущего, а при synchronous=NORMAL коммит
+    # не делает fsync, он выполняется только при checkpoint
+    cursor.execute(f"PRAGMA journal_mode={config.SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={config.SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={config.SQLITE_BUSY_TIMEOUT}")
+    cursor.execute(f"PRAGMA cache_size={config.SQLITE_CACHE_SIZE}")
+    cursor.execute(f"PRAGMA mmap_size={config.SQLITE_MMAP_SIZE}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+def make_engine(url: str = DATABASE_URL) -> Engine:
+    url = make_url(url)
+    pool = dict(pool_size=config.DB_POOL_SIZE, max_overflow=config.DB_MAX_OVERFLOW, pool_timeout=config.DB_POOL_TIMEOUT)
+    if url.get_backend_name() != "sqlite":
+        return create_engine(url, **pool)
+
+    if url.database in (None, "", ":memory:"):
+        # Для базы в памяти SQLAlchemy использует пул с одним соединением
+        pool = {}
+    engine = create_engine(url, connect_args={"check_same_thread": False, "timeout": config.SQLITE_BUSY_TIMEOUT / 1000}, **pool)
+    event.listen(engine, "connect", set_sqlite_pragmas)
+    return engine
+
+engine = make_engine()
 
 DBSession = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -0,0 +1,255 @@
+"""Генератор синтетических данных для нагрузочных тестов и оценки ёмкости.
+
+Заполняет базу пользователями, собаками по многим местам, заданиями,
+откликами и историей координат. Данные детерминированы: одинаковые --seed,
+объёмы и --until дают одинаковые строки (кроме случайной соли хэша пароля).
+Строки пишутся пачками через executemany (Core insert) в больших транзакциях;
+хэш пароля по умолчанию считается один раз и переиспользуется для всех
+пользователей.
+
+    python -m src.dataset --users 100000 --dogs 50000 --places 200 \\
+        --tasks 1000000 --responses 2000000 --track-points 20
+
+Пароль всех сгенерированных пользователей — --password (по умолчанию qwerty),
+логины — seed<seed>_user<id>. Данные дописываются к уже существующим: id
+продолжают текущие максимальные, а токены зависят от первого id, поэтому
+повторный запуск с тем же --seed не повторяет токены.
+"""
+import argparse
+import math
+import random
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Iterable, Iterator, Optional
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.engine import Engine
+from werkzeug.security import generate_password_hash
+
+from src import config
+from src.database import BaseDBModel
+from src.migrations import migrate
+from src.users import models
+
+GOALS = ["Покормить", "Выгулять", "Погладить", "Отвести к ветеринару", "Помыть", "Поиграть"]
+COMMENTS = ["", "Сделано", "Накормил", "Погуляли час", "Всё хорошо"]
+NAMES = ["Шарик", "Бобик", "Жучка", "Дружок", "Рекс", "Тузик", "Найда", "Лайка"]
+EARTH_RADIUS = 6371008.8
+
+
+def chunks(rows: Iterable[dict], size: int) -> Iterator[list]:
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+def bulk_insert(engine: Engine, table, rows: Iterable[dict], batch: int, commit_every: int) -> int:
+    """Пишет строки пачками по batch, коммит — каждые commit_every строк."""
+    total = 0
+    conn = engine.connect()
+    try:
+        transaction = conn.begin()
+        pending = 0
+        for chunk in chunks(rows, batch):
+            conn.execute(insert(table), chunk)
+            total += len(chunk)
+            pending += len(chunk)
+            if pending >= commit_every:
+                transaction.commit()
+                transaction = conn.begin()
+                pending = 0
+        transaction.commit()
+    finally:
+        conn.close()
+    return total
+
+
+def next_id(engine: Engine, column) -> int:
+    with engine.connect() as conn:
+        return (conn.execute(select(func.max(column))).scalar() or 0) + 1
+
+
+def offset(lat: float, lon: float, north: float, east: float) -> tuple[float, float]:
+    # Сдвиг точки на north/east метров
+    lat2 = lat + math.degrees(north / EARTH_RADIUS)
+    lon2 = lon + math.degrees(east / (EARTH_RADIUS * math.cos(math.radians(lat))))
+    return lat2, lon2
+
+
+class Generator:
+    def __init__(self, seed: int, until: datetime, password_hash: Optional[str], password: str):
+        self.seed = seed
+        self.until = until
+        self.password_hash = password_hash
+        self.password = password
+
+    def rnd(self, name: str, first_id: int = 0) -> random.Random:
+        # Отдельный генератор на таблицу: объём одной таблицы не меняет данные других.
+        # Первый id входит в seed: при дописывании в базу с тем же --seed новые
+        # строки не повторяют токены уже записанных
+        return random.Random(f"{self.seed}:{name}:{first_id}")
+
+    def token(self, rnd: random.Random) -> str:
+        return f"{rnd.getrandbits(48):012x}"
+
+    def users(self, first_id: int, count: int) -> Iterator[dict]:
+        rnd = self.rnd("users", first_id)
+        for id in range(first_id, first_id + count):
+            yield {
+                "id": id,
+                "login": f"seed{self.seed}_user{id}",
+                "password": self.password_hash or generate_password_hash(self.password, method=config.PASSWORD_HASH_METHOD),
+                "is_admin": rnd.random() < 0.01,
+                "is_deleted": rnd.random() < 0.01,
+                "accessToken": self.token(rnd),
+            }
+
+    def places(self, count: int) -> list[tuple[str, float, float, float]]:
+        # Место, его центр и вес: несколько крупных мест и длинный хвост мелких (закон Ципфа)
+        rnd = self.rnd("places")
+        return [(f"Место {k}", rnd.uniform(42, 68), rnd.uniform(30, 140), 1 / (k + 1)) for k in range(count)]
+
+    def dogs(self, first_id: int, count: int, places: list) -> Iterator[dict]:
+        rnd = self.rnd("dogs", first_id)
+        weights = [place[3] for place in places]
+        for dogid in range(first_id, first_id + count):
+            place, lat, lon, _ = rnd.choices(places, weights)[0]
+            lat, lon = offset(lat, lon, rnd.gauss(0, 3000), rnd.gauss(0, 3000))
+            lat, lon = round(lat, 6), round(lon, 6)
+            yield {
+                "dogid": dogid,
+                "characteristic": f"Характеристика собаки {dogid}",
+                "coordinates": f"{lat}, {lon}",
+                "lat": lat,
+                "lon": lon,
+                "last_send": self.until - timedelta(seconds=rnd.expovariate(1 / 600)),
+                "place": place,
+                "is_deleted": rnd.random() < 0.02,
+                "accessToken": self.token(rnd),
+                "photo": "dog.img",
+                "name": rnd.choice(NAMES),
+            }
+
+    def rtree(self, dogs: Iterable[dict]) -> Iterator[dict]:
+        for dog in dogs:
+            yield {"dogid": dog["dogid"], "min_lat": dog["lat"], "max_lat": dog["lat"],
+                   "min_lon": dog["lon"], "max_lon": dog["lon"]}
+
+    def track(self, first_id: int, dogs: Iterable[dict], points: int, interval: float) -> Iterator[dict]:
+        # Трек идёт назад во времени от текущей точки собаки случайным блужданием
+        rnd = self.rnd("track", first_id)
+        until = int(self.until.timestamp() * 1000)
+        for dog in dogs:
+            lat, lon = dog["lat"], dog["lon"]
+            for i in range(points):
+                yield {"dogid": dog["dogid"], "ts": until - int(i * interval * 1000), "lat": round(lat, 6), "lon": round(lon, 6)}
+                lat, lon = offset(lat, lon, rnd.gauss(0, 20), rnd.gauss(0, 20))
+
+    def tasks(self, first_id: int, count: int, users: tuple[int, int], dogs: tuple[int, int]) -> Iterator[dict]:
+        rnd = self.rnd("tasks", first_id)
+        for id in range(first_id, first_id + count):
+            yield {
+                "id": id,
+                "upload_user_id": rnd.randrange(*users),
+                "dog_id": rnd.randrange(*dogs),
+                "goal": rnd.choice(GOALS),
+                "done": rnd.random() < 0.5,
+            }
+
+    def responses(self, first_id: int, count: int, users: tuple[int, int], tasks: tuple[int, int]) -> Iterator[dict]:
+        # Пользователь откликается на задание не больше одного раза (get_taken_task
+        # ищет отклик через .first()), поэтому исполнители задания выбираются без повторов
+        rnd = self.rnd("responses", first_id)
+        task_count = tasks[1] - tasks[0]
+        count = min(count, (users[1] - users[0]) * task_count)
+        per_task, extra = divmod(count, task_count)
+        id = first_id
+        for i, task_id in enumerate(range(*tasks)):
+            for do_user_id in rnd.sample(range(*users), per_task + (i < extra)):
+                yield {
+                    "id": id,
+                    "do_user_id": do_user_id,
+                    "task_id": task_id,
+                    "comment": rnd.choice(COMMENTS),
+                    "photo": rnd.choice(["", "dog.img"]),
+                }
+                id += 1
+
+
+def generate(engine: Engine, users: int, dogs: int, places: int, tasks: int, responses: int, track_points: int,
+             seed: int = 1, until: Optional[datetime] = None, track_interval: float = 60, password: str = "qwerty",
+             hash_each: bool = False, batch: int = 10000, commit_every: int = 200000, log=print) -> dict:
+    """Заполняет базу синтетическими данными и возвращает число строк по таблицам."""
+    BaseDBModel.metadata.create_all(bind=engine)
+    migrate(engine)
+
+    until = until or datetime.now().replace(minute=0, second=0, microsecond=0)
+    password_hash = None if hash_each else generate_password_hash(password, method=config.PASSWORD_HASH_METHOD)
+    generator = Generator(seed, until, password_hash, password)
+    counts = {}
+
+    def load(name: str, table, rows: Iterable[dict]):
+        started = time.perf_counter()
+        counts[name] = bulk_insert(engine, table, rows, batch, commit_every)
+        elapsed = time.perf_counter() - started
+        log(f"{name}: {counts[name]} строк за {elapsed:.1f} с ({counts[name] / elapsed if elapsed else 0:.0f} строк/с)")
+
+    first_user = next_id(engine, models.tableUser.id)
+    first_dog = next_id(engine, models.DogsUser.dogid)
+    first_task = next_id(engine, models.Tasks.id)
+    first_response = next_id(engine, models.Responses.id)
+    all_places = generator.places(places)
+    user_ids = (first_user, first_user + users)
+    dog_ids = (first_dog, first_dog + dogs)
+
+    load("users", models.tableUser.__table__, generator.users(first_user, users))
+    load("dogsUsers", models.DogsUser.__table__, generator.dogs(first_dog, dogs, all_places))
+    # Точки и трек повторяют те же координаты: генератор собак детерминирован
+    load("dogsRtree", models.dogs_rtree, generator.rtree(generator.dogs(first_dog, dogs, all_places)))
+    if track_points:
+        load("dogsTrack", models.DogsTrack.__table__,
+             generator.track(first_dog, generator.dogs(first_dog, dogs, all_places), track_points, track_interval))
+    if tasks and users and dogs:
+        load("tasks", models.Tasks.__table__, generator.tasks(first_task, tasks, user_ids, dog_ids))
+    # Отклики ссылаются только на действительно записанные задания
+    if responses and users and "tasks" in counts:
+        load("responses", models.Responses.__table__,
+             generator.responses(first_response, responses, user_ids, (first_task, first_task + tasks)))
+
+    with engine.begin() as conn:
+        conn.exec_driver_sql("ANALYZE")
+    return counts
+
+
+def main():
+    from src.database import engine, make_engine
+
+    parser = argparse.ArgumentParser(description="Генератор синтетических данных dogsHelp")
+    parser.add_argument("--database-url", help="база данных, по умолчанию DATABASE_URL")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--dogs", type=int, default=50000)
+    parser.add_argument("--places", type=int, default=200)
+    parser.add_argument("--tasks", type=int, default=1000000)
+    parser.add_argument("--responses", type=int, default=2000000)
+    parser.add_argument("--track-points", type=int, default=20, help="точек истории координат на собаку")
+    parser.add_argument("--track-interval", type=float, default=60, help="секунд между точками трека")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--until", type=datetime.fromisoformat,
+                        help="время последних координат (ISO), по умолчанию начало текущего часа")
+    parser.add_argument("--password", default="qwerty", help="пароль всех пользователей")
+    parser.add_argument("--hash-each", action="store_true", help="считать хэш пароля для каждого пользователя (медленно)")
+    parser.add_argument("--batch", type=int, default=10000, help="строк в одном executemany")
+    parser.add_argument("--commit-every", type=int, default=200000, help="строк в одной транзакции")
+    args = parser.parse_args()
+
+    target = make_engine(args.database_url) if args.database_url else engine
+    started = time.perf_counter()
+    counts = generate(target, args.users, args.dogs, args.places, args.tasks, args.responses, args.track_points,
+                      seed=args.seed, until=args.until, track_interval=args.track_interval, password=args.password,
+                      hash_each=args.hash_each, batch=args.batch, commit_every=args.commit_every)
+    print(f"Готово за {time.perf_counter() - started:.1f} с: {counts}")
+
+
+if __name__ == "__main__":
+    main()
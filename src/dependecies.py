@@ -1,8 +1,60 @@
+from typing import Annotated
+from fastapi import Depends, Request
+from fastapi.exceptions import RequestValidationError
+from sqlalchemy.engine import Row
 from src.database import DBSession
+from src.users.cache import CachedUser
+import src.users.crud as crud
+import src.users.exceptions as exceptions
+from src import request_context
+from src.logger import get_logger
+
+logger = get_logger("user_router_logger")
 
 def get_db_session():
     session = DBSession()
     try:
         yield session
     finally:
-        session.close()
\ No newline at end of file
+        session.close()
+
+async def get_request_body(request: Request) -> dict:
+    # Токен приходит в теле запроса. Starlette кэширует прочитанное тело,
+    # поэтому обработчик потом разбирает его в свою схему без повторного чтения
+    try:
+        body = await request.json()
+    except ValueError:
+        body = None
+    return body if isinstance(body, dict) else {}
+
+def get_body_token(body: dict, field: str) -> str:
+    token = body.get(field)
+    if not isinstance(token, str):
+        raise RequestValidationError([{"type": "missing", "loc": ("body", field), "msg": "Field required", "input": body}])
+    return token
+
+def get_current_user(request: Request, body: dict = Depends(get_request_body), db: DBSession = Depends(get_db_session)) -> CachedUser:
+    userByToken = crud.get_user_by_Token(db, get_body_token(body, "accessToken"))
+    if not(userByToken):
+        logger.warning(f"POST {request.url.path} — Запрос от несуществующего пользователя.")
+        raise exceptions.TokenNotTaken()
+    request_context.set_principal(userByToken.id)
+    return userByToken
+
+def get_current_admin(request: Request, userByToken: CachedUser = Depends(get_current_user)) -> CachedUser:
+    if not(userByToken.is_admin):
+        logger.warning(f"POST {request.url.path} — Запрос от пользователя {userByToken.login}, не являющегося админом.")
+        raise exceptions.AdminNotTaken()
+    return userByToken
+
+def get_current_collar(request: Request, body: dict = Depends(get_request_body), db: DBSession = Depends(get_db_session)) -> Row:
+    collar = crud.get_user_by_DogToken(db, get_body_token(body, "accessDogToken"))
+    if not(collar):
+        logger.warning(f"POST {request.url.path} — Запрос от несуществующего ошейника.")
+        raise exceptions.DogTokenNotTaken()
+    request_context.set_principal(collar.dogid)
+    return collar
+
+CurrentUser = Annotated[CachedUser, Depends(get_current_user)]
+CurrentAdmin = Annotated[CachedUser, Depends(get_current_admin)]
+CurrentCollar = Annotated[Row, Depends(get_current_collar)]
@@ -0,0 +1,196 @@
+import atexit
+import logging
+import os
+import queue
+import random
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+from threading import Lock
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+import orjson
+
+from src import config, metrics, request_context
+
+FORMATTER_STRING = "%(asctime)s — %(name)s — %(levelname)s — %(message)s"
+FORMATTER = logging.Formatter(FORMATTER_STRING)
+
+
+OUTCOMES = {logging.DEBUG: "ok", logging.INFO: "ok", logging.WARNING: "rejected"}
+# Поля, которые переносятся в JSON из записи, если они в ней есть
+CONTEXT_FIELDS = ("route", "outcome", "principal_id", "latency_ms", "queries")
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON (orjson)."""
+
+    def format(self, record):
+        data = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name in CONTEXT_FIELDS:
+            value = getattr(record, name, None)
+            if value is not None:
+                data[name] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        return orjson.dumps(data).decode()
+
+
+class RequestContextFilter(logging.Filter):
+    """Дописывает в запись маршрут, пользователя, время и число запросов к базе
+    текущего HTTP-запроса. Работает в потоке запроса, до постановки в очередь."""
+
+    def filter(self, record):
+        if getattr(record, "outcome", None) is None:
+            record.outcome = OUTCOMES.get(record.levelno, "error")
+        stats = request_context.current()
+        if stats is not None:
+            if getattr(record, "route", None) is None:
+                record.route = stats.route
+            record.principal_id = stats.principal_id
+            record.latency_ms = round(stats.latency * 1000, 3)
+            record.queries = stats.queries
+        return True
+
+
+def parse_sampling(rules: str) -> dict:
+    sampling = {}
+    for rule in filter(None, (part.strip() for part in rules.split(","))):
+        target, rate = rule.rsplit("=", 1)
+        route, level = target.rsplit(":", 1) if ":" in target else (target, "*")
+        sampling[(route.strip(), level.strip().upper())] = float(rate)
+    return sampling
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает в лог заданную долю записей для пары (маршрут, уровень)."""
+
+    def __init__(self, rules: str):
+        super().__init__()
+        self.sampling = parse_sampling(rules)
+
+    def rate(self, route: str, level: str) -> float:
+        for key in ((route, level), (route, "*"), ("*", level), ("*", "*")):
+            if key in self.sampling:
+                return self.sampling[key]
+        return 1.0
+
+    def filter(self, record):
+        rate = self.rate(getattr(record, "route", None) or "*", record.levelname)
+        return rate >= 1.0 or random.random() < rate
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Кладёт запись в ограниченную очередь и никогда не ждёт: если очередь
+    переполнена, запись отбрасывается и учитывается в dropped и в метрике
+    log_records_dropped_total."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            metrics.LOG_RECORDS_DROPPED.inc()
+
+
+class SafeTimedRotatingFileHandler(TimedRotatingFileHandler):
+    """Ротация файла в полночь, безопасная при нескольких воркерах uvicorn.
+
+    Стандартный обработчик при ротации удаляет уже существующий файл за
+    прошедший день, поэтому второй воркер стирал файл, только что созданный
+    первым. Здесь ротация выполняется под файловой блокировкой, и если файл за
+    этот период уже есть, воркер просто переоткрывает текущий лог. Все процессы
+    пишут в режиме дозаписи, так что строки не перемешиваются и не теряются."""
+
+    def doRollover(self):
+        if fcntl is None:
+            return super().doRollover()
+
+        with open(self.baseFilename + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            t = self.rolloverAt - self.interval
+            timeTuple = time.gmtime(t) if self.utc else time.localtime(t)
+            dfn = self.rotation_filename(self.baseFilename + "." + time.strftime(self.suffix, timeTuple))
+            if not os.path.exists(dfn):
+                return super().doRollover()
+
+            if self.stream:
+                self.stream.close()
+                self.stream = None
+            if not self.delay:
+                self.stream = self._open()
+            currentTime = int(time.time())
+            newRolloverAt = self.computeRollover(currentTime)
+            while newRolloverAt <= currentTime:
+                newRolloverAt = newRolloverAt + self.interval
+            self.rolloverAt = newRolloverAt
+
+
+_lock = Lock()
+_queue_handler = None
+_listener = None
+
+
+def get_queue_handler() -> DroppingQueueHandler:
+    """Единственный на процесс обработчик-очередь и поток, который форматирует
+    записи и пишет их в консоль и файл."""
+    global _queue_handler, _listener
+    with _lock:
+        if _queue_handler is None:
+            formatter = JsonFormatter() if config.LOG_FORMAT == "json" else FORMATTER
+            handlers = []
+            if config.LOG_TO_CONSOLE:
+                console_handler = logging.StreamHandler(sys.stdout)
+                console_handler.setFormatter(formatter)
+                handlers.append(console_handler)
+
+            os.makedirs(os.path.dirname(config.LOG_FILE) or ".", exist_ok=True)
+            file_handler = SafeTimedRotatingFileHandler(config.LOG_FILE, when='midnight', encoding='utf-8')
+            file_handler.setFormatter(formatter)
+            handlers.append(file_handler)
+
+            log_queue = queue.Queue(maxsize=config.LOG_QUEUE_SIZE)
+            _queue_handler = DroppingQueueHandler(log_queue)
+            _queue_handler.addFilter(RequestContextFilter())
+            _queue_handler.addFilter(SamplingFilter(config.LOG_SAMPLING))
+            _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+            _listener.start()
+            atexit.register(stop_listener)
+        return _queue_handler
+
+
+def stop_listener():
+    """Дописывает оставшиеся в очереди записи и останавливает поток."""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+            _listener = None
+
+
+def get_logger(logger_name):
+    logger = logging.getLogger(logger_name)
+    logger.setLevel(logging.INFO)
+
+    queue_handler = get_queue_handler()
+    if queue_handler not in logger.handlers:
+        logger.addHandler(queue_handler)
+
+    return logger
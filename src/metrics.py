@@ -0,0 +1,212 @@
+"""Метрики сервиса в текстовом формате Prometheus (/metrics).
+
+Метрики хранятся в памяти процесса: при нескольких воркерах uvicorn каждый
+отдаёт свои значения, а Prometheus суммирует их по меткам instance/worker.
+"""
+from bisect import bisect_left
+from threading import Lock
+from time import perf_counter
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from sqlalchemy.engine import Engine
+
+from src import request_context
+
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels[name] for name in self.labelnames)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key: tuple, value) -> list[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}"]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = HTTP_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def _render_value(self, key: tuple, value) -> list[str]:
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            labels = _format_labels(self.labelnames, key, 'le="' + le + '"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(Counter(
+    "http_requests_total", "Количество HTTP-запросов.", ("method", "route", "status")))
+REQUEST_LATENCY = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "Время обработки HTTP-запроса.", ("method", "route")))
+REQUESTS_IN_PROGRESS = REGISTRY.register(Gauge(
+    "http_requests_in_progress", "HTTP-запросы, которые обрабатываются сейчас.", ("method",)))
+EXCEPTIONS = REGISTRY.register(Counter(
+    "http_exceptions_total", "Ошибки обработки запросов по классу исключения.", ("route", "exception")))
+DB_QUERIES = REGISTRY.register(Counter(
+    "db_queries_total", "Количество запросов к базе данных.", ("operation",)))
+DB_QUERY_LATENCY = REGISTRY.register(Histogram(
+    "db_query_duration_seconds", "Время выполнения запроса к базе данных.", ("operation",), DB_BUCKETS))
+
+STREAM_SUBSCRIBERS = REGISTRY.register(Gauge(
+    "dogs_stream_subscribers", "Открытые подписки /dogs/stream."))
+OFFLINE_COLLARS = REGISTRY.register(Gauge(
+    "dogs_offline_collars", "Ошейники, от которых давно нет координат."))
+STATIONARY_COLLARS = REGISTRY.register(Gauge(
+    "dogs_stationary_collars", "Собаки, которые долго не двигаются с места."))
+LOG_RECORDS_DROPPED = REGISTRY.register(Counter(
+    "log_records_dropped_total", "Записи лога, отброшенные из-за переполненной очереди."))
+WRITE_BEHIND_PENDING = REGISTRY.register(Gauge(
+    "write_behind_pending", "Координаты в буфере отложенной записи."))
+WRITE_BEHIND_FLUSHES = REGISTRY.register(Counter(
+    "write_behind_flushes_total", "Сбросы буфера отложенной записи в базу.", ("result",)))
+WRITE_BEHIND_REJECTED = REGISTRY.register(Counter(
+    "write_behind_rejected_total", "Координаты, отклонённые из-за переполненного буфера."))
+
+
+def route_label(scope) -> str:
+    # Шаблон маршрута вместо пути, чтобы случайные адреса не плодили метки
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """ASGI middleware: счётчики, гистограмма времени и число запросов в работе."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        started = perf_counter()
+        REQUESTS_IN_PROGRESS.inc(method=method)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as exc:
+            EXCEPTIONS.inc(route=route_label(scope), exception=type(exc).__name__)
+            raise
+        finally:
+            REQUESTS_IN_PROGRESS.dec(method=method)
+            route = route_label(scope)
+            REQUESTS.inc(method=method, route=route, status=str(status["code"]))
+            REQUEST_LATENCY.observe(perf_counter() - started, method=method, route=route)
+
+
+def _observe_query(statement: str, elapsed: float):
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+    DB_QUERIES.inc(operation=operation)
+    DB_QUERY_LATENCY.observe(elapsed, operation=operation)
+
+
+def instrument_engine(engine: Engine):
+    """Число и время запросов к базе по типу; замер берётся из общего обработчика request_context."""
+    request_context.instrument_engine(engine)
+    request_context.add_query_observer(_observe_query)
+
+
+router = APIRouter()
+
+
+@router.get("/metrics", include_in_schema=False)
+def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,200 @@
+"""Версионные миграции схемы базы данных.
+
+create_all создаёт только отсутствующие таблицы и не трогает уже
+существующие: не добавляет в них ни колонки, ни индексы. Всё, что меняет
+существующую схему, оформляется здесь отдельной миграцией с номером версии.
+Применённые версии записываются в таблицу schema_migrations вместе с планами
+горячих запросов (EXPLAIN QUERY PLAN) до и после миграции.
+
+Миграции применяются при старте приложения (main.py) или вручную:
+
+    python -m src.migrations            # применить новые миграции
+    python -m src.migrations --status   # список версий и планы запросов
+
+Каждый шаг идемпотентен (IF NOT EXISTS, проверка колонок), поэтому миграцию,
+прерванную на середине, или одновременный старт нескольких воркеров можно
+безопасно повторить.
+"""
+import argparse
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Union
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import OperationalError
+
+from src.logger import get_logger
+
+logger = get_logger("migrations_logger")
+
+Step = Union[str, Callable[[Connection], None]]
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    steps: tuple[Step, ...]
+    # Запросы, планы которых сохраняются до и после миграции
+    probes: tuple[str, ...] = ()
+
+
+def add_column(table: str, column: str, type_: str) -> Callable[[Connection], None]:
+    def step(conn: Connection):
+        columns = {row[1] for row in conn.execute(text(f'PRAGMA table_info("{table}")'))}
+        if column not in columns:
+            conn.execute(text(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {type_}'))
+    return step
+
+
+HOT_QUERIES = (
+    'SELECT id, login, is_admin, is_deleted FROM users WHERE "accessToken" = \'token\'',
+    'SELECT dogid, is_deleted FROM "dogsUsers" WHERE "accessToken" = \'token\'',
+    'SELECT tasks.id, users.login, tasks.goal FROM tasks JOIN users ON users.id = tasks.upload_user_id '
+    'WHERE tasks.dog_id = 1 AND tasks.done = 0 AND tasks.id > 0 ORDER BY tasks.id LIMIT 101',
+    'SELECT id FROM tasks WHERE upload_user_id = 1',
+    'SELECT responses.id, users.login, responses.comment, responses.photo FROM responses '
+    'JOIN users ON users.id = responses.do_user_id WHERE responses.task_id = 1 AND responses.id > 0 '
+    'ORDER BY responses.id LIMIT 101',
+    'SELECT id FROM responses WHERE task_id = 1 AND do_user_id = 1',
+    'SELECT id FROM responses WHERE do_user_id = 1',
+)
+
+MIGRATIONS = (
+    Migration(1, "dogs_numeric_coordinates", (
+        add_column("dogsUsers", "lat", "FLOAT"),
+        add_column("dogsUsers", "lon", "FLOAT"),
+        # Старые строки хранят координаты только текстом "широта, долгота"
+        '''UPDATE "dogsUsers"
+           SET lat = CAST(trim(substr(coordinates, 1, instr(coordinates, ',') - 1)) AS REAL),
+               lon = CAST(trim(substr(coordinates, instr(coordinates, ',') + 1)) AS REAL)
+           WHERE lat IS NULL AND instr(coordinates, ',') > 0''',
+        '''INSERT OR IGNORE INTO "dogsRtree" (dogid, min_lat, max_lat, min_lon, max_lon)
+           SELECT dogid, lat, lat, lon, lon FROM "dogsUsers" WHERE lat IS NOT NULL AND lon IS NOT NULL''',
+    ), probes=(
+        'SELECT lat, lon FROM "dogsUsers" WHERE dogid = 1',
+        'SELECT "dogsUsers".dogid, "dogsUsers".lat, "dogsUsers".lon FROM "dogsUsers" '
+        'JOIN "dogsRtree" ON "dogsRtree".dogid = "dogsUsers".dogid '
+        'WHERE "dogsRtree".max_lat >= 52.2 AND "dogsRtree".min_lat <= 52.4 '
+        'AND "dogsRtree".max_lon >= 104.2 AND "dogsRtree".min_lon <= 104.4 AND "dogsUsers".is_deleted = 0',
+    )),
+    Migration(2, "hot_lookup_indexes", (
+        'CREATE INDEX IF NOT EXISTS "ix_users_accessToken" ON users ("accessToken")',
+        'CREATE INDEX IF NOT EXISTS "ix_dogsUsers_accessToken" ON "dogsUsers" ("accessToken")',
+        'CREATE INDEX IF NOT EXISTS ix_tasks_dog_id ON tasks (dog_id)',
+        'CREATE INDEX IF NOT EXISTS ix_tasks_upload_user_id ON tasks (upload_user_id)',
+        'CREATE INDEX IF NOT EXISTS ix_responses_task_id ON responses (task_id)',
+        'CREATE INDEX IF NOT EXISTS ix_responses_do_user_id ON responses (do_user_id)',
+        'CREATE INDEX IF NOT EXISTS ix_responses_task_id_do_user_id ON responses (task_id, do_user_id)',
+        'CREATE INDEX IF NOT EXISTS ix_tasks_open ON tasks (dog_id, id) WHERE done = 0',
+        'ANALYZE',
+    ), probes=HOT_QUERIES),
+    Migration(3, "dogs_change_seq", (
+        add_column("dogsUsers", "change_seq", "INTEGER DEFAULT 0"),
+        'UPDATE "dogsUsers" SET change_seq = 0 WHERE change_seq IS NULL',
+        'CREATE TABLE IF NOT EXISTS "changeSeq" (name VARCHAR NOT NULL PRIMARY KEY, value INTEGER NOT NULL)',
+        '''INSERT OR IGNORE INTO "changeSeq" (name, value) VALUES ('dogs', 0)''',
+        'CREATE INDEX IF NOT EXISTS "ix_dogsUsers_place_change_seq" ON "dogsUsers" (place, change_seq)',
+    ), probes=(
+        'SELECT dogid, coordinates, is_deleted FROM "dogsUsers" WHERE place = \'Irkutsk\' AND change_seq > 100',
+    )),
+    Migration(4, "dogs_last_send_index", (
+        # last_send стал DateTime: пустая строка не разбирается как время
+        '''UPDATE "dogsUsers" SET last_send = NULL WHERE last_send = \'\'''',
+        'CREATE INDEX IF NOT EXISTS "ix_dogsUsers_last_send" ON "dogsUsers" (last_send)',
+    ), probes=(
+        'SELECT dogid, last_send, place FROM "dogsUsers" '
+        'WHERE last_send > \'2024-06-01 11:00:00\' AND last_send <= \'2024-06-01 11:30:00\' AND is_deleted = 0',
+    )),
+)
+
+
+def explain(conn: Connection, queries: tuple[str, ...]) -> str:
+    plans = []
+    for query in queries:
+        try:
+            detail = "; ".join(row[3] for row in conn.execute(text("EXPLAIN QUERY PLAN " + query)))
+        except OperationalError as error:
+            # До миграции запрос может ссылаться на ещё не созданные колонки
+            detail = f"недоступен: {error.orig}"
+        plans.append(f"{query}\n    -> {detail}")
+    return "\n".join(plans)
+
+
+def ensure_version_table(conn: Connection):
+    conn.execute(text('''CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name VARCHAR NOT NULL,
+        applied_at VARCHAR NOT NULL,
+        plan_before TEXT,
+        plan_after TEXT
+    )'''))
+
+
+def applied_versions(conn: Connection) -> set[int]:
+    ensure_version_table(conn)
+    return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def migrate(engine: Engine) -> list[int]:
+    """Применяет ещё не применённые миграции по возрастанию версии и возвращает их номера."""
+    applied = []
+    with engine.begin() as conn:
+        done = applied_versions(conn)
+
+    for migration in MIGRATIONS:
+        if migration.version in done:
+            continue
+        with engine.begin() as conn:
+            plan_before = explain(conn, migration.probes) if migration.probes else None
+            for step in migration.steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(text(step))
+            plan_after = explain(conn, migration.probes) if migration.probes else None
+            conn.execute(text(
+                "INSERT OR IGNORE INTO schema_migrations (version, name, applied_at, plan_before, plan_after) "
+                "VALUES (:version, :name, :applied_at, :plan_before, :plan_after)"
+            ), {"version": migration.version, "name": migration.name, "applied_at": str(datetime.now()),
+                "plan_before": plan_before, "plan_after": plan_after})
+
+        logger.info(f"Миграция {migration.version} ({migration.name}) применена.")
+        if plan_after:
+            logger.info(f"Планы запросов после миграции {migration.version}:\n{plan_after}")
+        applied.append(migration.version)
+    return applied
+
+
+def status(engine: Engine) -> list[dict]:
+    with engine.begin() as conn:
+        ensure_version_table(conn)
+        rows = conn.execute(text(
+            "SELECT version, name, applied_at, plan_before, plan_after FROM schema_migrations ORDER BY version"
+        )).mappings().all()
+    return [dict(row) for row in rows]
+
+
+def main():
+    from src.database import BaseDBModel, engine
+    import src.users.models  # noqa: F401  регистрирует модели в метаданных
+
+    parser = argparse.ArgumentParser(description="Миграции схемы базы данных dogsHelp")
+    parser.add_argument("--status", action="store_true", help="показать применённые миграции и планы запросов")
+    args = parser.parse_args()
+
+    if not args.status:
+        BaseDBModel.metadata.create_all(bind=engine)
+        applied = migrate(engine)
+        print(f"Применены миграции: {applied}" if applied else "Новых миграций нет.")
+
+    for row in status(engine):
+        print(f"\n#{row['version']} {row['name']} ({row['applied_at']})")
+        if row["plan_before"]:
+            print("До:\n" + row["plan_before"])
+            print("После:\n" + row["plan_after"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""Профилировщик SQL-запросов одного HTTP-запроса (включается SQL_PROFILER=1).
+
+Для каждого запроса считает и замеряет выражения SQL, помечает выражения
+одной формы, повторённые SQL_PROFILER_NPLUSONE раз и больше, как подозрение
+на N+1 и добавляет к ответу заголовок Server-Timing с разбивкой времени:
+
+    db             — выполнение SQL (вместе с зависимостями вроде проверки токена);
+    handler        — код обработчика без времени SQL;
+    serialization  — от возврата из обработчика до отправки заголовков ответа;
+    total          — весь запрос до отправки заголовков.
+
+Отчёт о самых медленных выражениях пишется в лог sql_profiler_logger и
+хранится в памяти (recent_reports) для отладки.
+
+Своего обработчика событий SQLAlchemy у профилировщика нет: число запросов,
+их время и формы выражений собирает request_context в RequestStats запроса.
+"""
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from functools import wraps
+from inspect import iscoroutinefunction
+from time import perf_counter
+from typing import Optional
+
+from fastapi.routing import APIRoute
+
+from src import config, request_context
+from src.logger import get_logger
+from src.request_context import RequestStats, StatementStats
+
+logger = get_logger("sql_profiler_logger")
+
+
+@dataclass
+class Profile:
+    stats: RequestStats
+    started: float = field(default_factory=perf_counter)
+    handler_time: float = 0.0
+    handler_db_time: float = 0.0
+    handler_finished: Optional[float] = None
+    response_started: Optional[float] = None
+
+    @property
+    def route(self) -> str:
+        return self.stats.route
+
+    @property
+    def statements(self) -> dict:
+        return self.stats.statements
+
+    @property
+    def queries(self) -> int:
+        return self.stats.queries
+
+    @property
+    def db_time(self) -> float:
+        return self.stats.db_time
+
+    def suspects(self) -> list[tuple[str, StatementStats]]:
+        return [(shape, stats) for shape, stats in self.statements.items()
+                if stats.count >= config.SQL_PROFILER_NPLUSONE]
+
+    def slowest(self, limit: int) -> list[tuple[str, StatementStats]]:
+        return sorted(self.statements.items(), key=lambda item: item[1].slowest, reverse=True)[:limit]
+
+    def timings(self) -> dict:
+        end = self.response_started or perf_counter()
+        serialization = end - self.handler_finished if self.handler_finished is not None else 0.0
+        return {
+            "db": self.db_time,
+            "handler": max(self.handler_time - self.handler_db_time, 0.0),
+            "serialization": serialization,
+            "total": end - self.started,
+        }
+
+    def server_timing(self) -> str:
+        timings = self.timings()
+        parts = []
+        for name, seconds in timings.items():
+            part = f"{name};dur={seconds * 1000:.2f}"
+            if name == "db":
+                part += f';desc="{self.queries} queries"'
+            parts.append(part)
+        return ", ".join(parts)
+
+    def report(self) -> str:
+        lines = [f"{self.route}: {self.queries} запросов к базе, {self.db_time * 1000:.2f} мс"]
+        for shape, stats in self.suspects():
+            lines.append(f"  N+1? {stats.count} раз, {stats.total * 1000:.2f} мс: {shape}")
+        for shape, stats in self.slowest(config.SQL_PROFILER_TOP):
+            lines.append(f"  {stats.slowest * 1000:.2f} мс (x{stats.count}): {shape}")
+        return "\n".join(lines)
+
+
+_current: ContextVar[Optional[Profile]] = ContextVar("sql_profile", default=None)
+_reports: deque = deque(maxlen=100)
+
+
+def current() -> Optional[Profile]:
+    return _current.get()
+
+
+def recent_reports() -> list[str]:
+    return list(_reports)
+
+
+class SQLProfilerMiddleware:
+    """ASGI middleware: заводит Profile на запрос и добавляет Server-Timing к ответу."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        with request_context.request_stats(scope) as stats:
+            stats.statements = {}
+            profile = Profile(stats)
+            token = _current.set(profile)
+
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    profile.response_started = perf_counter()
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", profile.server_timing().encode("latin-1")))
+                    message = {**message, "headers": headers}
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                _current.reset(token)
+                report = profile.report()
+                _reports.append(report)
+                slow = profile.db_time * 1000 >= config.SQL_PROFILER_SLOW_MS
+                if profile.suspects() or slow:
+                    logger.warning(report)
+                else:
+                    logger.debug(report)
+
+
+def _finish_handler(profile: Profile, started: float, db_before: float):
+    profile.handler_finished = perf_counter()
+    profile.handler_time += profile.handler_finished - started
+    profile.handler_db_time += profile.db_time - db_before
+
+
+def _timed_endpoint(endpoint):
+    # include_router пересоздаёт маршруты с уже обёрнутым обработчиком
+    if getattr(endpoint, "_profiled", False):
+        return endpoint
+    # Синхронный обработчик должен остаться синхронным, иначе FastAPI
+    # перестанет выносить его в пул потоков
+    if iscoroutinefunction(endpoint):
+        @wraps(endpoint)
+        async def timed(*args, **kwargs):
+            profile = _current.get()
+            if profile is None:
+                return await endpoint(*args, **kwargs)
+            started, db_before = perf_counter(), profile.db_time
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                _finish_handler(profile, started, db_before)
+    else:
+        @wraps(endpoint)
+        def timed(*args, **kwargs):
+            profile = _current.get()
+            if profile is None:
+                return endpoint(*args, **kwargs)
+            started, db_before = perf_counter(), profile.db_time
+            try:
+                return endpoint(*args, **kwargs)
+            finally:
+                _finish_handler(profile, started, db_before)
+    timed._profiled = True
+    return timed
+
+
+class ProfiledRoute(APIRoute):
+    """Маршрут, который замеряет время самого обработчика для Server-Timing."""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, _timed_endpoint(endpoint), **kwargs)
+
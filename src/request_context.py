@@ -0,0 +1,135 @@
+import re
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from time import perf_counter
+from typing import Callable, Iterator, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Развёрнутые списки IN (?, ?, ?) разной длины считаются одной формой
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACES = re.compile(r"\s+")
+
+
+def statement_shape(statement: str) -> str:
+    return _IN_LIST.sub("(?, ...)", _SPACES.sub(" ", statement).strip())
+
+
+@dataclass
+class StatementStats:
+    count: int = 0
+    total: float = 0.0
+    slowest: float = 0.0
+
+
+@dataclass
+class RequestStats:
+    """Сведения о текущем запросе, которые собираются по ходу его обработки."""
+    route: str
+    started: float = field(default_factory=perf_counter)
+    principal_id: Optional[int] = None
+    queries: int = 0
+    db_time: float = 0.0
+    # Форма выражения -> StatementStats; собирается, только если словарь
+    # завёл профилировщик (SQL_PROFILER=1)
+    statements: Optional[dict] = None
+
+    @property
+    def latency(self) -> float:
+        return perf_counter() - self.started
+
+    def record(self, statement: str, elapsed: float):
+        self.queries += 1
+        self.db_time += elapsed
+        if self.statements is not None:
+            stats = self.statements.setdefault(statement_shape(statement), StatementStats())
+            stats.count += 1
+            stats.total += elapsed
+            stats.slowest = max(stats.slowest, elapsed)
+
+
+# Обработчики выполняются в пуле потоков с копией контекста, поэтому в
+# переменной лежит изменяемый объект: счётчики, увеличенные в потоке,
+# видны middleware после ответа
+_current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def current() -> Optional[RequestStats]:
+    return _current.get()
+
+
+def set_principal(principal_id: int):
+    stats = _current.get()
+    if stats is not None:
+        stats.principal_id = principal_id
+
+
+@contextmanager
+def request_stats(scope) -> Iterator[RequestStats]:
+    """RequestStats HTTP-запроса: уже заведённый внешним middleware или новый на время блока."""
+    stats = _current.get()
+    if stats is not None:
+        yield stats
+        return
+    stats = RequestStats(route=f"{scope['method']} {scope['path']}")
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+class RequestContextMiddleware:
+    """ASGI middleware, которое заводит RequestStats на каждый HTTP-запрос."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        with request_stats(scope):
+            await self.app(scope, receive, send)
+
+
+# Кому ещё нужно время каждого выражения (метрики): вызываются из того же
+# обработчика событий, чтобы выражение замерялось один раз
+_query_observers: list[Callable[[str, float], None]] = []
+
+
+def add_query_observer(observer: Callable[[str, float], None]):
+    if observer not in _query_observers:
+        _query_observers.append(observer)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = perf_counter() - conn.info["query_started"].pop()
+    for observer in _query_observers:
+        observer(statement, elapsed)
+    stats = _current.get()
+    if stats is not None:
+        stats.record(statement, elapsed)
+
+
+def _handle_error(exception_context):
+    # after_cursor_execute для упавшего запроса не вызывается
+    if exception_context.connection is not None and exception_context.cursor is not None:
+        started = exception_context.connection.info.get("query_started")
+        if started:
+            started.pop()
+
+
+def instrument_engine(engine: Engine):
+    """Единственный обработчик выполнения SQL: считает запросы и их время в
+    RequestStats текущего запроса и передаёт время наблюдателям."""
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "handle_error", _handle_error)
@@ -0,0 +1,65 @@
+from collections import OrderedDict, namedtuple
+from threading import Lock
+from time import monotonic
+from typing import Optional
+
+from src import config
+
+CachedUser = namedtuple("CachedUser", ["id", "login", "is_admin", "is_deleted"])
+
+
+class TokenCache:
+    """LRU-кэш accessToken -> CachedUser с ограниченным временем жизни записи.
+
+    Кэш живёт внутри процесса: при смене токена, бана или прав запись нужно
+    сбросить через invalidate. В других воркерах устаревшая запись живёт не
+    дольше ttl секунд."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = Lock()
+        self._generation = 0
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, token: str) -> Optional[CachedUser]:
+        with self._lock:
+            item = self._items.get(token)
+            if item is None:
+                return None
+            user, expires = item
+            if expires < monotonic():
+                del self._items[token]
+                return None
+            self._items.move_to_end(token)
+            return user
+
+    def put(self, token: str, user: CachedUser, generation: int):
+        # generation берётся до запроса в базу: если за это время был invalidate,
+        # прочитанная строка могла устареть и в кэш не кладётся
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._items[token] = (user, monotonic() + self.ttl)
+            self._items.move_to_end(token)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def invalidate(self, token: str):
+        with self._lock:
+            self._generation += 1
+            self._items.pop(token, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._items.clear()
+
+
+token_cache = TokenCache(config.TOKEN_CACHE_SIZE, config.TOKEN_CACHE_TTL)
@@ -1,11 +1,13 @@
+import numpy as np
+from sqlalchemy import insert, update
+from sqlalchemy.engine import Row
 from sqlalchemy.orm import Session
-from typing import Optional
-from src.users import models, schemas
+from typing import Optional, Iterable
+from src.users import models, schemas, geo
+from src.users.cache import CachedUser, token_cache
 from secrets import token_hex
-from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
-def create_user(db: Session, user: schemas.UserCreate) -> Optional[models.tableUser]:
-    hashedPassword = generate_password_hash(user.password)
+def create_user(db: Session, user: schemas.UserCreate, hashedPassword: str) -> Optional[models.tableUser]:
     admin = False
     accessToken = token_hex(6)
 
@@ -20,12 +22,21 @@ def get_user_by_login(db: Session, login: str) -> Optional[models.tableUser]:
     db_user = db.query(models.tableUser).filter_by(login=login).first()
     return db_user
 
-def get_user_by_Token(db: Session, accessToken: str) -> Optional[models.tableUser]:
-    db_user = db.query(models.tableUser).filter_by(accessToken=accessToken).first()
+def get_user_by_Token(db: Session, accessToken: str) -> Optional[CachedUser]:
+    db_user = token_cache.get(accessToken)
+    if db_user:
+        return db_user
+
+    generation = token_cache.generation
+    row = db.query(models.tableUser.id, models.tableUser.login, models.tableUser.is_admin, models.tableUser.is_deleted).filter_by(accessToken=accessToken).first()
+    if row is None:
+        return None
+    db_user = CachedUser(*row)
+    token_cache.put(accessToken, db_user, generation)
     return db_user
 
-def get_user_by_DogToken(db: Session, accessDogToken: str) -> Optional[models.DogsUser]:
-    db_user = db.query(models.DogsUser).filter_by(accessToken=accessDogToken).first()
+def get_user_by_DogToken(db: Session, accessDogToken: str) -> Optional[Row]:
+    db_user = db.query(models.DogsUser.dogid, models.DogsUser.is_deleted).filter_by(accessToken=accessDogToken).first()
     return db_user
 
 def get_user_by_DogId(db: Session, dogid: int) -> Optional[models.DogsUser]:
@@ -49,27 +60,35 @@ def get_user_by_Id(db: Session, id: str) -> str:
     return db_user[0]
 
 def get_user_by_Admin(db: Session, accessToken: str) -> bool:
-    db_user = db.query(models.tableUser.accessToken, models.tableUser.is_admin).filter_by(accessToken=accessToken).first()
-    return db_user[1]
+    db_user = get_user_by_Token(db, accessToken)
+    return bool(db_user and db_user.is_admin)
 
 def get_user_by_Deleted(db: Session, login: str) -> bool:
     db_user = db.query(models.tableUser.login, models.tableUser.is_deleted).filter_by(login=login).first()
     return db_user[1]
-def checkPassword(db: Session, login:str,password: str) -> Optional[models.tableUser]:
-    db_user = db.query(models.tableUser).filter_by(login=login).first()
-    if (db_user):
-        if check_password_hash(db_user.password, password):
-            db_user.accessToken = token_hex(6)
+def checkPassword(db: Session, db_user: models.tableUser, rehashedPassword: Optional[str] = None) -> str:
+    # Пароль уже проверен в пуле хэширования: выдаём новый токен и,
+    # если поменялись параметры хэширования, сохраняем пересчитанный хэш
+    oldToken = db_user.accessToken
+    accessToken = token_hex(6)
+    db_user.accessToken = accessToken
+    if rehashedPassword:
+        db_user.password = rehashedPassword
 
-            db.commit()
-        else:
-            db_user = False
-    return db_user
+    db.commit()
+    token_cache.invalidate(oldToken)
+    return accessToken
+
+def next_change_seq(db: Session) -> int:
+    # Первая запись транзакции: берёт блокировку записи и следующий номер изменения
+    return db.execute(update(models.ChangeSeq).where(models.ChangeSeq.name == "dogs").values(
+        value=models.ChangeSeq.value + 1
+    ).returning(models.ChangeSeq.value)).scalar_one()
 
 def create_dogsuser(db: Session, user: schemas.DogsUserBase) -> schemas.DogsUser:
     accessDogToken = token_hex(6)
 
-    db.user = models.DogsUser(characteristic=user.characteristic, coordinates='', last_send=str(datetime.now()), place=user.place, is_deleted=False, accessToken=accessDogToken, name=user.name, photo=user.photo)
+    db.user = models.DogsUser(characteristic=user.characteristic, coordinates='', last_send=datetime.now(), place=user.place, is_deleted=False, accessToken=accessDogToken, name=user.name, photo=user.photo, change_seq=next_change_seq(db))
 
     db.add(db.user)
     db.commit()
@@ -77,10 +96,8 @@ def create_dogsuser(db: Session, user: schemas.DogsUserBase) -> schemas.DogsUser
 
     return db.user
 
-def create_task(db: Session, task: schemas.CreateTask) -> Optional[models.Tasks]:
-    user = get_user_by_Token(db, task.accessToken)
-
-    db.user = models.Tasks(upload_user_id=user.id, dog_id=task.dog_id, goal=task.goal, done=False)
+def create_task(db: Session, task: schemas.CreateTask, user_id: int) -> Optional[models.Tasks]:
+    db.user = models.Tasks(upload_user_id=user_id, dog_id=task.dog_id, goal=task.goal, done=False)
 
     db.add(db.user)
     db.commit()
@@ -88,19 +105,24 @@ def create_task(db: Session, task: schemas.CreateTask) -> Optional[models.Tasks]
 
     return db.user
 
-def get_tasks(db: Session, dog_id: int) -> object:
-    result = []
-    for u in db.query(models.Tasks.id, models.Tasks.upload_user_id, models.Tasks.goal, models.Tasks.done).filter_by(dog_id=dog_id).all():
-        user = get_user_by_Id(db, u[1])
-        if not(u[3]):
-            result.append({"task_id": str(u[0]), "asked_user": user, "goal": str(u[2])})
+def get_tasks(db: Session, task: schemas.GetTasks) -> tuple[list, Optional[int]]:
+    # Открытые задания вместе с логином автора одним запросом, постранично по id
+    query = db.query(models.Tasks.id, models.tableUser.login, models.Tasks.goal).join(
+        models.tableUser, models.tableUser.id == models.Tasks.upload_user_id
+    ).filter(models.Tasks.dog_id == task.dog_id, models.Tasks.done == False)
+    if task.after_task_id is not None:
+        query = query.filter(models.Tasks.id > task.after_task_id)
+    rows = query.order_by(models.Tasks.id).limit(task.limit + 1).all()
 
-    return result
+    result = []
+    for u in rows[:task.limit]:
+        result.append({"task_id": str(u[0]), "asked_user": u[1], "goal": str(u[2])})
+    next_cursor = rows[task.limit - 1][0] if len(rows) > task.limit else None
 
-def take_task(db: Session, task: schemas.TakeTask) -> Optional[models.Responses]:
-    user = get_user_by_Token(db, task.accessToken)
+    return result, next_cursor
 
-    db.user = models.Responses(do_user_id=user.id, task_id=task.task_id, comment="", photo="")
+def take_task(db: Session, task: schemas.TakeTask, user_id: int) -> Optional[models.Responses]:
+    db.user = models.Responses(do_user_id=user_id, task_id=task.task_id, comment="", photo="")
 
     db.add(db.user)
     db.commit()
@@ -116,50 +138,183 @@ def give_response(db: Session, user_id: int, task: schemas.giveResponse):
 
     db.commit()
 
-def get_responses(db: Session, task: schemas.TakeTask) -> object:
-    result = []
-    for u in db.query(models.Responses.do_user_id, models.Responses.comment, models.Responses.photo).filter_by(task_id=task.task_id).all():
-        user = get_user_by_Id(db, u[0])
-        result.append({"response_user": user, "comment": u[1], "photo": u[2]})
+def get_responses(db: Session, task: schemas.GetResponses) -> tuple[list, Optional[int]]:
+    # Отклики вместе с логином исполнителя одним запросом, постранично по id
+    query = db.query(models.Responses.id, models.tableUser.login, models.Responses.comment, models.Responses.photo).join(
+        models.tableUser, models.tableUser.id == models.Responses.do_user_id
+    ).filter(models.Responses.task_id == task.task_id)
+    if task.after_response_id is not None:
+        query = query.filter(models.Responses.id > task.after_response_id)
+    rows = query.order_by(models.Responses.id).limit(task.limit + 1).all()
 
-    return result
+    result = []
+    for u in rows[:task.limit]:
+        result.append({"response_id": u[0], "response_user": u[1], "comment": u[2], "photo": u[3]})
+    next_cursor = rows[task.limit - 1][0] if len(rows) > task.limit else None
 
-def confirm_task(db: Session, task_id: int):
-    db_user = get_task_by_Id(db, task_id)
+    return result, next_cursor
 
+def confirm_task(db: Session, db_user: models.Tasks):
     db_user.done = True
 
     db.commit()
 
-def get_dogsuser_place(db: Session, place: str) -> object:
-    result=[]
-    for u in db.query(models.DogsUser.dogid, models.DogsUser.coordinates, models.DogsUser.place).filter_by(place=place, is_deleted=False).all():
-        result.append({"dogid": str(u[0]), "coordinates": str(u[1])})
-    return result
+def get_dogsuser_place(db: Session, place: str, since: Optional[int] = None) -> tuple[list, list, int]:
+    # Курсор и собаки читаются разными SELECT без общей транзакции: запись,
+    # закоммиченная между ними, уже видна в собаках, но не в курсоре. Поэтому
+    # курсор поднимается до наибольшего change_seq отданных строк — иначе
+    # следующий опрос прислал бы их повторно. Номера выдаются под блокировкой
+    # записи, так что изменения с меньшими номерами к этому моменту тоже видны
+    cursor = db.query(models.ChangeSeq.value).filter_by(name="dogs").scalar() or 0
+    query = db.query(models.DogsUser.dogid, models.DogsUser.coordinates, models.DogsUser.is_deleted,
+                     models.DogsUser.change_seq).filter_by(place=place)
+    # Курсор из будущего (например, от другой базы) — отдаём место целиком
+    if since is None or since > cursor:
+        query = query.filter(models.DogsUser.is_deleted == False)
+    else:
+        query = query.filter(models.DogsUser.change_seq > since)
 
-def get_dogsuser_update(db: Session, dogid: int, coordinates: str):
-    db_user = db.query(models.DogsUser).filter_by(dogid=dogid).first()
-    db_user.coordinates=coordinates
-    db_user.last_send = str(datetime.now())
+    result = []
+    deleted = []
+    for u in query.all():
+        cursor = max(cursor, u[3] or 0)
+        if u[2]:
+            deleted.append(str(u[0]))
+        else:
+            result.append({"dogid": str(u[0]), "coordinates": str(u[1])})
+    return result, deleted, cursor
+
+def get_dogsuser_nearby(db: Session, area: schemas.NearbyDogs) -> list:
+    if area.radius is not None:
+        min_lat, max_lat, min_lon, max_lon = geo.bounding_box(area.lat, area.lon, area.radius)
+    else:
+        min_lat, max_lat, min_lon, max_lon = area.min_lat, area.max_lat, area.min_lon, area.max_lon
+
+    rtree = models.dogs_rtree.c
+    rows = []
+    # У линии перемены дат прямоугольник делится на два запроса к R*Tree
+    for range_min_lon, range_max_lon in geo.lon_ranges(min_lon, max_lon):
+        query = db.query(models.DogsUser.dogid, models.DogsUser.coordinates, models.DogsUser.lat, models.DogsUser.lon).join(
+            models.dogs_rtree, rtree.dogid == models.DogsUser.dogid
+        ).filter(
+            rtree.min_lat >= min_lat, rtree.max_lat <= max_lat, rtree.min_lon >= range_min_lon, rtree.max_lon <= range_max_lon,
+            models.DogsUser.is_deleted == False
+        )
+        if area.radius is None:
+            query = query.limit(area.limit - len(rows))
+        rows += query.all()
+
+    if area.radius is None:
+        return [{"dogid": str(u[0]), "coordinates": str(u[1])} for u in rows[:area.limit]]
+
+    # R*Tree отбирает кандидатов по описанному прямоугольнику, круг проверяется точно
+    lats = np.fromiter((u[2] for u in rows), dtype=float, count=len(rows))
+    lons = np.fromiter((u[3] for u in rows), dtype=float, count=len(rows))
+    order, distances = geo.nearest(area.lat, area.lon, lats, lons, area.limit, area.radius)
+    return [{"dogid": str(rows[i][0]), "coordinates": str(rows[i][1]), "distance": round(float(d), 1)} for i, d in zip(order, distances)]
+
+def get_dogsuser_places(db: Session, dogids: list[int]) -> dict:
+    # dogid -> place для не удалённых собак, один запрос на пачку
+    rows = db.query(models.DogsUser.dogid, models.DogsUser.place).filter(
+        models.DogsUser.dogid.in_(set(dogids)), models.DogsUser.is_deleted == False
+    ).all()
+    return {u[0]: u[1] for u in rows}
+
+def get_dogsuser_area(db: Session, place: Optional[str], box: Optional[tuple], limit: int) -> tuple[list, bool]:
+    # Текущие координаты не больше limit собак места или прямоугольника для первого
+    # сообщения подписки и признак того, что собак в области больше
+    query = db.query(models.DogsUser.dogid, models.DogsUser.coordinates, models.DogsUser.lat, models.DogsUser.lon).filter(
+        models.DogsUser.is_deleted == False
+    )
+    if place is not None:
+        query = query.filter(models.DogsUser.place == place)
+    else:
+        rtree = models.dogs_rtree.c
+        min_lat, max_lat, min_lon, max_lon = box
+        query = query.join(models.dogs_rtree, rtree.dogid == models.DogsUser.dogid).filter(
+            rtree.min_lat >= min_lat, rtree.max_lat <= max_lat, rtree.min_lon >= min_lon, rtree.max_lon <= max_lon
+        )
+    rows = query.limit(limit + 1).all()
+    return [{"dogid": str(u[0]), "coordinates": str(u[1]), "lat": u[2], "lon": u[3]} for u in rows[:limit]], len(rows) > limit
+
+def get_dogsuser_positions(db: Session, place: str) -> tuple[np.ndarray, list, np.ndarray, np.ndarray]:
+    # Координаты всех собак места загружаются в массивы NumPy одним запросом
+    rows = db.query(models.DogsUser.dogid, models.DogsUser.coordinates, models.DogsUser.lat, models.DogsUser.lon).filter(
+        models.DogsUser.place == place, models.DogsUser.is_deleted == False, models.DogsUser.lat != None
+    ).all()
+    dogids = np.fromiter((u[0] for u in rows), dtype=np.int64, count=len(rows))
+    lats = np.fromiter((u[2] for u in rows), dtype=float, count=len(rows))
+    lons = np.fromiter((u[3] for u in rows), dtype=float, count=len(rows))
+    return dogids, [u[1] for u in rows], lats, lons
+
+def get_dogsuser_nearest(db: Session, user: schemas.NearestDogs) -> list:
+    dogids, coordinates, lats, lons = get_dogsuser_positions(db, user.place)
+    order, distances = geo.nearest(user.lat, user.lon, lats, lons, user.limit)
+    return [{"dogid": str(dogids[i]), "coordinates": str(coordinates[i]), "distance": round(float(d), 1)} for i, d in zip(order, distances)]
+
+def get_dogsuser_update(db: Session, user: schemas.DogsUpdate):
+    update_dogsusers_coordinates(db, [user])
+
+def get_dogids_by_DogTokens(db: Session, accessDogTokens: Iterable[str]) -> dict:
+    # Один запрос на всю пачку: accessDogToken -> dogid
+    rows = db.query(models.DogsUser.accessToken, models.DogsUser.dogid).filter(models.DogsUser.accessToken.in_(set(accessDogTokens))).all()
+    return {u[0]: u[1] for u in rows}
+
+def update_dogsusers_coordinates(db: Session, fixes: list[schemas.DogsUpdate]):
+    now = datetime.now()
+    write_dogsusers_coordinates(db, [(fix, now) for fix in fixes])
+
+def write_dogsusers_coordinates(db: Session, fixes: list[tuple[schemas.DogsUpdate, datetime]]):
+    # Все координаты пачки пишутся одним executemany и одним коммитом.
+    # В трек попадает каждая точка, в dogsUsers и R-дерево — последняя у собаки
+    seq = next_change_seq(db)
+    latest = {fix.dogid: (fix, at) for fix, at in fixes}
+    db.execute(update(models.DogsUser), [
+        {"dogid": fix.dogid, "coordinates": fix.coordinates, "lat": fix.lat, "lon": fix.lon, "last_send": at, "change_seq": seq}
+        for fix, at in latest.values()
+    ])
+    # Точка собаки с той же миллисекундой заменяет прежнюю, как и в dogsUsers:
+    # последняя координата пачки остаётся и в треке, и в текущем положении
+    db.execute(insert(models.DogsTrack).prefix_with("OR REPLACE"), [
+        {"dogid": fix.dogid, "ts": int(at.timestamp() * 1000), "lat": fix.lat, "lon": fix.lon} for fix, at in fixes
+    ])
+    db.execute(insert(models.dogs_rtree).prefix_with("OR REPLACE"), [
+        {"dogid": fix.dogid, "min_lat": fix.lat, "max_lat": fix.lat, "min_lon": fix.lon, "max_lon": fix.lon}
+        for fix, _ in latest.values()
+    ])
     db.commit()
 
-def get_dogsuser_Characteristic(db: Session, dogid: int) -> str:
+def get_dogsuser_track(db: Session, track: schemas.DogTrack) -> list:
+    result = []
+    for u in db.query(models.DogsTrack.ts, models.DogsTrack.lat, models.DogsTrack.lon).filter(
+            models.DogsTrack.dogid == track.dog_id, models.DogsTrack.ts >= track.ts_from, models.DogsTrack.ts <= track.ts_to
+    ).order_by(models.DogsTrack.ts).limit(track.limit).all():
+        result.append({"ts": u[0], "lat": u[1], "lon": u[2]})
+    return result
+
+def get_dogsuser_Characteristic(db: Session, dogid: int) -> Optional[str]:
     db_user = db.query(models.DogsUser.dogid, models.DogsUser.characteristic).filter_by(dogid=dogid).first()
+    if db_user is None:
+        return None
     return str(db_user[1])
 
 def coordinates(db: Session, user: schemas.Coordinates) -> schemas.CoordinatesResponse:
-    db.user = models.DogsUser(characteristic=user.characteristic, coordinates="52.249958,104.264544", last_send=str(datetime.now()), place=user.place, is_deleted=False)
+    db.user = models.DogsUser(characteristic=user.characteristic, coordinates="52.249958,104.264544", last_send=datetime.now(), place=user.place, is_deleted=False)
 
     return db.user
 
 def dog_status_update(db: Session, dogid: int, delete: bool):
     db_user = db.query(models.DogsUser).filter_by(dogid=dogid).first()
-    db_user.is_deleted = delete
+    if db_user.is_deleted != delete:
+        db_user.is_deleted = delete
+        db_user.change_seq = next_change_seq(db)
     db.commit()
 
 def user_status_update(db: Session, db_user, delete: bool):
+    accessToken = db_user.accessToken
     db_user.is_deleted = delete
     db.commit()
+    token_cache.invalidate(accessToken)
 
 def dog_info(db: Session, dogid: int):
     db_user = db.query(models.DogsUser).filter_by(dogid=dogid).first()
@@ -167,5 +322,7 @@ def dog_info(db: Session, dogid: int):
     return db_user
 
 def user_admin_update(db: Session, db_user, admin: bool):
+    accessToken = db_user.accessToken
     db_user.is_admin = admin
-    db.commit()
\ No newline at end of file
+    db.commit()
+    token_cache.invalidate(accessToken)
@@ -35,4 +35,7 @@ class CreatorNotTaken(HTTPException):
 
 class UserBanned(HTTPException):
     def __init__(self):
-        super().__init__(status_code=status.HTTP_400_BAD_REQUEST, detail="User banned")
\ No newline at end of file
+        super().__init__(status_code=status.HTTP_400_BAD_REQUEST, detail="User banned")
+class IngestOverloaded(HTTPException):
+    def __init__(self):
+        super().__init__(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Too many coordinates waiting to be written")
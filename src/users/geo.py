@@ -0,0 +1,56 @@
+from math import asin, cos, radians, sin, sqrt
+
+import numpy as np
+
+EARTH_RADIUS = 6371000.0
+METERS_PER_DEGREE = 111320.0
+
+
+def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Расстояние между двумя точками в метрах."""
+    lat1, lon1, lat2, lon2 = map(radians, (lat1, lon1, lat2, lon2))
+    a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * asin(sqrt(a))
+
+
+def haversine_many(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Расстояния в метрах от точки (lat, lon) до каждой точки массивов lats/lons за один проход."""
+    lat, lon = radians(lat), radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+    a = np.sin((lats - lat) / 2) ** 2 + cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+def nearest(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray, limit: int,
+            radius: float = None) -> tuple[np.ndarray, np.ndarray]:
+    """Индексы не более limit ближайших точек, отсортированные по расстоянию, и сами расстояния.
+
+    Если задан radius, точки дальше него отбрасываются."""
+    distances = haversine_many(lat, lon, lats, lons)
+    order = np.arange(len(distances))
+    if radius is not None:
+        order = order[distances <= radius]
+    if len(order) > limit:
+        order = order[np.argpartition(distances[order], limit - 1)[:limit]]
+    order = order[np.argsort(distances[order], kind='stable')]
+    return order, distances[order]
+
+
+def bounding_box(lat: float, lon: float, radius: float) -> tuple[float, float, float, float]:
+    """Прямоугольник (min_lat, max_lat, min_lon, max_lon), описанный вокруг круга радиуса radius метров."""
+    dlat = radius / METERS_PER_DEGREE
+    dlon = radius / (METERS_PER_DEGREE * max(cos(radians(lat)), 1e-6))
+    return lat - dlat, lat + dlat, lon - dlon, lon + dlon
+
+
+def lon_ranges(min_lon: float, max_lon: float) -> list[tuple[float, float]]:
+    """Диапазоны долгот в пределах [-180, 180], которые покрывают [min_lon, max_lon].
+
+    Прямоугольник, заходящий за ±180° (круг у линии перемены дат), делится на два."""
+    if max_lon - min_lon >= 360:
+        return [(-180.0, 180.0)]
+    if min_lon < -180:
+        return [(min_lon + 360, 180.0), (-180.0, max_lon)]
+    if max_lon > 180:
+        return [(min_lon, 180.0), (-180.0, max_lon - 360)]
+    return [(min_lon, max_lon)]
@@ -1,4 +1,4 @@
-from sqlalchemy import Integer, String, Boolean, Column
+from sqlalchemy import Integer, String, Boolean, Float, DateTime, Column, Index, Table, MetaData, DDL, event, text
 from src.database import BaseDBModel
 
 class tableUser(BaseDBModel):
@@ -9,35 +9,95 @@ class tableUser(BaseDBModel):
     password = Column(String, unique=False, index=False)
     is_admin = Column(Boolean, unique=False, index=False, default=False)
     is_deleted = Column(Boolean, unique=False, index=False, default=False)
-    accessToken = Column(String, unique=False, index=False)
+    accessToken = Column(String, unique=False, index=True)
 
 class DogsUser(BaseDBModel):
     __tablename__ = "dogsUsers"
+    __table_args__ = (
+        # Дельта-синхронизация /dogs/coordinates: собаки места, изменившиеся после курсора
+        Index("ix_dogsUsers_place_change_seq", "place", "change_seq"),
+    )
 
     dogid = Column(Integer, primary_key=True)
     characteristic = Column(String, unique=False, index=False)
     coordinates = Column(String, unique=False, index=False)
-    last_send = Column(String, unique=False, index=False)
+    lat = Column(Float, unique=False, index=False)
+    lon = Column(Float, unique=False, index=False)
+    # Время последних координат. SQLite хранит его строкой ISO, которая
+    # сравнивается как время, поэтому индекс отвечает на запросы диапазона
+    last_send = Column(DateTime, unique=False, index=True)
     place = Column(String, unique=False, index=True)
     is_deleted = Column(Boolean, default=True)
-    accessToken = Column(String, unique=False, index=False)
+    accessToken = Column(String, unique=False, index=True)
     photo = Column(String, unique=False, index=False)
     name = Column(String, unique=False, index=False)
+    # Номер последнего изменения координат или статуса собаки (см. ChangeSeq)
+    change_seq = Column(Integer, unique=False, index=False, default=0)
+
+class ChangeSeq(BaseDBModel):
+    __tablename__ = "changeSeq"
+    # Монотонный счётчик изменений: каждая пишущая транзакция по собакам
+    # увеличивает его на единицу и помечает изменённые строки новым значением.
+    # Писатели в SQLite идут по одному, поэтому номера видны клиентам по порядку.
+
+    name = Column(String, primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
+event.listen(
+    ChangeSeq.__table__, "after_create",
+    DDL('INSERT INTO "changeSeq" (name, value) VALUES (\'dogs\', 0)'),
+)
 
 class Tasks(BaseDBModel):
     __tablename__ = "tasks"
+    __table_args__ = (
+        # Частичный индекс только по открытым заданиям для /dogs/task/list
+        Index("ix_tasks_open", "dog_id", "id", sqlite_where=text("done = 0")),
+    )
 
     id = Column(Integer, primary_key=True)
-    upload_user_id = Column(Integer)
-    dog_id = Column(Integer)
+    upload_user_id = Column(Integer, index=True)
+    dog_id = Column(Integer, index=True)
     goal = Column(String, unique=False, index=False)
     done = Column(Boolean, default=True)
 
 class Responses(BaseDBModel):
     __tablename__ = "responses"
+    __table_args__ = (
+        Index("ix_responses_task_id_do_user_id", "task_id", "do_user_id"),
+    )
 
     id = Column(Integer, primary_key=True)
-    do_user_id = Column(Integer)
-    task_id = Column(Integer)
+    do_user_id = Column(Integer, index=True)
+    task_id = Column(Integer, index=True)
     comment = Column(String, unique=False, index=False)
-    photo = Column(String, unique=False, index=False)
\ No newline at end of file
+    photo = Column(String, unique=False, index=False)
+
+class DogsTrack(BaseDBModel):
+    __tablename__ = "dogsTrack"
+    # История координат только дописывается. Таблица без rowid хранится прямо
+    # в B-дереве первичного ключа (dogid, ts), поэтому выборка трека собаки за
+    # промежуток времени читает подряд идущие строки без обращения к другим таблицам.
+    __table_args__ = {"sqlite_with_rowid": False}
+
+    dogid = Column(Integer, primary_key=True, autoincrement=False)
+    ts = Column(Integer, primary_key=True, autoincrement=False)
+    lat = Column(Float, unique=False, index=False)
+    lon = Column(Float, unique=False, index=False)
+
+# Пространственный индекс текущих координат собак (модуль R*Tree в SQLite).
+# Виртуальную таблицу create_all создать не умеет, поэтому она описана вне
+# метаданных моделей и создаётся отдельной командой сразу после create_all.
+dogs_rtree = Table(
+    "dogsRtree", MetaData(),
+    Column("dogid", Integer, primary_key=True),
+    Column("min_lat", Float),
+    Column("max_lat", Float),
+    Column("min_lon", Float),
+    Column("max_lon", Float),
+)
+
+event.listen(
+    BaseDBModel.metadata, "after_create",
+    DDL('CREATE VIRTUAL TABLE IF NOT EXISTS "dogsRtree" USING rtree(dogid, min_lat, max_lat, min_lon, max_lon)').execute_if(dialect="sqlite"),
+)
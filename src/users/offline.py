@@ -0,0 +1,94 @@
+"""Поиск ошейников, от которых давно нет координат.
+
+Список молчащих ошейников обновляется по частям: при каждой проверке
+читаются только собаки, у которых last_send попал между прошлой и текущей
+границей (замолчали с прошлой проверки), и перепроверяются уже известные
+молчащие (вдруг снова вышли на связь). Оба запроса идут по индексу, поэтому
+проверка стоит O(молчащих), а не O(всех ошейников). Раз в OFFLINE_RESYNC
+секунд список перечитывается целиком, чтобы подхватить восстановленных собак.
+"""
+import asyncio
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+
+from src import config, metrics
+from src.database import DBSession
+from src.logger import get_logger
+from src.users import models
+
+logger = get_logger("user_router_logger")
+
+# Ограничение SQLite на число параметров в одном запросе
+IN_CHUNK = 5000
+
+
+class OfflineMonitor:
+    def __init__(self):
+        self.offline = {}
+        self.threshold: Optional[datetime] = None
+        self.checked_at: Optional[datetime] = None
+        self.resynced_at: Optional[datetime] = None
+        self._lock = Lock()
+
+    def refresh(self, db: Session, now: Optional[datetime] = None) -> list[int]:
+        """Обновляет список молчащих ошейников и возвращает тех, кто замолчал с прошлой проверки."""
+        now = now or datetime.now()
+        threshold = now - timedelta(seconds=config.OFFLINE_AFTER)
+        with self._lock:
+            query = db.query(models.DogsUser.dogid, models.DogsUser.last_send, models.DogsUser.place).filter(
+                models.DogsUser.last_send <= threshold, models.DogsUser.is_deleted == False
+            )
+            full = self.threshold is None or now - self.resynced_at >= timedelta(seconds=config.OFFLINE_RESYNC)
+            if full:
+                offline = {u[0]: (u[1], u[2]) for u in query.all()}
+                self.resynced_at = now
+            else:
+                offline = {}
+                known = list(self.offline)
+                for i in range(0, len(known), IN_CHUNK):
+                    for u in query.filter(models.DogsUser.dogid.in_(known[i:i + IN_CHUNK])).all():
+                        offline[u[0]] = (u[1], u[2])
+                for u in query.filter(models.DogsUser.last_send > self.threshold).all():
+                    offline[u[0]] = (u[1], u[2])
+
+            silenced = [dogid for dogid in offline if dogid not in self.offline]
+            self.offline = offline
+            self.threshold = threshold
+            self.checked_at = now
+        metrics.OFFLINE_COLLARS.set(len(offline))
+        return silenced
+
+    def refresh_if_due(self, db: Session) -> list[int]:
+        if self.checked_at is None or datetime.now() - self.checked_at >= timedelta(seconds=config.OFFLINE_CHECK_INTERVAL):
+            return self.refresh(db)
+        return []
+
+    def snapshot(self, limit: int) -> list:
+        now = datetime.now()
+        items = sorted(self.offline.items(), key=lambda item: item[1][0])[:limit]
+        return [{"dogid": str(dogid), "place": place, "last_send": str(last_send),
+                 "silent_for": int((now - last_send).total_seconds())} for dogid, (last_send, place) in items]
+
+
+monitor = OfflineMonitor()
+
+
+def check():
+    with DBSession() as db:
+        silenced = monitor.refresh(db)
+    for dogid in silenced:
+        logger.warning(f"Ошейник {dogid} не присылает координаты дольше {int(config.OFFLINE_AFTER)} с.")
+
+
+async def run():
+    """Фоновая проверка молчащих ошейников, запускается в lifespan приложения."""
+    while True:
+        try:
+            await run_in_threadpool(check)
+        except Exception:
+            logger.exception("Не удалось проверить молчащие ошейники.")
+        await asyncio.sleep(config.OFFLINE_CHECK_INTERVAL)
@@ -0,0 +1,64 @@
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Optional
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from src import config
+
+_executor: Optional[Executor] = None
+
+
+def get_executor() -> Executor:
+    """Отдельный ограниченный пул для хэширования, чтобы всплеск входов не
+    занимал потоки, в которых обрабатываются остальные запросы."""
+    global _executor
+    if _executor is None:
+        if config.PASSWORD_HASH_EXECUTOR == "process":
+            _executor = ProcessPoolExecutor(max_workers=config.PASSWORD_HASH_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=config.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+    return _executor
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+@lru_cache(maxsize=None)
+def hash_prefix(method: str) -> str:
+    # werkzeug дописывает в хэш параметры по умолчанию ("scrypt" -> "scrypt:32768:8:1"),
+    # поэтому сравнивать нужно с тем, что он реально запишет
+    return generate_password_hash("", method=method).split("$", 1)[0]
+
+
+def needs_rehash(hashed: str, method: str) -> bool:
+    return hashed.split("$", 1)[0] != hash_prefix(method)
+
+
+def _hash(password: str, method: str) -> str:
+    return generate_password_hash(password, method=method)
+
+
+def _verify(hashed: str, password: str, method: str) -> tuple[bool, Optional[str]]:
+    if not check_password_hash(hashed, password):
+        return False, None
+    if needs_rehash(hashed, method):
+        return True, _hash(password, method)
+    return True, None
+
+
+async def hash_password(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), _hash, password, config.PASSWORD_HASH_METHOD)
+
+
+async def verify_password(hashed: str, password: str) -> tuple[bool, Optional[str]]:
+    """Проверяет пароль. Если хэш сделан с другими параметрами, вторым
+    значением возвращает новый хэш, который нужно сохранить."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), _verify, hashed, password, config.PASSWORD_HASH_METHOD)
@@ -1,4 +1,5 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, model_validator
+from typing import List, Optional
 
 class UserBase(BaseModel):
     login: str
@@ -44,12 +45,15 @@ class CreateTask(BaseModel):
 class GetTasksResponse(BaseModel):
     success: bool
     tasks: object
+    next_cursor: Optional[int] = None
     class Config:
         orm_model = True
 
 class GetTasks(BaseModel):
     accessToken: str
     dog_id: int
+    after_task_id: Optional[int] = None
+    limit: int = Field(default=100, ge=1, le=1000)
 
 class TakeTaskResponse(BaseModel):
     success: bool
@@ -66,9 +70,16 @@ class giveResponse(BaseModel):
     comment: str
     photo: str
 
+class GetResponses(BaseModel):
+    accessToken: str
+    task_id: int
+    after_response_id: Optional[int] = None
+    limit: int = Field(default=100, ge=1, le=1000)
+
 class GetResponsesResponse(BaseModel):
     success: bool
     responses: object
+    next_cursor: Optional[int] = None
     class Config:
         orm_model = True
 
@@ -80,8 +91,70 @@ class ConfirmTask(BaseModel):
 class Coordinates(BaseModel):
     accessToken: str
     place: str
+    since: Optional[int] = Field(default=None, ge=0)
 
 class CoordinatesResponse(BaseModel):
+    success: bool
+    dogs: object
+    deleted: List[str] = []
+    cursor: int = 0
+    class Config:
+        orm_model = True
+
+class NearbyDogs(BaseModel):
+    accessToken: str
+    lat: Optional[float] = Field(default=None, ge=-90, le=90)
+    lon: Optional[float] = Field(default=None, ge=-180, le=180)
+    radius: Optional[float] = Field(default=None, gt=0, le=50000)
+    min_lat: Optional[float] = Field(default=None, ge=-90, le=90)
+    max_lat: Optional[float] = Field(default=None, ge=-90, le=90)
+    min_lon: Optional[float] = Field(default=None, ge=-180, le=180)
+    max_lon: Optional[float] = Field(default=None, ge=-180, le=180)
+    limit: int = Field(default=500, ge=1, le=5000)
+
+    @model_validator(mode='after')
+    def check_area(self):
+        circle = None not in (self.lat, self.lon, self.radius)
+        box = None not in (self.min_lat, self.max_lat, self.min_lon, self.max_lon)
+        if circle == box:
+            raise ValueError("Нужно передать либо lat, lon и radius, либо min_lat, max_lat, min_lon и max_lon")
+        return self
+
+class NearbyDogsResponse(BaseModel):
+    success: bool
+    dogs: object
+    class Config:
+        orm_model = True
+
+class DogsStream(BaseModel):
+    accessToken: str
+    place: Optional[str] = None
+    min_lat: Optional[float] = Field(default=None, ge=-90, le=90)
+    max_lat: Optional[float] = Field(default=None, ge=-90, le=90)
+    min_lon: Optional[float] = Field(default=None, ge=-180, le=180)
+    max_lon: Optional[float] = Field(default=None, ge=-180, le=180)
+
+    @model_validator(mode='after')
+    def check_area(self):
+        box = None not in (self.min_lat, self.max_lat, self.min_lon, self.max_lon)
+        if (self.place is not None) == box:
+            raise ValueError("Нужно передать либо place, либо min_lat, max_lat, min_lon и max_lon")
+        return self
+
+    @property
+    def box(self) -> Optional[tuple]:
+        if self.place is not None:
+            return None
+        return (self.min_lat, self.max_lat, self.min_lon, self.max_lon)
+
+class NearestDogs(BaseModel):
+    accessToken: str
+    place: str
+    lat: float = Field(ge=-90, le=90)
+    lon: float = Field(ge=-180, le=180)
+    limit: int = Field(default=50, ge=1, le=5000)
+
+class NearestDogsResponse(BaseModel):
     success: bool
     dogs: object
     class Config:
@@ -101,12 +174,58 @@ class DogsUpdate(BaseModel):
     accessDogToken: str
     dogid: int
     coordinates: str
+    lat: float = Field(ge=-90, le=90)
+    lon: float = Field(ge=-180, le=180)
+
+    @model_validator(mode='before')
+    @classmethod
+    def parse_coordinates(cls, data):
+        # Строка "широта, долгота" разбирается один раз при приёме,
+        # дальше сервер работает только с числами lat/lon
+        if not isinstance(data, dict):
+            return data
+        if isinstance(data.get('coordinates'), str):
+            parts = data['coordinates'].split(',')
+            if len(parts) != 2:
+                raise ValueError("Координаты должны иметь вид \"широта, долгота\"")
+            return {**data, 'lat': parts[0].strip(), 'lon': parts[1].strip()}
+        if 'coordinates' not in data and 'lat' in data and 'lon' in data:
+            return {**data, 'coordinates': f"{data['lat']}, {data['lon']}"}
+        return data
 
 class DogsUpdateResponse(BaseModel):
     success: bool
     class Config:
         orm_model = True
 
+class DogsUpdateBatch(BaseModel):
+    fixes: List[DogsUpdate] = Field(min_length=1, max_length=1000)
+
+class DogsUpdateBatchItem(BaseModel):
+    dogid: int
+    success: bool
+    detail: Optional[str] = None
+
+class DogsUpdateBatchResponse(BaseModel):
+    success: bool
+    results: List[DogsUpdateBatchItem]
+
+class DogTrack(BaseModel):
+    accessToken: str
+    dog_id: int
+    ts_from: int
+    ts_to: int
+    limit: int = Field(default=1000, ge=1, le=10000)
+
+class DogTrackPoint(BaseModel):
+    ts: int
+    lat: float
+    lon: float
+
+class DogTrackResponse(BaseModel):
+    success: bool
+    track: List[DogTrackPoint]
+
 class DogChangeStatus(BaseModel):
     accessToken: str
     dogid: int
@@ -123,6 +242,29 @@ class UserChangeStatus(BaseModel):
 class UserChangeStatusResponse(BaseModel):
     success: bool
 
+class DogsOffline(BaseModel):
+    accessToken: str
+    limit: int = Field(default=1000, ge=1, le=10000)
+
+class DogsOfflineResponse(BaseModel):
+    success: bool
+    dogs: object
+    total: int
+    checked_at: Optional[str] = None
+    class Config:
+        orm_model = True
+
+class DogsStationary(BaseModel):
+    accessToken: str
+    limit: int = Field(default=1000, ge=1, le=10000)
+
+class DogsStationaryResponse(BaseModel):
+    success: bool
+    dogs: object
+    total: int
+    class Config:
+        orm_model = True
+
 class DogInfo(BaseModel):
     accessToken: str
     dog_id: int
@@ -0,0 +1,75 @@
+"""Поиск собак, которые долго не двигаются с места.
+
+Долгая стоянка может означать, что собака ранена или ошейник потерян.
+Для каждой собаки хранится только якорь — точка и время, с которых она
+находится в пределах STATIONARY_RADIUS метров. Каждая принятая координата
+сравнивается с якорем: вышла за радиус — якорь переносится в новую точку,
+осталась внутри дольше STATIONARY_AFTER секунд — собака попадает в список
+тревог. Проверка одной координаты стоит O(1) по времени и памяти, история
+координат не перечитывается.
+
+Якоря живут в памяти процесса: после перезапуска отсчёт стоянки начинается
+заново с первой координаты.
+"""
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import Iterable, Optional
+
+from src import config, metrics
+from src.logger import get_logger
+from src.users.geo import haversine
+
+logger = get_logger("user_router_logger")
+
+
+class StationaryDetector:
+    def __init__(self):
+        # dogid -> (lat, lon, с какого времени собака в радиусе)
+        self.anchors = {}
+        # dogid -> (lat, lon, с какого времени стоит, когда обнаружено)
+        self.alerts = {}
+        self._lock = Lock()
+
+    def observe(self, fixes: Iterable, now: Optional[datetime] = None) -> list[int]:
+        """Учитывает принятые координаты и возвращает собак, которые только что попали в список тревог."""
+        now = now or datetime.now()
+        radius = config.STATIONARY_RADIUS
+        after = timedelta(seconds=config.STATIONARY_AFTER)
+        flagged = []
+        with self._lock:
+            for fix in fixes:
+                anchor = self.anchors.get(fix.dogid)
+                if anchor is None or haversine(anchor[0], anchor[1], fix.lat, fix.lon) > radius:
+                    self.anchors[fix.dogid] = (fix.lat, fix.lon, now)
+                    self.alerts.pop(fix.dogid, None)
+                elif fix.dogid not in self.alerts and now - anchor[2] >= after:
+                    self.alerts[fix.dogid] = (anchor[0], anchor[1], anchor[2], now)
+                    flagged.append(fix.dogid)
+            total = len(self.alerts)
+        metrics.STATIONARY_COLLARS.set(total)
+        return flagged
+
+    def forget(self, dogid: int):
+        with self._lock:
+            self.anchors.pop(dogid, None)
+            self.alerts.pop(dogid, None)
+            total = len(self.alerts)
+        metrics.STATIONARY_COLLARS.set(total)
+
+    def snapshot(self, limit: int) -> list:
+        now = datetime.now()
+        with self._lock:
+            items = sorted(self.alerts.items(), key=lambda item: item[1][2])[:limit]
+        return [{"dogid": str(dogid), "lat": lat, "lon": lon, "since": str(since), "detected_at": str(detected_at),
+                 "stationary_for": int((now - since).total_seconds())}
+                for dogid, (lat, lon, since, detected_at) in items]
+
+
+detector = StationaryDetector()
+
+
+def observe(fixes: Iterable):
+    """Проверка принятых координат в обработчиках /dogs/update."""
+    for dogid in detector.observe(fixes):
+        logger.warning(
+            f"Собака {dogid} не сдвигается дальше {config.STATIONARY_RADIUS:g} м дольше {int(config.STATIONARY_AFTER)} с.")
@@ -0,0 +1,97 @@
+"""Рассылка изменившихся координат собак подписчикам /dogs/stream.
+
+Подписка живёт в цикле событий того соединения, которое её создало.
+Координаты публикуются из пула потоков (синхронные обработчики /dogs/update),
+поэтому доставка передаётся в цикл подписчика через call_soon_threadsafe.
+Пока подписчик не забрал пачку, новые координаты той же собаки заменяют
+старые: медленный клиент получает последнее положение, а очередь не растёт
+больше числа собак в его области.
+"""
+import asyncio
+from threading import Lock
+from typing import Iterable, Optional
+
+from sqlalchemy.orm import Session
+
+from src import metrics
+from src.users import crud
+
+
+class Subscription:
+    def __init__(self, loop: asyncio.AbstractEventLoop, place: Optional[str] = None, box: Optional[tuple] = None):
+        self.loop = loop
+        self.place = place
+        self.box = box
+        self.pending = {}
+        self.ready = asyncio.Event()
+
+    def matches(self, position: dict) -> bool:
+        if self.place is not None:
+            return position["place"] == self.place
+        min_lat, max_lat, min_lon, max_lon = self.box
+        return min_lat <= position["lat"] <= max_lat and min_lon <= position["lon"] <= max_lon
+
+    def deliver(self, positions: list):
+        # Выполняется в цикле событий подписчика
+        for position in positions:
+            self.pending[position["dogid"]] = position
+        self.ready.set()
+
+    async def next_batch(self) -> list:
+        await self.ready.wait()
+        self.ready.clear()
+        batch, self.pending = list(self.pending.values()), {}
+        return batch
+
+
+class Hub:
+    def __init__(self):
+        self._subscriptions = set()
+        self._lock = Lock()
+
+    @property
+    def active(self) -> bool:
+        return bool(self._subscriptions)
+
+    def subscribe(self, place: Optional[str] = None, box: Optional[tuple] = None) -> Subscription:
+        subscription = Subscription(asyncio.get_running_loop(), place, box)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        metrics.STREAM_SUBSCRIBERS.inc()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            if subscription not in self._subscriptions:
+                return
+            self._subscriptions.discard(subscription)
+        metrics.STREAM_SUBSCRIBERS.dec()
+
+    def publish(self, positions: list):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            matched = [{key: position[key] for key in ("dogid", "coordinates", "lat", "lon")}
+                       for position in positions if subscription.matches(position)]
+            if not matched:
+                continue
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, matched)
+            except RuntimeError:
+                # Цикл подписчика уже закрыт
+                self.unsubscribe(subscription)
+
+
+hub = Hub()
+
+
+def publish_fixes(db: Session, fixes: Iterable):
+    """Отправляет подписчикам принятые координаты собак, которые не удалены."""
+    if not hub.active:
+        return
+    fixes = list(fixes)
+    places = crud.get_dogsuser_places(db, [fix.dogid for fix in fixes])
+    hub.publish([
+        {"dogid": str(fix.dogid), "coordinates": fix.coordinates, "lat": fix.lat, "lon": fix.lon, "place": places[fix.dogid]}
+        for fix in fixes if fix.dogid in places
+    ])
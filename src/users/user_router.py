@@ -1,44 +1,32 @@
-from fastapi import APIRouter, Depends
+import asyncio
+from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect, status
+from pydantic import ValidationError
+from fastapi.concurrency import run_in_threadpool
 from src.database import DBSession
 import src.users.schemas as schemas
 import src.users.crud as crud
-from src.dependecies import get_db_session
+from src.dependecies import get_db_session, CurrentUser, CurrentAdmin, CurrentCollar
 import src.users.exceptions as exceptions
-import logging
-import sys
+import src.users.passwords as passwords
+from src.users import stationary, stream, writebehind
+from src.users.offline import monitor as offline_monitor
+from src.logger import get_logger
+from src import config, request_context
+from src.profiler import ProfiledRoute
 
-router = APIRouter()
-
-from logging.handlers import TimedRotatingFileHandler
-
-FORMATTER_STRING = "%(asctime)s — %(name)s — %(levelname)s — %(message)s"
-FORMATTER = logging.Formatter(FORMATTER_STRING)
-LOG_FILE = "./src/tmp/user_router.log"
-
-def get_logger(logger_name):
-    logger = logging.getLogger(logger_name)
-    logger.setLevel(logging.INFO)
-
-    console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setFormatter(FORMATTER)
-    logger.addHandler(console_handler)
-
-    file_handler = TimedRotatingFileHandler(LOG_FILE, when='midnight')
-    file_handler.setFormatter(FORMATTER)
-    logger.addHandler(file_handler)
-
-    return logger
+router = APIRouter(route_class=ProfiledRoute)
 
 logger = get_logger("user_router_logger")
 
 
 @router.post("/user/register", response_model=schemas.UserResponse)
 async def register_user(user: schemas.UserCreate, db: DBSession = Depends(get_db_session)):
-    if crud.get_user_by_login(db, user.login):
+    if await run_in_threadpool(crud.get_user_by_login, db, user.login):
         logger.warning(f"POST /user/register — Пользователь {user.login} уже зарегистрирован.")
         raise exceptions.LoginTaken()
 
-    db_user = crud.create_user(db, user)
+    hashedPassword = await passwords.hash_password(user.password)
+    db_user = await run_in_threadpool(crud.create_user, db, user, hashedPassword)
     response = schemas.UserResponse(success=True, accessToken=db_user.accessToken)
 
     logger.info(f"POST /user/register — Пользователь {user.login} зарегистрирован.")    
@@ -46,25 +34,23 @@ async def register_user(user: schemas.UserCreate, db: DBSession = Depends(get_db
 
 @router.post("/user/login", response_model=schemas.UserResponse)
 async def login_user(user: schemas.UserLogin, db: DBSession = Depends(get_db_session)):
-    db_user = crud.checkPassword(db, user.login,user.password)
-    if not(db_user):
+    db_user = await run_in_threadpool(crud.get_user_by_login, db, user.login)
+    correct, rehashedPassword = await passwords.verify_password(db_user.password, user.password) if db_user else (False, None)
+    if not(correct):
         logger.warning(f"POST /user/login — Пользователь {user.login} ввел неверный пароль.")
         raise exceptions.IncorrectPassword()
-    if (crud.get_user_by_Deleted(db, user.login)):
+    request_context.set_principal(db_user.id)
+    banned = db_user.is_deleted
+    accessToken = await run_in_threadpool(crud.checkPassword, db, db_user, rehashedPassword)
+    if (banned):
         logger.warning(f"POST /user/login — Забаненный пользователь {user.login} пытался войти.")
         raise exceptions.UserBanned()
 
     logger.info(f"POST /user/login — Пользователь {user.login} вошел в аккаунт.")
-    return schemas.UserResponse(success=True, accessToken=db_user.accessToken)
+    return schemas.UserResponse(success=True, accessToken=accessToken)
 
 @router.post("/dogs/register", response_model=schemas.DogsUser)
-async def create_dogsuser(user: schemas.DogsUserBase, db: DBSession = Depends(get_db_session)):
-    if not(crud.get_user_by_Token(db, user.accessToken)):
-        logger.warning(f"POST /dogs/register — Собаку {user.accessToken[0:5]} пытался зарегистрировать несуществующий пользователь")
-        raise exceptions.TokenNotTaken()
-    if not(crud.get_user_by_Admin(db, user.accessToken)):
-        logger.warning(f"POST /dogs/register — Собаку {user.accessToken[0:5]} пытался зарегистрировать не админ.")
-        raise exceptions.AdminNotTaken()
+def create_dogsuser(user: schemas.DogsUserBase, userByToken: CurrentAdmin, db: DBSession = Depends(get_db_session)):
     db_user = crud.create_dogsuser(db, user)
 
     response = schemas.DogsUser(success=True, dogid=db_user.dogid, accessDogToken=db_user.accessToken)
@@ -72,15 +58,12 @@ async def create_dogsuser(user: schemas.DogsUserBase, db: DBSession = Depends(ge
     return response
 
 @router.post("/dogs/task/create", response_model=schemas.CreateTaskResponse)
-async def create_task(task: schemas.CreateTask, db: DBSession = Depends(get_db_session)):
-    if not(crud.get_user_by_Token(db, task.accessToken)):
-        logger.warning(f"POST /dogs/task/create — Задание {task.goal[0:6]}... пытался зарегистрировать несуществующий пользователь.")
-        raise exceptions.TokenNotTaken()
+def create_task(task: schemas.CreateTask, userByToken: CurrentUser, db: DBSession = Depends(get_db_session)):
     if not(crud.get_user_by_DogId(db, task.dog_id)):
         logger.warning(
             f"POST /dogs/task/create — Задание {task.goal[0:6]}... пытались зарегистрировать на несуществующую собаку.")
         raise exceptions.DogNotTaken()
-    db_user = crud.create_task(db, task)
+    db_user = crud.create_task(db, task, userByToken.id)
 
     response = schemas.CreateTaskResponse(success=True, task_id=db_user.id)
     logger.info(
@@ -88,176 +71,252 @@ async def create_task(task: schemas.CreateTask, db: DBSession = Depends(get_db_s
     return response
 
 @router.post("/dogs/task/list", response_model=schemas.GetTasksResponse)
-async def get_all_task(task: schemas.GetTasks, db: DBSession = Depends(get_db_session)):
-    if not(crud.get_user_by_Token(db, task.accessToken)):
-        logger.warning(
-            f"POST /dogs/task/list — Список заданий пытался получить несуществующий пользователь.")
-        raise exceptions.TokenNotTaken()
+def get_all_task(task: schemas.GetTasks, userByToken: CurrentUser, db: DBSession = Depends(get_db_session)):
     if not(crud.get_user_by_DogId(db, task.dog_id)):
         logger.warning(
             f"POST /dogs/task/list — Список заданий пытались получить на несуществующую собаку.")
         raise exceptions.DogNotTaken()
 
-    db_user = crud.get_tasks(db, task.dog_id)
+    db_user, next_cursor = crud.get_tasks(db, task)
 
-    response = schemas.GetTasksResponse(success=True, tasks=db_user)
+    response = schemas.GetTasksResponse(success=True, tasks=db_user, next_cursor=next_cursor)
     logger.info(
         f"POST /dogs/task/list — Список заданий успешно получен.")
     return response
 
 @router.post("/dogs/task/take", response_model=schemas.TakeTaskResponse)
-async def take_task(task: schemas.TakeTask, db: DBSession = Depends(get_db_session)):
-    user = crud.get_user_by_Token(db, task.accessToken)
-    if not(user):
-        logger.warning(
-            f"POST /dogs/task/take — Взять задание {task.task_id} пытался несуществующий пользователь.")
-        raise exceptions.TokenNotTaken()
+def take_task(task: schemas.TakeTask, userByToken: CurrentUser, db: DBSession = Depends(get_db_session)):
     if not(crud.get_task_by_Id(db, task.task_id)):
         logger.warning(
-            f"POST /dogs/task/take — Пользователь {user.login} пытался взять несуществующее задание.")
+            f"POST /dogs/task/take — Пользователь {userByToken.login} пытался взять несуществующее задание.")
         raise exceptions.TaskNotTaken()
-    if crud.get_taken_task(db, user.id, task.task_id):
+    if crud.get_taken_task(db, userByToken.id, task.task_id):
         logger.warning(
-            f"POST /dogs/task/take — Пользователь {user.login} пытался повторно взять задание.")
+            f"POST /dogs/task/take — Пользователь {userByToken.login} пытался повторно взять задание.")
         raise exceptions.TaskAlreadyTaken()
 
-    crud.take_task(db, task)
+    crud.take_task(db, task, userByToken.id)
 
     response = schemas.TakeTaskResponse(success=True)
     logger.info(
-        f"POST /dogs/task/take — Пользователь {user.login} успешно взял задание {task.task_id}.")
+        f"POST /dogs/task/take — Пользователь {userByToken.login} успешно взял задание {task.task_id}.")
     return response
 
 @router.post("/dogs/task/response/give", response_model=schemas.TakeTaskResponse)
-async def give_response_task(task: schemas.giveResponse, db: DBSession = Depends(get_db_session)):
-    user = crud.get_user_by_Token(db, task.accessToken)
-    if not(user):
-        logger.warning(
-            f"POST /dogs/task/response/give — Отправить отклик к заданию {task.task_id} пытался несуществующий пользователь.")
-        raise exceptions.TokenNotTaken()
+def give_response_task(task: schemas.giveResponse, userByToken: CurrentUser, db: DBSession = Depends(get_db_session)):
     if not(crud.get_task_by_Id(db, task.task_id)):
         logger.warning(
-            f"POST /dogs/task/response/give — Пользователь {user.login} пытался отправить отклик к несуществующему заданию.")
+            f"POST /dogs/task/response/give — Пользователь {userByToken.login} пытался отправить отклик к несуществующему заданию.")
         raise exceptions.TaskNotTaken()
-    if not(crud.get_taken_task(db, user.id, task.task_id)):
+    if not(crud.get_taken_task(db, userByToken.id, task.task_id)):
         logger.warning(
-            f"POST /dogs/task/response/give — Пользователь {user.login} пытался отправить отклик к заданию, которое не брал.")
+            f"POST /dogs/task/response/give — Пользователь {userByToken.login} пытался отправить отклик к заданию, которое не брал.")
         raise exceptions.UserNotTakenTask()
 
-    crud.give_response(db, user.id, task)
+    crud.give_response(db, userByToken.id, task)
 
     response = schemas.TakeTaskResponse(success=True)
     logger.info(
-        f"POST /dogs/task/response/give — Пользователь {user.login} успешно отправил отклик к заданию {task.task_id}.")
+        f"POST /dogs/task/response/give — Пользователь {userByToken.login} успешно отправил отклик к заданию {task.task_id}.")
     return response
 
 @router.post("/dogs/task/response/list", response_model=schemas.GetResponsesResponse)
-async def get_responses(task: schemas.TakeTask, db: DBSession = Depends(get_db_session)):
-    user = crud.get_user_by_Token(db, task.accessToken)
-    if not(user):
-        logger.warning(
-            f"POST /dogs/task/response/list — Получить отклики к заданию {task.task_id} пытался несуществующий пользователь.")
-        raise exceptions.TokenNotTaken()
-    if not(crud.get_task_by_Id(db, task.task_id)):
+def get_responses(task: schemas.GetResponses, userByToken: CurrentUser, db: DBSession = Depends(get_db_session)):
+    db_task = crud.get_task_by_Id(db, task.task_id)
+    if not(db_task):
         logger.warning(
-            f"POST /dogs/task/response/list — Пользователь {user.login} пытался получить отклики к несуществующему заданию.")
+            f"POST /dogs/task/response/list — Пользователь {userByToken.login} пытался получить отклики к несуществующему заданию.")
         raise exceptions.TaskNotTaken()
-    if not(crud.is_creator_task(db, user.id, task.task_id)):
+    if db_task.upload_user_id != userByToken.id:
         logger.warning(
-            f"POST /dogs/task/response/list — Пользователь {user.login} пытался получить отклики к заданию {task.task_id}, не являясь создателем.")
+            f"POST /dogs/task/response/list — Пользователь {userByToken.login} пытался получить отклики к заданию {task.task_id}, не являясь создателем.")
         raise exceptions.CreatorNotTaken()
 
-    response = schemas.GetResponsesResponse(success=True, responses=crud.get_responses(db, task))
+    db_user, next_cursor = crud.get_responses(db, task)
+
+    response = schemas.GetResponsesResponse(success=True, responses=db_user, next_cursor=next_cursor)
     logger.info(
-        f"POST /dogs/task/response/list — Пользователь {user.login} успешно получил список откликов.")
+        f"POST /dogs/task/response/list — Пользователь {userByToken.login} успешно получил список откликов.")
     return response
 
 @router.post("/dogs/task/confirm", response_model=schemas.TakeTaskResponse)
-async def confirm_task(task: schemas.ConfirmTask, db: DBSession = Depends(get_db_session)):
-    user = crud.get_user_by_Token(db, task.accessToken)
-    if not(user):
+def confirm_task(task: schemas.ConfirmTask, userByToken: CurrentUser, db: DBSession = Depends(get_db_session)):
+    db_task = crud.get_task_by_Id(db, task.task_id)
+    if not(db_task):
         logger.warning(
-            f"POST /dogs/task/confirm — Изменить статус задания {task.task_id} пытался несуществующий пользователь.")
-        raise exceptions.TokenNotTaken()
-    if not(crud.get_task_by_Id(db, task.task_id)):
-        logger.warning(
-            f"POST /dogs/task/confirm — Пользователь {user.login} пытался изменить статус несуществующего задания.")
+            f"POST /dogs/task/confirm — Пользователь {userByToken.login} пытался изменить статус несуществующего задания.")
         raise exceptions.TaskNotTaken()
-    if not(crud.is_creator_task(db, user.id, task.task_id)):
+    if db_task.upload_user_id != userByToken.id:
         logger.warning(
-            f"POST /dogs/task/confirm — Пользователь {user.login} пытался изменить статус задания, не являясь создателем.")
+            f"POST /dogs/task/confirm — Пользователь {userByToken.login} пытался изменить статус задания, не являясь создателем.")
         raise exceptions.CreatorNotTaken()
 
-    crud.confirm_task(db, task.task_id)
+    crud.confirm_task(db, db_task)
 
     response = schemas.TakeTaskResponse(success=True)
     logger.info(
-        f"POST /dogs/task/confirm — Пользователь {user.login} успешно изменил статус задания.")
+        f"POST /dogs/task/confirm — Пользователь {userByToken.login} успешно изменил статус задания.")
     return response
 
 @router.post("/dogs/coordinates",response_model=schemas.CoordinatesResponse)
-async def Сoordinates(user: schemas.Coordinates, db: DBSession = Depends(get_db_session)):
-    userByToken = crud.get_user_by_Token(db, user.accessToken)
-    if not(userByToken):
-        logger.warning(
-            f"POST /dogs/coordinates — Получить координаты собак пытался несуществующий пользователь.")
-        raise exceptions.TokenNotTaken()
-    db_user = schemas.CoordinatesResponse(dogs=crud.get_dogsuser_place(db, user.place),success=True)
+def Сoordinates(user: schemas.Coordinates, userByToken: CurrentUser, db: DBSession = Depends(get_db_session)):
+    dogs, deleted, cursor = crud.get_dogsuser_place(db, user.place, user.since)
+    db_user = schemas.CoordinatesResponse(dogs=dogs, deleted=deleted, cursor=cursor, success=True)
 
     logger.info(
         f"POST /dogs/coordinates — Пользователь {userByToken.login} успешно получил координаты собак.")
     return db_user
 
-@router.post("/dogs/characteristic",response_model=schemas.CharacteristicResponse)
-async def Characteristic(user: schemas.Characteristic, db: DBSession = Depends(get_db_session)):
-    userByToken = crud.get_user_by_Token(db, user.accessToken)
+@router.post("/dogs/nearby",response_model=schemas.NearbyDogsResponse)
+def Nearby(user: schemas.NearbyDogs, userByToken: CurrentUser, db: DBSession = Depends(get_db_session)):
+    db_user = schemas.NearbyDogsResponse(dogs=crud.get_dogsuser_nearby(db, user), success=True)
+
+    logger.info(
+        f"POST /dogs/nearby — Пользователь {userByToken.login} успешно получил собак поблизости.")
+    return db_user
+
+@router.post("/dogs/nearest",response_model=schemas.NearestDogsResponse)
+def Nearest(user: schemas.NearestDogs, userByToken: CurrentUser, db: DBSession = Depends(get_db_session)):
+    db_user = schemas.NearestDogsResponse(dogs=crud.get_dogsuser_nearest(db, user), success=True)
+
+    logger.info(
+        f"POST /dogs/nearest — Пользователь {userByToken.login} успешно получил ближайших собак.")
+    return db_user
+
+def stream_subscriber(request: schemas.DogsStream):
+    with DBSession() as db:
+        return crud.get_user_by_Token(db, request.accessToken)
+
+def stream_snapshot(request: schemas.DogsStream) -> tuple[list, bool]:
+    with DBSession() as db:
+        return crud.get_dogsuser_area(db, request.place, request.box, config.STREAM_SNAPSHOT_LIMIT)
+
+@router.websocket("/dogs/stream")
+async def Stream(websocket: WebSocket):
+    # Сессия открывается только на время запросов: соединение может жить часами
+    await websocket.accept()
+    try:
+        request = schemas.DogsStream.model_validate(await websocket.receive_json())
+    except WebSocketDisconnect:
+        return
+    except (ValidationError, ValueError) as error:
+        await websocket.send_json({"success": False, "detail": str(error)})
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    userByToken = await run_in_threadpool(stream_subscriber, request)
     if not(userByToken):
-        logger.warning(
-            f"POST /dogs/characteristic — Получить характеристику собаки {user.dogid} пытался несуществующий пользователь.")
-        raise exceptions.TokenNotTaken()
-    if not(crud.get_user_by_DogId(db, user.dogid)):
+        logger.warning(f"WS /dogs/stream — Запрос от несуществующего пользователя.")
+        await websocket.send_json({"success": False, "detail": exceptions.TokenNotTaken().detail})
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    # Подписка оформляется до снимка, чтобы не потерять координаты, пришедшие между ними
+    subscription = stream.hub.subscribe(request.place, request.box)
+    logger.info(f"WS /dogs/stream — Пользователь {userByToken.login} подписался на координаты собак.")
+    try:
+        dogs, truncated = await run_in_threadpool(stream_snapshot, request)
+        if truncated:
+            logger.warning(
+                f"WS /dogs/stream — Снимок для {userByToken.login} обрезан до {config.STREAM_SNAPSHOT_LIMIT} собак.")
+        await websocket.send_json({"success": True, "dogs": dogs, "truncated": truncated})
+
+        async def send_updates():
+            while True:
+                await websocket.send_json({"success": True, "dogs": await subscription.next_batch()})
+
+        async def wait_disconnect():
+            while (await websocket.receive())["type"] != "websocket.disconnect":
+                pass
+
+        tasks = [asyncio.create_task(send_updates()), asyncio.create_task(wait_disconnect())]
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        stream.hub.unsubscribe(subscription)
+        logger.info(f"WS /dogs/stream — Пользователь {userByToken.login} отписался от координат собак.")
+
+@router.post("/dogs/characteristic",response_model=schemas.CharacteristicResponse)
+def Characteristic(user: schemas.Characteristic, userByToken: CurrentUser, db: DBSession = Depends(get_db_session)):
+    characteristic = crud.get_dogsuser_Characteristic(db, user.dogid)
+    if characteristic is None:
         logger.warning(
             f"POST /dogs/characteristic — Пользователь {userByToken.login} пытался получить характеристику несуществующей собаки.")
         raise exceptions.DogNotTaken()
-    db_user = schemas.CharacteristicResponse(success=True, charterictic=crud.get_dogsuser_Characteristic(db, user.dogid))
+    db_user = schemas.CharacteristicResponse(success=True, charterictic=characteristic)
 
     logger.info(
         f"POST /dogs/characteristic — Пользователь {userByToken.login} успешно получил характеристику собаки.")
     return db_user
 
-@router.post("/dogs/update", response_model=schemas.DogsUpdateResponse)
-async def Update(user: schemas.DogsUpdate, db: DBSession = Depends(get_db_session)):
-    if not(crud.get_user_by_DogToken(db, user.accessDogToken)):
+@router.post("/dogs/track", response_model=schemas.DogTrackResponse)
+def Track(user: schemas.DogTrack, userByToken: CurrentUser, db: DBSession = Depends(get_db_session)):
+    if not(crud.get_user_by_DogId(db, user.dog_id)):
         logger.warning(
-            f"POST /dogs/update — Отправить координаты пытался несуществующий ошейник.")
-        raise exceptions.DogTokenNotTaken()
-    if not(crud.get_user_by_DogId(db, user.dogid)):
+            f"POST /dogs/track — Пользователь {userByToken.login} пытался получить трек несуществующей собаки.")
+        raise exceptions.DogNotTaken()
+    db_user = schemas.DogTrackResponse(success=True, track=crud.get_dogsuser_track(db, user))
+
+    logger.info(
+        f"POST /dogs/track — Пользователь {userByToken.login} успешно получил трек собаки {user.dog_id}.")
+    return db_user
+
+@router.post("/dogs/update", response_model=schemas.DogsUpdateResponse)
+def Update(user: schemas.DogsUpdate, collar: CurrentCollar, db: DBSession = Depends(get_db_session)):
+    if collar.dogid != user.dogid:
         logger.warning(
             f"POST /dogs/update — Отправить координаты пытался несуществующий ошейник.")
         raise exceptions.DogNotTaken()
-    crud.get_dogsuser_update(db, user.dogid, user.coordinates)
+    writebehind.write(db, [user])
+    stream.publish_fixes(db, [user])
+    stationary.observe([user])
     db_user = schemas.DogsUpdateResponse(success=True)
 
     logger.info(
         f"POST /dogs/update — Ошейник {user.dogid} успешно отправила координаты.")
     return db_user
 
+@router.post("/dogs/update/batch", response_model=schemas.DogsUpdateBatchResponse)
+def UpdateBatch(batch: schemas.DogsUpdateBatch, db: DBSession = Depends(get_db_session)):
+    dogids = crud.get_dogids_by_DogTokens(db, (fix.accessDogToken for fix in batch.fixes))
+
+    results = []
+    accepted = []
+    for fix in batch.fixes:
+        dogid = dogids.get(fix.accessDogToken)
+        if dogid is None:
+            results.append(schemas.DogsUpdateBatchItem(dogid=fix.dogid, success=False, detail=exceptions.DogTokenNotTaken().detail))
+        elif dogid != fix.dogid:
+            results.append(schemas.DogsUpdateBatchItem(dogid=fix.dogid, success=False, detail=exceptions.DogNotTaken().detail))
+        else:
+            accepted.append(fix)
+            results.append(schemas.DogsUpdateBatchItem(dogid=fix.dogid, success=True))
+
+    if accepted:
+        writebehind.write(db, accepted)
+        stream.publish_fixes(db, accepted)
+        stationary.observe(accepted)
+    if len(accepted) != len(batch.fixes):
+        logger.warning(
+            f"POST /dogs/update/batch — Отклонено {len(batch.fixes) - len(accepted)} из {len(batch.fixes)} координат.")
+
+    logger.info(
+        f"POST /dogs/update/batch — Принято {len(accepted)} координат от ошейников.")
+    return schemas.DogsUpdateBatchResponse(success=True, results=results)
+
 @router.post("/dogs/changestatus", response_model = schemas.DogChangeStatusResponse)
-async def dog_change_status(user: schemas.DogChangeStatus, db: DBSession = Depends(get_db_session)):
-    userByToken = crud.get_user_by_Token(db, user.accessToken)
-    if not(userByToken):
-        logger.warning(
-            f"POST /dogs/changestatus — Статус собаки пытался изменить несуществующий пользователь.")
-        raise exceptions.TokenNotTaken()
-    if not(crud.get_user_by_Admin(db, user.accessToken)):
-        logger.warning(
-            f"POST /dogs/changestatus — Статус собаки пытался изменить пользователь {userByToken.login}, не являющийся админом.")
-        raise exceptions.AdminNotTaken()
+def dog_change_status(user: schemas.DogChangeStatus, userByToken: CurrentAdmin, db: DBSession = Depends(get_db_session)):
     if not(crud.get_user_by_DogId(db, user.dogid)):
         logger.warning(
             f"POST /dogs/changestatus — Пользователь {userByToken.login} пытался поменять статус несуществующей собаки.")
         raise exceptions.DogNotTaken()
     crud.dog_status_update(db, user.dogid, user.delete)
+    if user.delete:
+        stationary.detector.forget(user.dogid)
     db_user = schemas.DogChangeStatusResponse(success=True)
 
     logger.info(
@@ -265,18 +324,9 @@ async def dog_change_status(user: schemas.DogChangeStatus, db: DBSession = Depen
     return db_user
 
 @router.post("/user/changestatus", response_model = schemas.UserChangeStatusResponse)
-async def user_change_status(user: schemas.UserChangeStatus, db: DBSession = Depends(get_db_session)):
-    userByToken = crud.get_user_by_Token(db, user.accessToken)
-    if not(userByToken):
-        logger.warning(
-            f"POST /user/changestatus — Статус пользователя пытался изменить несуществующий пользователь.")
-        raise exceptions.TokenNotTaken()
-    if not(crud.get_user_by_Admin(db, user.accessToken)):
-        logger.warning(
-            f"POST /user/changestatus — Статус пользователя пытался изменить пользователь {userByToken.login}, не являющийся админом.")
-        raise exceptions.AdminNotTaken()
+def user_change_status(user: schemas.UserChangeStatus, userByToken: CurrentAdmin, db: DBSession = Depends(get_db_session)):
     check_user = crud.get_user_by_login(db, user.changed_user_login)
-    if not(crud.get_user_by_login(db, user.changed_user_login)):
+    if not(check_user):
         logger.warning(
             f"POST /user/changestatus — Админ {userByToken.login} пытался поменять статус несуществующего пользователя.")
         raise exceptions.LoginTaken()
@@ -289,41 +339,46 @@ async def user_change_status(user: schemas.UserChangeStatus, db: DBSession = Dep
     return db_user
 
 @router.post("/dogs/info", response_model = schemas.DogInfoResponse)
-async def dog_info(user: schemas.DogInfo, db: DBSession = Depends(get_db_session)):
-    userByToken = crud.get_user_by_Token(db, user.accessToken)
-    if not(userByToken):
-        logger.warning(
-            f"POST /dogs/info — Получить данные ошейника пытался несуществующий пользователь.")
-        raise exceptions.TokenNotTaken()
-    if not(crud.get_user_by_Admin(db, user.accessToken)):
-        logger.warning(
-            f"POST /dogs/info — Получить данные ошейника пытался пользователь, не являющийся админом.")
-        raise exceptions.AdminNotTaken()
-    if not (crud.get_user_by_DogId(db, user.dog_id)):
+def dog_info(user: schemas.DogInfo, userByToken: CurrentAdmin, db: DBSession = Depends(get_db_session)):
+    db_user = crud.dog_info(db, user.dog_id)
+    if not (db_user):
         logger.warning(
             f"POST /dogs/info — Админ {userByToken.login} пытался получить данные несуществующего ошейника.")
         raise exceptions.DogNotTaken()
 
-    db_user = crud.dog_info(db, user.dog_id)
-    db_user = schemas.DogInfoResponse(success=True, lastsend=db_user.last_send, coordinates=db_user.coordinates)
+    db_user = schemas.DogInfoResponse(success=True, lastsend=str(db_user.last_send) if db_user.last_send is not None else "", coordinates=db_user.coordinates)
 
     logger.info(
         f"POST /dogs/info — Данные ошейника {user.dog_id} успешно отправлены.")
     return db_user
 
+@router.post("/dogs/offline", response_model = schemas.DogsOfflineResponse)
+def dogs_offline(user: schemas.DogsOffline, userByToken: CurrentAdmin, db: DBSession = Depends(get_db_session)):
+    offline_monitor.refresh_if_due(db)
+    db_user = schemas.DogsOfflineResponse(success=True, dogs=offline_monitor.snapshot(user.limit), total=len(offline_monitor.offline),
+                                          checked_at=str(offline_monitor.checked_at))
+
+    logger.info(
+        f"POST /dogs/offline — Админ {userByToken.login} получил список молчащих ошейников.")
+    return db_user
+
+@router.post("/dogs/stationary", response_model = schemas.DogsStationaryResponse)
+def dogs_stationary(user: schemas.DogsStationary, userByToken: CurrentAdmin):
+    db_user = schemas.DogsStationaryResponse(success=True, dogs=stationary.detector.snapshot(user.limit),
+                                             total=len(stationary.detector.alerts))
+
+    logger.info(
+        f"POST /dogs/stationary — Админ {userByToken.login} получил список долго стоящих собак.")
+    return db_user
+
 @router.post("/user/changeAdmin", response_model = schemas.changeStatusAdminResponse)
-async def change_admin(user: schemas.changeStatusAdmin, db: DBSession = Depends(get_db_session)):
-    userByToken = crud.get_user_by_Token(db, user.accessToken)
-    if not (userByToken):
-        logger.warning(
-            f"POST /user/changeAdmin — Статус админа пользователя пытался изменить несуществующий пользователь.")
-        raise exceptions.TokenNotTaken()
+def change_admin(user: schemas.changeStatusAdmin, userByToken: CurrentUser, db: DBSession = Depends(get_db_session)):
     if userByToken.login != 'BigAdmin':
         logger.warning(
             f"POST /user/changeAdmin — Статус пользователя пытался изменить пользователь {userByToken.login}, не являющийся биг админом.")
         raise exceptions.AdminNotTaken()
     check_user = crud.get_user_by_login(db, user.changed_user_login)
-    if not (crud.get_user_by_login(db, user.changed_user_login)):
+    if not (check_user):
         logger.warning(
             f"POST /user/changeAdmin — Биг админ пытался поменять статус несуществующего пользователя.")
         raise exceptions.LoginTaken()
@@ -333,4 +388,4 @@ async def change_admin(user: schemas.changeStatusAdmin, db: DBSession = Depends(
 
     logger.info(
         f"POST /user/changeAdmin — Статус админа пользователя {user.changed_user_login} успешно изменен.")
-    return db_user
\ No newline at end of file
+    return db_user
@@ -0,0 +1,140 @@
+"""Отложенная запись координат ошейников (WRITE_BEHIND=1).
+
+Вместо коммита на каждую координату /dogs/update кладёт её в буфер в
+памяти, а отдельный поток пишет буфер в базу одной транзакцией раз в
+WRITE_BEHIND_INTERVAL_MS миллисекунд или как только в нём набралось
+WRITE_BEHIND_MAX_ENTRIES собак. В dogsUsers и R-дерево уходит только
+последняя координата каждой собаки, в трек — все точки со временем приёма.
+
+Буфер ограничен WRITE_BEHIND_MAX_PENDING координатами. Когда он полон,
+обработчик ждёт сброса до WRITE_BEHIND_PUT_TIMEOUT секунд и затем отвечает
+503, чтобы ошейник повторил отправку позже. При остановке приложения буфер
+сбрасывается целиком.
+
+Пока координата в буфере, /dogs/coordinates, /dogs/nearby и /dogs/track
+её ещё не видят: задержка не больше интервала сброса.
+"""
+import time
+from datetime import datetime
+from threading import Condition, Thread
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from src import config, metrics
+from src.database import DBSession
+from src.logger import get_logger
+from src.users import crud, exceptions, schemas
+
+logger = get_logger("user_router_logger")
+
+
+class WriteBehindBuffer:
+    def __init__(self):
+        self._fixes = []
+        self._dogs = set()
+        self._first_at: Optional[float] = None
+        self._cond = Condition()
+        self._thread: Optional[Thread] = None
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and not self._stopping
+
+    def __len__(self) -> int:
+        return len(self._fixes)
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Сбрасывает всё, что осталось в буфере, и останавливает поток записи."""
+        with self._cond:
+            thread, self._stopping = self._thread, True
+            self._cond.notify_all()
+        if thread is not None:
+            thread.join()
+        with self._cond:
+            self._thread = None
+
+    def put(self, fixes: list[schemas.DogsUpdate]) -> bool:
+        """Кладёт координаты в буфер. False — буфер не запущен, координаты надо записать сразу."""
+        now = datetime.now()
+        deadline = time.monotonic() + config.WRITE_BEHIND_PUT_TIMEOUT
+        with self._cond:
+            # Пачка больше всего буфера ждёт, пока он опустеет
+            while self.running and self._fixes and len(self._fixes) + len(fixes) > config.WRITE_BEHIND_MAX_PENDING:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    metrics.WRITE_BEHIND_REJECTED.inc(len(fixes))
+                    raise exceptions.IngestOverloaded()
+                self._cond.wait(remaining)
+            if not self.running:
+                return False
+            if not self._fixes:
+                self._first_at = time.monotonic()
+            self._fixes.extend((fix, now) for fix in fixes)
+            self._dogs.update(fix.dogid for fix in fixes)
+            if self._full():
+                self._cond.notify_all()
+            metrics.WRITE_BEHIND_PENDING.set(len(self._fixes))
+        return True
+
+    def _full(self) -> bool:
+        return len(self._dogs) >= config.WRITE_BEHIND_MAX_ENTRIES or len(self._fixes) >= config.WRITE_BEHIND_MAX_PENDING
+
+    def _take(self) -> Optional[list]:
+        # Ждёт, пока буфер пора сбрасывать, и забирает его; None — поток пора остановить
+        with self._cond:
+            while not self._stopping:
+                if self._fixes:
+                    remaining = self._first_at + config.WRITE_BEHIND_INTERVAL_MS / 1000 - time.monotonic()
+                    if remaining <= 0 or self._full():
+                        break
+                    self._cond.wait(remaining)
+                else:
+                    self._cond.wait()
+            if not self._fixes:
+                return None
+            fixes, self._fixes, self._dogs = self._fixes, [], set()
+            metrics.WRITE_BEHIND_PENDING.set(0)
+            # Освободилось место: будим обработчики, ждущие в put
+            self._cond.notify_all()
+            return fixes
+
+    def _run(self):
+        while (fixes := self._take()) is not None:
+            try:
+                with DBSession() as db:
+                    crud.write_dogsusers_coordinates(db, fixes)
+                metrics.WRITE_BEHIND_FLUSHES.inc(result="ok")
+            except Exception:
+                metrics.WRITE_BEHIND_FLUSHES.inc(result="error")
+                if self._stopping:
+                    logger.exception(f"Не удалось записать {len(fixes)} координат при остановке, они потеряны.")
+                    continue
+                logger.exception(f"Не удалось записать {len(fixes)} координат, повтор при следующем сбросе.")
+                with self._cond:
+                    # Поверх вернувшихся точек лягут более свежие, принятые во время сброса
+                    if not self._fixes:
+                        self._first_at = time.monotonic()
+                    self._fixes[:0] = fixes
+                    self._dogs.update(fix.dogid for fix, _ in fixes)
+                    metrics.WRITE_BEHIND_PENDING.set(len(self._fixes))
+                    if not self._stopping:
+                        self._cond.wait(config.WRITE_BEHIND_INTERVAL_MS / 1000)
+
+
+buffer = WriteBehindBuffer()
+
+
+def write(db: Session, fixes: list[schemas.DogsUpdate]):
+    """Запись принятых координат: в буфер при WRITE_BEHIND=1, иначе сразу в базу."""
+    if not (config.WRITE_BEHIND and buffer.put(fixes)):
+        crud.update_dogsusers_coordinates(db, fixes)
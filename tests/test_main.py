@@ -1,8 +1,46 @@
-from fastapi.testclient import TestClient
-import re
+import asyncio
+import logging
+import os
+import queue
 import random
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from secrets import token_hex
+
+# База и лог тестов лежат во временной папке, чтобы прогон не менял файлы
+# репозитория. Настройки читаются при импорте src.config, поэтому задаются
+# до импорта приложения
+TEST_DIR = tempfile.mkdtemp(prefix="dogshelp-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(TEST_DIR, 'user_devices.db')}"
+os.environ["LOG_FILE"] = os.path.join(TEST_DIR, "user_router.log")
+
+import httpx
+import orjson
+import pytest
+from fastapi import FastAPI
+from fastapi.routing import APIRoute
+from fastapi.testclient import TestClient
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+from werkzeug.security import generate_password_hash
 
 from main import app
+from src import config, profiler, request_context
+from src.database import BaseDBModel, DBSession, engine, make_engine
+from src.dataset import generate
+from src.logger import DroppingQueueHandler, JsonFormatter, SafeTimedRotatingFileHandler, SamplingFilter, get_logger
+from src.migrations import MIGRATIONS, migrate, status, logger as migrations_logger
+from src.users import crud, exceptions, geo, models, schemas, writebehind
+from src.users.cache import token_cache
+from src.users.offline import OfflineMonitor
+from src.users.stationary import StationaryDetector
+from src.users.user_router import router as user_router
 
 client = TestClient(app)
 
@@ -155,6 +193,33 @@ def test_AdminCorrect():
     assert response.status_code == 200
     assert response.json()["success"] == True
 
+def test_AdminRevoked():
+    login = getLogin()
+    client.post("/user/changeAdmin", json={
+        "accessToken": getTokenAdmin(),
+        "changed_user_login": login,
+        "admin": True
+    })
+    tokenLogin = client.post("/user/login", json={
+        "login": login,
+        "password": "qwerty"
+    }).json()["accessToken"]
+    dog = {
+        "accessToken": tokenLogin,
+        "characteristic": "123",
+        "place": "Irkutsk",
+        'photo': 'dog.img',
+        'name': 'Черепокрушитель'
+    }
+    assert client.post("/dogs/register", json=dog).status_code == 200
+
+    client.post("/user/changeAdmin", json={
+        "accessToken": getTokenAdmin(),
+        "changed_user_login": login,
+        "admin": False
+    })
+    assert client.post("/dogs/register", json=dog).status_code == 400
+
 def test_AdminError():
     login = getLogin()
     token = getAccessTokennotAdmin()
@@ -395,6 +460,38 @@ def test_response_list_correct():
     assert response.status_code == 200
     assert response.json()["success"] == True
 
+def test_response_list_pages():
+    token, taskid = getCreateTask()
+    for i in range(3):
+        tokenTaker = getAccessToken()
+        client.post("/dogs/task/take", json={
+            "accessToken": tokenTaker,
+            "task_id": taskid
+        })
+        client.post("/dogs/task/response/give", json={
+            "accessToken": tokenTaker,
+            "task_id": taskid,
+            "comment": "Отклик " + str(i),
+            "photo": "dog.img"
+        })
+
+    response = client.post("/dogs/task/response/list", json={
+            "accessToken": token,
+            "task_id": taskid,
+            "limit": 2
+    })
+    responses = response.json()["responses"]
+    assert [r["comment"] for r in responses] == ["Отклик 0", "Отклик 1"]
+    assert response.json()["next_cursor"] == responses[1]["response_id"]
+
+    response = client.post("/dogs/task/response/list", json={
+            "accessToken": token,
+            "task_id": taskid,
+            "after_response_id": responses[0]["response_id"]
+    })
+    assert [r["comment"] for r in response.json()["responses"]] == ["Отклик 1", "Отклик 2"]
+    assert response.json()["next_cursor"] is None
+
 def test_response_list_wrongToken():
     token, taskid = getCreateTask()
 
@@ -630,6 +727,114 @@ def test_dogs_errorupdate1():
     })
     assert response.status_code == 400
 
+def test_dogs_concurrentupdate():
+    dogs = [getDogID_AND_accessDogToken() for i in range(10)]
+
+    async def send_all():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as async_client:
+            return await asyncio.gather(*(async_client.post("/dogs/update", json={
+                "accessDogToken": accessDogToken,
+                "dogid": dogid,
+                "coordinates": "52.250323, 104.264442"
+            }) for dogid, accessDogToken in dogs))
+
+    responses = asyncio.run(send_all())
+    assert [response.status_code for response in responses] == [200] * len(dogs)
+def test_dogs_correctupdatebatch():
+    first = getDogID_AND_accessDogToken()
+    second = getDogID_AND_accessDogToken()
+    response = client.post("/dogs/update/batch", json={"fixes": [
+        {"accessDogToken": first[1], "dogid": first[0], "coordinates": "52.250323, 104.264442"},
+        {"accessDogToken": second[1], "dogid": second[0], "coordinates": "52.250884, 104.263155"}
+    ]})
+    assert response.status_code == 200
+    assert response.json()["success"] == True
+    assert [item["success"] for item in response.json()["results"]] == [True, True]
+
+    token = getAccessToken()
+    response = client.post("/dogs/info", json={
+            "accessToken": token,
+            "dog_id": second[0],
+        })
+    assert response.json()["coordinates"] == "52.250884, 104.263155"
+def test_dogs_errorupdatebatch():
+    first = getDogID_AND_accessDogToken()
+    second = getDogID_AND_accessDogToken()
+    response = client.post("/dogs/update/batch", json={"fixes": [
+        {"accessDogToken": first[1], "dogid": first[0], "coordinates": "52.250323, 104.264442"},
+        {"accessDogToken": '123123', "dogid": second[0], "coordinates": "52.250323, 104.264442"},
+        {"accessDogToken": first[1], "dogid": second[0], "coordinates": "52.250323, 104.264442"}
+    ]})
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [item["success"] for item in results] == [True, False, False]
+    assert results[1]["detail"] == "DogToken don't exist"
+    assert results[2]["detail"] == "Dog don't exist"
+def test_dogs_correcttrack():
+    dogid, accessDogToken = getDogID_AND_accessDogToken()
+    ts_from = int(time.time() * 1000) - 1
+    for coordinates in ["52.250323, 104.264442", "52.250884, 104.263155"]:
+        client.post("/dogs/update", json={
+                "accessDogToken": accessDogToken,
+                "dogid": dogid,
+                "coordinates": coordinates
+        })
+        time.sleep(0.01)
+
+    token = getAccessToken()
+    response = client.post("/dogs/track", json={
+        "accessToken": token,
+        "dog_id": dogid,
+        "ts_from": ts_from,
+        "ts_to": int(time.time() * 1000)
+    })
+    assert response.status_code == 200
+    track = response.json()["track"]
+    assert [(point["lat"], point["lon"]) for point in track] == [(52.250323, 104.264442), (52.250884, 104.263155)]
+    assert track[0]["ts"] < track[1]["ts"]
+def test_dogs_duplicateupdatebatch():
+    dogid, accessDogToken = getDogID_AND_accessDogToken()
+    ts_from = int(time.time() * 1000) - 1
+    response = client.post("/dogs/update/batch", json={"fixes": [
+        {"accessDogToken": accessDogToken, "dogid": dogid, "coordinates": "1.0, 1.0"},
+        {"accessDogToken": accessDogToken, "dogid": dogid, "coordinates": "2.0, 2.0"}
+    ]})
+    assert [item["success"] for item in response.json()["results"]] == [True, True]
+
+    # В треке и в текущем положении одна и та же последняя точка пачки
+    token = getAccessToken()
+    response = client.post("/dogs/info", json={"accessToken": token, "dog_id": dogid})
+    assert response.json()["coordinates"] == "2.0, 2.0"
+    response = client.post("/dogs/track", json={
+        "accessToken": token,
+        "dog_id": dogid,
+        "ts_from": ts_from,
+        "ts_to": int(time.time() * 1000)
+    })
+    assert [(point["lat"], point["lon"]) for point in response.json()["track"]] == [(2.0, 2.0)]
+def test_dogs_errortrack():
+    dogid = getDogId()
+    response = client.post("/dogs/track", json={
+        "accessToken": '123123',
+        "dog_id": dogid,
+        "ts_from": 0,
+        "ts_to": int(time.time() * 1000)
+    })
+    assert response.status_code == 400
+def test_dogs_emptyupdatebatch():
+    response = client.post("/dogs/update/batch", json={"fixes": []})
+    assert response.status_code == 422
+
+def test_dogs_errorupdateForeignDog():
+    first = getDogID_AND_accessDogToken()
+    second = getDogID_AND_accessDogToken()
+    response = client.post("/dogs/update", json={
+            "accessDogToken": first[1],
+            "dogid": second[0],
+            "coordinates": "52.250323, 104.264442"
+    })
+    assert response.status_code == 400
+
 
 def test_dogs_correctcharacterictic():
     token = getAccessToken()
@@ -673,6 +878,50 @@ def test_user_correctlogin():
     assert response.status_code == 200
     assert response.json()["success"] == True
 
+def test_user_oldTokenAfterLogin():
+    login = getLogin()
+    oldToken = client.post("/user/login", json={
+        "login": login,
+        "password": "qwerty"
+    }).json()["accessToken"]
+    response = client.post("/dogs/coordinates", json={
+        "accessToken": oldToken,
+        "place": "Irkutsk"
+    })
+    assert response.status_code == 200
+
+    client.post("/user/login", json={
+        "login": login,
+        "password": "qwerty"
+    })
+    response = client.post("/dogs/coordinates", json={
+        "accessToken": oldToken,
+        "place": "Irkutsk"
+    })
+    assert response.status_code == 400
+
+def test_user_rehashOnLogin():
+    login = getLogin()
+    with DBSession() as db:
+        db_user = db.query(models.tableUser).filter_by(login=login).first()
+        db_user.password = generate_password_hash("qwerty", method="pbkdf2:sha256:1000")
+        db.commit()
+
+    response = client.post("/user/login", json={
+        "login": login,
+        "password": "qwerty"
+    })
+    assert response.status_code == 200
+
+    with DBSession() as db:
+        db_user = db.query(models.tableUser).filter_by(login=login).first()
+        assert not db_user.password.startswith("pbkdf2:sha256:1000$")
+    response = client.post("/user/login", json={
+        "login": login,
+        "password": "qwerty"
+    })
+    assert response.status_code == 200
+
 def test_user_wrongPassword():
     login = getLogin()
     response = client.post("/user/login", json={
@@ -721,6 +970,13 @@ def test_user_errorplace():
         "place": place
     })
     assert response.status_code == 400
+def test_user_missingToken():
+    response = client.post("/dogs/coordinates", json={
+        "place": "Irkutsk"
+    })
+    assert response.status_code == 422
+    response = client.post("/dogs/update", content="not json")
+    assert response.status_code == 422
 def test_user_correcttaskList():
     token = getAccessToken()
     dogid = getDogId()
@@ -731,6 +987,42 @@ def test_user_correcttaskList():
     assert response.status_code == 200
     assert response.json()["success"] == True
 
+def test_user_taskListPages():
+    token = getAccessToken()
+    dogid = getDogId()
+    tasks = []
+    for goal in ["Покормить", "Выгулять", "Погладить"]:
+        response = client.post("/dogs/task/create", json={
+            "accessToken": token,
+            "dog_id": dogid,
+            "goal": goal
+        })
+        tasks.append(str(response.json()["task_id"]))
+    client.post("/dogs/task/confirm", json={
+        "accessToken": token,
+        "task_id": tasks[1],
+        "done": True
+    })
+
+    response = client.post("/dogs/task/list", json={
+        "accessToken": token,
+        "dog_id": dogid,
+        "limit": 1
+    })
+    assert [task["task_id"] for task in response.json()["tasks"]] == [tasks[0]]
+    assert response.json()["tasks"][0]["goal"] == "Покормить"
+    cursor = response.json()["next_cursor"]
+    assert cursor is not None
+
+    response = client.post("/dogs/task/list", json={
+        "accessToken": token,
+        "dog_id": dogid,
+        "after_task_id": cursor,
+        "limit": 1
+    })
+    assert [task["task_id"] for task in response.json()["tasks"]] == [tasks[2]]
+    assert response.json()["next_cursor"] is None
+
 def test_error_user_errortaskList():
     dogid = getDogId()
     response = client.post("/dogs/task/list", json={
@@ -739,6 +1031,122 @@ def test_error_user_errortaskList():
     })
     assert response.status_code == 400
 
+def test_dogs_correctnearby():
+    lat = random.uniform(-60, -50)
+    lon = random.uniform(-60, -50)
+    near = getDogID_AND_accessDogToken()
+    far = getDogID_AND_accessDogToken()
+    for (dogid, accessDogToken), coordinates in [(near, f"{lat + 0.001}, {lon}"), (far, f"{lat + 0.1}, {lon}")]:
+        client.post("/dogs/update", json={
+                "accessDogToken": accessDogToken,
+                "dogid": dogid,
+                "coordinates": coordinates
+        })
+
+    token = getAccessToken()
+    response = client.post("/dogs/nearby", json={
+        "accessToken": token,
+        "lat": lat,
+        "lon": lon,
+        "radius": 1000
+    })
+    assert response.status_code == 200
+    assert [dog["dogid"] for dog in response.json()["dogs"]] == [str(near[0])]
+
+    response = client.post("/dogs/nearby", json={
+        "accessToken": token,
+        "min_lat": lat,
+        "max_lat": lat + 0.2,
+        "min_lon": lon - 0.1,
+        "max_lon": lon + 0.1
+    })
+    assert response.status_code == 200
+    assert sorted(dog["dogid"] for dog in response.json()["dogs"]) == sorted([str(near[0]), str(far[0])])
+def test_dogs_nearbyantimeridian():
+    lat = random.uniform(10, 11)
+    east = getDogID_AND_accessDogToken()
+    west = getDogID_AND_accessDogToken()
+    for (dogid, accessDogToken), lon in [(east, 179.995), (west, -179.995)]:
+        client.post("/dogs/update", json={
+                "accessDogToken": accessDogToken,
+                "dogid": dogid,
+                "coordinates": f"{lat}, {lon}"
+        })
+
+    # Круг у линии перемены дат захватывает собак по обе стороны от ±180°
+    token = getAccessToken()
+    for lon in [179.99, -179.99]:
+        response = client.post("/dogs/nearby", json={
+            "accessToken": token,
+            "lat": lat,
+            "lon": lon,
+            "radius": 5000
+        })
+        assert response.status_code == 200
+        assert sorted(dog["dogid"] for dog in response.json()["dogs"]) == sorted([str(east[0]), str(west[0])])
+def test_geo_lonranges():
+    min_lat, max_lat, min_lon, max_lon = geo.bounding_box(10, 179.99, 5000)
+    assert max_lon > 180
+    assert geo.lon_ranges(min_lon, max_lon) == [(min_lon, 180.0), (-180.0, max_lon - 360)]
+    min_lat, max_lat, min_lon, max_lon = geo.bounding_box(10, -179.99, 5000)
+    assert geo.lon_ranges(min_lon, max_lon) == [(min_lon + 360, 180.0), (-180.0, max_lon)]
+    assert geo.lon_ranges(104.0, 105.0) == [(104.0, 105.0)]
+    assert geo.lon_ranges(-200.0, 200.0) == [(-180.0, 180.0)]
+def test_dogs_correctnearest():
+    token = getAccessToken()
+    place = 'Place' + str(random.randint(0, 10**9))
+    dogs = []
+    for coordinates in ["52.40, 104.40", "52.20, 104.20", "52.25, 104.26"]:
+        response = client.post("/dogs/register", json={
+            "accessToken": token,
+            "characteristic": "123",
+            "place": place,
+            'photo': 'dog.img',
+            'name': 'Черепокрушитель'
+        })
+        dogid, accessDogToken = response.json()["dogid"], response.json()["accessDogToken"]
+        client.post("/dogs/update", json={
+                "accessDogToken": accessDogToken,
+                "dogid": dogid,
+                "coordinates": coordinates
+        })
+        dogs.append(str(dogid))
+
+    response = client.post("/dogs/nearest", json={
+        "accessToken": token,
+        "place": place,
+        "lat": 52.25,
+        "lon": 104.25,
+        "limit": 2
+    })
+    assert response.status_code == 200
+    nearest = response.json()["dogs"]
+    assert [dog["dogid"] for dog in nearest] == [dogs[2], dogs[1]]
+    assert nearest[0]["distance"] < nearest[1]["distance"]
+def test_dogs_errorcoordinatesupdate():
+    dogid, accessDogToken = getDogID_AND_accessDogToken()
+    for coordinates in ["52.250323 104.264442", "north, east", "152.25, 104.26"]:
+        response = client.post("/dogs/update", json={
+                "accessDogToken": accessDogToken,
+                "dogid": dogid,
+                "coordinates": coordinates
+        })
+        assert response.status_code == 422
+def test_dogs_errornearby():
+    token = getAccessToken()
+    response = client.post("/dogs/nearby", json={
+        "accessToken": token,
+        "lat": 52.25
+    })
+    assert response.status_code == 422
+    response = client.post("/dogs/nearby", json={
+        "accessToken": '123123',
+        "lat": 52.25,
+        "lon": 104.26,
+        "radius": 1000
+    })
+    assert response.status_code == 400
+
 def test_error_user_errortaskList1():
     token = getAccessToken()
     response = client.post("/dogs/task/list", json={
@@ -747,3 +1155,637 @@ def test_error_user_errortaskList1():
     })
     assert response.status_code == 400
 
+# Тест миграций
+
+def test_migrations_applied():
+    assert migrate(engine) == []
+    applied = status(engine)
+    assert [row["version"] for row in applied] == [migration.version for migration in MIGRATIONS]
+    for row in applied:
+        if row["plan_after"]:
+            # Поиск по R-дереву EXPLAIN показывает как SCAN виртуальной таблицы по её индексу
+            assert "SCAN" not in row["plan_after"].replace("SCAN dogsRtree VIRTUAL TABLE INDEX", "")
+    with engine.connect() as conn:
+        indexes = {row[0] for row in conn.exec_driver_sql('SELECT name FROM sqlite_master WHERE tbl_name = "dogsTrack"')}
+    assert "ix_dogsTrack_ts" not in indexes
+
+def test_migrations_logged(tmp_path, caplog):
+    # Сообщения о миграциях и планы запросов видны при старте, а не теряются ниже уровня WARNING
+    assert migrations_logger.isEnabledFor(logging.INFO)
+    with caplog.at_level(logging.INFO, logger="migrations_logger"):
+        target = make_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+        BaseDBModel.metadata.create_all(bind=target)
+        migrate(target)
+        target.dispose()
+    assert "Миграция 1 (dogs_numeric_coordinates) применена." in caplog.text
+
+def test_migrations_upgrade_shipped_db(tmp_path):
+    # База из репозитория создана до колонок lat/lon, change_seq и трека
+    path = tmp_path / "user_devices.db"
+    shutil.copy(Path(__file__).resolve().parent.parent / "src" / "user_devices.db", path)
+    with sqlite3.connect(path) as conn:
+        conn.execute('''INSERT INTO "dogsUsers" (dogid, coordinates, last_send, place, is_deleted, "accessToken")
+                        VALUES (1000, '52.25, 104.26', '', 'Irkutsk', 0, 'old-token')''')
+    target = make_engine(f"sqlite:///{path}")
+    BaseDBModel.metadata.create_all(bind=target)
+    migrate(target)
+
+    with Session(target) as db:
+        dog = db.get(models.DogsUser, 1000)
+        assert (dog.lat, dog.lon) == (52.25, 104.26)
+        assert db.execute(text('SELECT dogid FROM "dogsRtree" WHERE dogid = 1000')).scalar() == 1000
+        crud.update_dogsusers_coordinates(db, [schemas.DogsUpdate(accessDogToken="old-token", dogid=1000, coordinates="52.3, 104.3")])
+        db.refresh(dog)
+        assert (dog.lat, dog.lon) == (52.3, 104.3)
+    target.dispose()
+
+# Тест настроек SQLite
+
+def test_sqlite_pragmas():
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 1
+        assert conn.exec_driver_sql("PRAGMA busy_timeout").scalar() == config.SQLITE_BUSY_TIMEOUT
+
+# Тест логирования
+
+def test_logger_handlers_once():
+    logger = get_logger("user_router_logger")
+    handlers = list(logger.handlers)
+    assert get_logger("user_router_logger").handlers == handlers
+    assert len(handlers) == 1
+
+def test_logger_rotation_workers(tmp_path):
+    log_file = str(tmp_path / "user_router.log")
+    workers = [SafeTimedRotatingFileHandler(log_file, when='midnight', encoding='utf-8') for i in range(2)]
+    for i, handler in enumerate(workers):
+        handler.emit(logging.makeLogRecord({"msg": f"до ротации {i}"}))
+
+    for handler in workers:
+        handler.rolloverAt = int(time.time()) - 1
+    for i, handler in enumerate(workers):
+        handler.emit(logging.makeLogRecord({"msg": f"после ротации {i}"}))
+        handler.close()
+
+    rotated = [path for path in tmp_path.iterdir() if path.name.startswith("user_router.log.") and path.suffix != ".lock"]
+    assert len(rotated) == 1
+    assert rotated[0].read_text(encoding='utf-8').splitlines() == ["до ротации 0", "до ротации 1"]
+    assert (tmp_path / "user_router.log").read_text(encoding='utf-8').splitlines() == ["после ротации 0", "после ротации 1"]
+
+def test_logger_json_context(caplog):
+    token = getAccessToken()
+    with caplog.at_level(logging.INFO, logger="user_router_logger"):
+        response = client.post("/dogs/coordinates", json={
+            "accessToken": token,
+            "place": "Irkutsk"
+        })
+    assert response.status_code == 200
+    record = [r for r in caplog.records if getattr(r, "route", None) == "POST /dogs/coordinates"][-1]
+    line = orjson.loads(JsonFormatter().format(record))
+    assert line["route"] == "POST /dogs/coordinates"
+    assert line["outcome"] == "ok"
+    assert line["principal_id"] is not None
+    assert line["queries"] >= 1
+    assert line["latency_ms"] > 0
+
+def test_logger_sampling():
+    sampling = SamplingFilter("POST /dogs/update:INFO=0, *:DEBUG=0.5")
+    assert sampling.rate("POST /dogs/update", "INFO") == 0
+    assert sampling.rate("POST /dogs/update", "WARNING") == 1
+    assert sampling.rate("POST /dogs/info", "DEBUG") == 0.5
+    assert sampling.rate("POST /dogs/info", "INFO") == 1
+
+    record = logging.makeLogRecord({"levelno": logging.INFO, "levelname": "INFO", "route": "POST /dogs/update"})
+    assert not sampling.filter(record)
+    record = logging.makeLogRecord({"levelno": logging.WARNING, "levelname": "WARNING", "route": "POST /dogs/update"})
+    assert sampling.filter(record)
+
+# Тест метрик
+
+def test_metrics():
+    client.post("/dogs/coordinates", json={
+        "accessToken": '123123',
+        "place": "Irkutsk"
+    })
+    token = getAccessToken()
+    client.post("/dogs/coordinates", json={
+        "accessToken": token,
+        "place": "Irkutsk"
+    })
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    text = response.text
+    assert 'http_requests_total{method="POST",route="/dogs/coordinates",status="200"}' in text
+    assert 'http_requests_total{method="POST",route="/dogs/coordinates",status="400"}' in text
+    assert 'http_exceptions_total{route="/dogs/coordinates",exception="TokenNotTaken"}' in text
+    assert 'http_request_duration_seconds_bucket{method="POST",route="/dogs/coordinates",le="+Inf"}' in text
+    assert 'http_requests_in_progress{method="GET"} 1' in text
+    assert 'db_queries_total{operation="SELECT"}' in text
+    assert 'db_query_duration_seconds_count{operation="SELECT"}' in text
+
+def test_metrics_log_dropped():
+    def dropped():
+        match = re.search(r"^log_records_dropped_total (\S+)$", client.get("/metrics").text, re.M)
+        return float(match.group(1)) if match else 0.0
+
+    before = dropped()
+    handler = DroppingQueueHandler(queue.Queue(maxsize=1))
+    for i in range(3):
+        handler.enqueue(logging.makeLogRecord({"msg": f"запись {i}"}))
+    assert handler.dropped == 2
+    assert dropped() == before + 2
+
+# Тест профилировщика SQL
+
+profiled_app = FastAPI()
+profiled_app.add_middleware(profiler.SQLProfilerMiddleware)
+profiled_app.include_router(user_router)
+
+@profiled_app.get("/nplusone")
+def nplusone():
+    with DBSession() as db:
+        for user_id in range(3):
+            db.execute(text("SELECT login FROM users WHERE id = :id"), {"id": user_id})
+    return {"success": True}
+
+profiled_client = TestClient(profiled_app)
+
+def test_profiler_server_timing():
+    token = getAccessToken()
+    dogid = getDogId()
+    response = profiled_client.post("/dogs/task/list", json={
+        "accessToken": token,
+        "dog_id": dogid
+    })
+    assert response.status_code == 200
+    timing = response.headers["server-timing"]
+    for name in ["db", "handler", "serialization", "total"]:
+        assert re.search(name + r";dur=\d+\.\d+", timing)
+    queries = int(re.search(r'desc="(\d+) queries"', timing).group(1))
+    assert 1 <= queries <= 3
+    assert "N+1?" not in profiler.recent_reports()[-1]
+    assert "server-timing" not in client.post("/dogs/task/list", json={
+        "accessToken": token,
+        "dog_id": dogid
+    }).headers
+
+def test_profiler_nplusone():
+    response = profiled_client.get("/nplusone")
+    assert response.status_code == 200
+    report = profiler.recent_reports()[-1]
+    assert report.startswith("GET /nplusone: 3 запросов к базе")
+    assert "N+1? 3 раз" in report
+    assert "SELECT login FROM users WHERE id = ?" in report
+
+def test_profiler_statement_shape():
+    assert request_context.statement_shape("SELECT id FROM users\n WHERE id IN (?, ?, ?)") == \
+        request_context.statement_shape("SELECT id FROM users WHERE id IN (?, ?)")
+
+def test_single_engine_listener():
+    # Запросы замеряет один обработчик request_context, метрики и профилировщик берут время из него
+    assert list(engine.dispatch.after_cursor_execute) == [request_context._after_cursor_execute]
+
+# Бюджет запросов к базе и времени для каждого маршрута
+#
+# База заполняется набором «как в жизни»: сотни собак в одном месте, сотни
+# заданий у собаки и откликов на задание, длинный трек. Число выражений SQL
+# не должно зависеть от объёма данных, поэтому бюджет — текущее число
+# запросов; если маршруту действительно нужно больше, бюджет поднимается здесь
+# вместе с изменением. Кэш токенов сбрасывается перед замером, чтобы в бюджет
+# входила и проверка токена.
+
+BUDGET_DOGS = 300
+BUDGET_TASKS = 200
+BUDGET_WORKERS = 200
+BUDGET_TRACK = 2000
+
+@pytest.fixture(scope="module")
+def budget_dataset():
+    place = "Бюджет" + token_hex(4)
+    owner = getAccessToken()
+    password = generate_password_hash("qwerty", method=config.PASSWORD_HASH_METHOD)
+    workers = [{"login": "budget" + token_hex(6), "accessToken": token_hex(6)} for i in range(BUDGET_WORKERS)]
+    dog_tokens = [token_hex(6) for i in range(BUDGET_DOGS)]
+
+    with DBSession() as db:
+        owner_id = crud.get_user_by_Token(db, owner).id
+        db.execute(models.tableUser.__table__.insert(), [
+            {**worker, "password": password, "is_admin": False, "is_deleted": False} for worker in workers])
+        db.execute(models.DogsUser.__table__.insert(), [
+            {"characteristic": "123", "coordinates": "", "last_send": datetime.now(), "place": place, "is_deleted": False,
+             "accessToken": dog_token, "photo": "dog.img", "name": "Бюджет"} for dog_token in dog_tokens])
+        dogids = dict(crud.get_dogids_by_DogTokens(db, dog_tokens))
+        dogs = [dogids[dog_token] for dog_token in dog_tokens]
+        crud.update_dogsusers_coordinates(db, [
+            schemas.DogsUpdate(accessDogToken=dog_token, dogid=dogids[dog_token],
+                               lat=52.2 + i % 20 * 0.01, lon=104.2 + i // 20 * 0.01)
+            for i, dog_token in enumerate(dog_tokens)])
+        db.execute(models.DogsTrack.__table__.insert(), [
+            {"dogid": dogs[0], "ts": ts, "lat": 52.2, "lon": 104.2} for ts in range(1, BUDGET_TRACK + 1)])
+        db.execute(models.Tasks.__table__.insert(), [
+            {"upload_user_id": owner_id, "dog_id": dogs[0], "goal": f"Задание {i}", "done": False} for i in range(BUDGET_TASKS)])
+        tasks = [u[0] for u in db.query(models.Tasks.id).filter_by(dog_id=dogs[0]).order_by(models.Tasks.id)]
+        worker_ids = [u[0] for u in db.query(models.tableUser.id).filter(
+            models.tableUser.login.in_([worker["login"] for worker in workers])).order_by(models.tableUser.id)]
+        db.execute(models.Responses.__table__.insert(), [
+            {"do_user_id": worker_id, "task_id": tasks[0], "comment": "", "photo": ""} for worker_id in worker_ids])
+        db.commit()
+
+    return {"place": place, "owner": owner, "workers": workers, "dogs": dogs, "dog_tokens": dog_tokens, "tasks": tasks}
+
+# маршрут -> (запросов к базе, секунд, тело запроса по набору данных)
+QUERY_BUDGETS = {
+    "/user/register": (3, 2.0, lambda ds: {"login": "budget" + token_hex(6), "password": "qwerty"}),
+    "/user/login": (2, 2.0, lambda ds: {"login": ds["workers"][2]["login"], "password": "qwerty"}),
+    "/dogs/register": (4, 0.5, lambda ds: {"accessToken": ds["owner"], "characteristic": "123", "place": ds["place"],
+                                           "photo": "dog.img", "name": "Бюджет"}),
+    "/dogs/task/create": (4, 0.5, lambda ds: {"accessToken": ds["owner"], "dog_id": ds["dogs"][0], "goal": "Бюджет"}),
+    "/dogs/task/list": (3, 0.5, lambda ds: {"accessToken": ds["owner"], "dog_id": ds["dogs"][0]}),
+    "/dogs/task/take": (5, 0.5, lambda ds: {"accessToken": ds["workers"][0]["accessToken"], "task_id": ds["tasks"][1]}),
+    "/dogs/task/response/give": (5, 0.5, lambda ds: {"accessToken": ds["workers"][1]["accessToken"], "task_id": ds["tasks"][0],
+                                                     "comment": "Сделано", "photo": "dog.img"}),
+    "/dogs/task/response/list": (3, 0.5, lambda ds: {"accessToken": ds["owner"], "task_id": ds["tasks"][0]}),
+    "/dogs/task/confirm": (3, 0.5, lambda ds: {"accessToken": ds["owner"], "task_id": ds["tasks"][-1], "done": True}),
+    "/dogs/coordinates": (3, 0.5, lambda ds: {"accessToken": ds["owner"], "place": ds["place"]}),
+    "/dogs/nearby": (2, 0.5, lambda ds: {"accessToken": ds["owner"], "lat": 52.25, "lon": 104.25, "radius": 5000}),
+    "/dogs/nearest": (2, 0.5, lambda ds: {"accessToken": ds["owner"], "place": ds["place"], "lat": 52.25, "lon": 104.25}),
+    "/dogs/characteristic": (2, 0.5, lambda ds: {"accessToken": ds["owner"], "dogid": ds["dogs"][0]}),
+    "/dogs/track": (3, 0.5, lambda ds: {"accessToken": ds["owner"], "dog_id": ds["dogs"][0], "ts_from": 0,
+                                        "ts_to": BUDGET_TRACK, "limit": BUDGET_TRACK}),
+    "/dogs/update": (5, 0.5, lambda ds: {"accessDogToken": ds["dog_tokens"][1], "dogid": ds["dogs"][1],
+                                         "coordinates": "52.21, 104.21"}),
+    "/dogs/update/batch": (5, 0.5, lambda ds: {"fixes": [
+        {"accessDogToken": dog_token, "dogid": dogid, "lat": 52.3, "lon": 104.3}
+        for dog_token, dogid in zip(ds["dog_tokens"][:100], ds["dogs"][:100])]}),
+    "/dogs/changestatus": (3, 0.5, lambda ds: {"accessToken": ds["owner"], "dogid": ds["dogs"][-1], "delete": False}),
+    "/user/changestatus": (2, 0.5, lambda ds: {"accessToken": ds["owner"], "changed_user_login": ds["workers"][-1]["login"],
+                                               "delete": False}),
+    "/dogs/info": (2, 0.5, lambda ds: {"accessToken": ds["owner"], "dog_id": ds["dogs"][0]}),
+    "/dogs/offline": (3, 0.5, lambda ds: {"accessToken": ds["owner"]}),
+    "/dogs/stationary": (1, 0.5, lambda ds: {"accessToken": ds["owner"]}),
+    "/user/changeAdmin": (2, 0.5, lambda ds: {"accessToken": getTokenAdmin(), "changed_user_login": ds["workers"][-2]["login"],
+                                              "admin": False}),
+}
+
+def test_budget_covers_all_routes():
+    assert {route.path for route in user_router.routes if isinstance(route, APIRoute)} == set(QUERY_BUDGETS)
+
+@pytest.mark.parametrize("path", list(QUERY_BUDGETS))
+def test_query_budget(budget_dataset, path):
+    max_queries, max_seconds, body = QUERY_BUDGETS[path]
+    payload = body(budget_dataset)
+    token_cache.clear()
+
+    started = time.perf_counter()
+    response = profiled_client.post(path, json=payload)
+    elapsed = time.perf_counter() - started
+
+    assert response.status_code == 200, response.text
+    assert response.json()["success"] == True
+    queries = int(re.search(r'desc="(\d+) queries"', response.headers["server-timing"]).group(1))
+    assert queries <= max_queries, f"{path}: {queries} запросов к базе при бюджете {max_queries}\n{profiler.recent_reports()[-1]}"
+    assert elapsed <= max_seconds, f"{path}: {elapsed:.3f} с при бюджете {max_seconds} с"
+
+# Тест генератора данных
+
+def test_dataset_generate(tmp_path):
+    dumps = []
+    for name in ["first", "second"]:
+        target = make_engine(f"sqlite:///{tmp_path / name}.db")
+        counts = generate(target, users=50, dogs=30, places=3, tasks=100, responses=200, track_points=5,
+                          seed=7, until=datetime(2024, 6, 1), log=lambda message: None)
+        assert counts == {"users": 50, "dogsUsers": 30, "dogsRtree": 30, "dogsTrack": 150, "tasks": 100, "responses": 200}
+        with target.connect() as conn:
+            # Соль хэша пароля случайна, остальные данные совпадают
+            dump = [conn.exec_driver_sql('SELECT id, login, is_admin, is_deleted, "accessToken" FROM users ORDER BY id').all()]
+            dump += [conn.exec_driver_sql(f'SELECT * FROM "{table}" ORDER BY 1, 2').all()
+                     for table in ["dogsUsers", "dogsRtree", "dogsTrack", "tasks", "responses"]]
+            dumps.append(dump)
+            assert conn.exec_driver_sql('SELECT count(*) FROM tasks JOIN "dogsUsers" ON dogid = dog_id').scalar() == 100
+            # Хэш пароля посчитан один раз на всех
+            assert conn.exec_driver_sql("SELECT count(DISTINCT password) FROM users").scalar() == 1
+            # Один отклик пользователя на задание, и только на существующие задания
+            assert conn.exec_driver_sql("SELECT count(DISTINCT do_user_id || ':' || task_id) FROM responses").scalar() == 200
+            assert conn.exec_driver_sql("SELECT count(*) FROM responses JOIN tasks ON tasks.id = task_id").scalar() == 200
+        target.dispose()
+
+    # Повторный запуск с тем же seed дописывает строки с новыми токенами
+    target = make_engine(f"sqlite:///{tmp_path / 'first'}.db")
+    generate(target, users=50, dogs=30, places=3, tasks=0, responses=0, track_points=0,
+             seed=7, until=datetime(2024, 6, 1), log=lambda message: None)
+    with target.connect() as conn:
+        for table in ["users", "dogsUsers"]:
+            assert conn.exec_driver_sql(f'SELECT count(DISTINCT "accessToken") FROM "{table}"').scalar() == \
+                conn.exec_driver_sql(f'SELECT count(*) FROM "{table}"').scalar()
+    target.dispose()
+
+    # Без заданий откликам не на что ссылаться
+    target = make_engine(f"sqlite:///{tmp_path / 'notasks'}.db")
+    counts = generate(target, users=5, dogs=0, places=1, tasks=10, responses=20, track_points=0,
+                      seed=7, log=lambda message: None)
+    assert "tasks" not in counts and "responses" not in counts
+    target.dispose()
+
+    assert dumps[0] == dumps[1]
+    assert dumps[0][0][0][1] == "seed7_user1"
+
+# Тест подписки на координаты собак
+
+def registerDogInPlace(place):
+    token = getAccessToken()
+    response = client.post("/dogs/register", json={
+        "accessToken": token,
+        "characteristic": "123",
+        "place": place,
+        'photo': 'dog.img',
+        'name': 'Черепокрушитель'
+    })
+    return [response.json()["dogid"], response.json()["accessDogToken"]]
+
+def test_dogs_streamplace():
+    place = "Поток" + token_hex(4)
+    dog = registerDogInPlace(place)
+    other = registerDogInPlace("Другое" + token_hex(4))
+    with client.websocket_connect("/dogs/stream") as websocket:
+        websocket.send_json({"accessToken": getAccessToken(), "place": place})
+        snapshot = websocket.receive_json()
+        assert snapshot["success"] == True
+        assert [item["dogid"] for item in snapshot["dogs"]] == [str(dog[0])]
+        assert snapshot["truncated"] == False
+
+        client.post("/dogs/update", json={"accessDogToken": other[1], "dogid": other[0], "lat": 10.5, "lon": 20.5})
+        response = client.post("/dogs/update", json={"accessDogToken": dog[1], "dogid": dog[0], "lat": 52.3, "lon": 104.3})
+        assert response.status_code == 200
+        update = websocket.receive_json()
+        assert update == {"success": True, "dogs": [{"dogid": str(dog[0]), "coordinates": "52.3, 104.3", "lat": 52.3, "lon": 104.3}]}
+
+def test_dogs_streamtruncated(monkeypatch):
+    monkeypatch.setattr(config, "STREAM_SNAPSHOT_LIMIT", 1)
+    place = "Поток" + token_hex(4)
+    dogs = [registerDogInPlace(place) for i in range(2)]
+    with client.websocket_connect("/dogs/stream") as websocket:
+        websocket.send_json({"accessToken": getAccessToken(), "place": place})
+        snapshot = websocket.receive_json()
+        assert len(snapshot["dogs"]) == 1
+        assert snapshot["truncated"] == True
+
+def test_dogs_streambox():
+    inside = getDogID_AND_accessDogToken()
+    outside = getDogID_AND_accessDogToken()
+    with client.websocket_connect("/dogs/stream") as websocket:
+        websocket.send_json({"accessToken": getAccessToken(), "min_lat": -41.0, "max_lat": -40.0, "min_lon": -71.0, "max_lon": -70.0})
+        assert websocket.receive_json() == {"success": True, "dogs": [], "truncated": False}
+
+        client.post("/dogs/update/batch", json={"fixes": [
+            {"accessDogToken": outside[1], "dogid": outside[0], "lat": -39.5, "lon": -70.5},
+            {"accessDogToken": inside[1], "dogid": inside[0], "lat": -40.5, "lon": -70.5},
+        ]})
+        update = websocket.receive_json()
+        assert [item["dogid"] for item in update["dogs"]] == [str(inside[0])]
+
+    response = client.get("/metrics")
+    assert "dogs_stream_subscribers 0" in response.text
+
+def test_dogs_streamerror():
+    with client.websocket_connect("/dogs/stream") as websocket:
+        websocket.send_json({"accessToken": "123123", "place": "Irkutsk"})
+        assert websocket.receive_json() == {"success": False, "detail": "Token don't exist"}
+
+    with client.websocket_connect("/dogs/stream") as websocket:
+        websocket.send_json({"accessToken": getAccessToken()})
+        assert websocket.receive_json()["success"] == False
+
+# Тест дельта-синхронизации координат
+
+def test_dogs_coordinatesdelta():
+    place = "Дельта" + token_hex(4)
+    token = getAccessToken()
+    moved, deleted, still = [registerDogInPlace(place) for i in range(3)]
+
+    response = client.post("/dogs/coordinates", json={"accessToken": token, "place": place})
+    assert len(response.json()["dogs"]) == 3
+    assert response.json()["deleted"] == []
+    cursor = response.json()["cursor"]
+
+    response = client.post("/dogs/coordinates", json={"accessToken": token, "place": place, "since": cursor})
+    assert response.json()["dogs"] == []
+    assert response.json()["cursor"] == cursor
+
+    client.post("/dogs/update", json={"accessDogToken": moved[1], "dogid": moved[0], "coordinates": "52.26, 104.27"})
+    client.post("/dogs/changestatus", json={"accessToken": token, "dogid": deleted[0], "delete": True})
+
+    response = client.post("/dogs/coordinates", json={"accessToken": token, "place": place, "since": cursor})
+    assert response.json()["dogs"] == [{"dogid": str(moved[0]), "coordinates": "52.26, 104.27"}]
+    assert response.json()["deleted"] == [str(deleted[0])]
+    assert response.json()["cursor"] > cursor
+    cursor = response.json()["cursor"]
+
+    response = client.post("/dogs/coordinates", json={"accessToken": token, "place": place, "since": cursor})
+    assert response.json()["dogs"] == []
+    assert response.json()["deleted"] == []
+
+    response = client.post("/dogs/coordinates", json={"accessToken": token, "place": place, "since": cursor + 1000000})
+    assert {dog["dogid"] for dog in response.json()["dogs"]} == {str(moved[0]), str(still[0])}
+
+def test_dogs_coordinatesdeltainterleaved():
+    place = "Дельта" + token_hex(4)
+    token = getAccessToken()
+    dog = registerDogInPlace(place)
+    cursor = client.post("/dogs/coordinates", json={"accessToken": token, "place": place}).json()["cursor"]
+
+    # Другой клиент коммитит координаты между чтением курсора и чтением собак
+    written = []
+    def interleave(conn, cursor_, statement, parameters, context, executemany):
+        if not written and statement.lstrip().startswith("SELECT") and '"changeSeq"' in statement:
+            written.append(True)
+            with DBSession() as writer:
+                crud.update_dogsusers_coordinates(writer, [schemas.DogsUpdate(accessDogToken=dog[1], dogid=dog[0], coordinates="52.3, 104.3")])
+    event.listen(engine, "after_cursor_execute", interleave)
+    try:
+        with DBSession() as db:
+            dogs, deleted, next_cursor = crud.get_dogsuser_place(db, place, since=cursor)
+    finally:
+        event.remove(engine, "after_cursor_execute", interleave)
+    assert written
+    assert dogs == [{"dogid": str(dog[0]), "coordinates": "52.3, 104.3"}]
+
+    # Курсор учитывает отданную строку: следующий опрос её не повторяет
+    response = client.post("/dogs/coordinates", json={"accessToken": token, "place": place, "since": next_cursor})
+    assert response.json()["dogs"] == []
+
+# Тест молчащих ошейников
+
+def setLastSend(dogid, last_send):
+    with DBSession() as db:
+        db.query(models.DogsUser).filter_by(dogid=dogid).update({"last_send": last_send})
+        db.commit()
+
+def test_dogs_offlinemonitor():
+    started = datetime.now()
+    silent = getDogID_AND_accessDogToken()
+    later = getDogID_AND_accessDogToken()
+    setLastSend(silent[0], started - timedelta(hours=2))
+    setLastSend(later[0], started - timedelta(minutes=20))
+
+    monitor = OfflineMonitor()
+    with DBSession() as db:
+        assert silent[0] in monitor.refresh(db, now=started)
+        assert later[0] not in monitor.offline
+
+        # Инкрементальная проверка находит замолчавших с прошлого раза
+        assert later[0] in monitor.refresh(db, now=started + timedelta(minutes=15))
+        assert silent[0] in monitor.offline
+
+    client.post("/dogs/update", json={"accessDogToken": silent[1], "dogid": silent[0], "coordinates": "52.25, 104.26"})
+    with DBSession() as db:
+        monitor.refresh(db, now=started + timedelta(minutes=16))
+    assert silent[0] not in monitor.offline
+    assert later[0] in monitor.offline
+
+def test_dogs_offline(monkeypatch):
+    monkeypatch.setattr(config, "OFFLINE_CHECK_INTERVAL", 0)
+    monkeypatch.setattr(config, "OFFLINE_RESYNC", 0)
+    dog = getDogID_AND_accessDogToken()
+    setLastSend(dog[0], datetime.now() - timedelta(hours=3))
+
+    response = client.post("/dogs/offline", json={"accessToken": getAccessToken()})
+    assert response.status_code == 200
+    dogs = {item["dogid"]: item for item in response.json()["dogs"]}
+    assert dogs[str(dog[0])]["silent_for"] >= 3 * 3600 - 5
+    assert response.json()["total"] >= 1
+
+    response = client.post("/dogs/offline", json={"accessToken": getAccessTokennotAdmin()})
+    assert response.status_code == 400
+
+def test_dogs_infolastsend():
+    dog = getDogID_AND_accessDogToken()
+    client.post("/dogs/update", json={"accessDogToken": dog[1], "dogid": dog[0], "coordinates": "52.25, 104.26"})
+    response = client.post("/dogs/info", json={"accessToken": getAccessToken(), "dog_id": dog[0]})
+    assert datetime.fromisoformat(response.json()["lastsend"]) > datetime.now() - timedelta(minutes=1)
+
+def test_dogs_infonolastsend():
+    # Ошейник, который ни разу не присылал координаты (миграция 4 превращает '' в NULL)
+    dog = getDogID_AND_accessDogToken()
+    setLastSend(dog[0], None)
+    response = client.post("/dogs/info", json={"accessToken": getAccessToken(), "dog_id": dog[0]})
+    assert response.status_code == 200
+    assert response.json()["lastsend"] == ""
+
+# Долго стоящие собаки
+
+def test_dogs_stationarydetector(monkeypatch):
+    monkeypatch.setattr(config, "STATIONARY_RADIUS", 50)
+    monkeypatch.setattr(config, "STATIONARY_AFTER", 3600)
+    started = datetime.now()
+    fix = lambda lat, lon: schemas.DogsUpdate(accessDogToken="token", dogid=1, lat=lat, lon=lon)
+
+    detector = StationaryDetector()
+    assert detector.observe([fix(52.25, 104.26)], now=started) == []
+    # Дрожание GPS в пределах радиуса не сбрасывает якорь
+    assert detector.observe([fix(52.2502, 104.2602)], now=started + timedelta(minutes=30)) == []
+    assert detector.observe([fix(52.2501, 104.2601)], now=started + timedelta(minutes=61)) == [1]
+    assert detector.observe([fix(52.2501, 104.2601)], now=started + timedelta(minutes=62)) == []
+    assert detector.snapshot(10)[0]["since"] == str(started)
+
+    # Собака ушла за радиус: тревога снимается, отсчёт начинается заново
+    assert detector.observe([fix(52.26, 104.26)], now=started + timedelta(minutes=63)) == []
+    assert detector.alerts == {}
+    assert detector.observe([fix(52.26, 104.26)], now=started + timedelta(minutes=100)) == []
+    assert detector.observe([fix(52.26, 104.26)], now=started + timedelta(minutes=124)) == [1]
+
+def test_dogs_stationary(monkeypatch):
+    monkeypatch.setattr(config, "STATIONARY_AFTER", 0)
+    dog = getDogID_AND_accessDogToken()
+    for _ in range(2):
+        client.post("/dogs/update", json={"accessDogToken": dog[1], "dogid": dog[0], "coordinates": "52.25, 104.26"})
+
+    response = client.post("/dogs/stationary", json={"accessToken": getAccessToken()})
+    assert response.status_code == 200
+    dogs = {item["dogid"]: item for item in response.json()["dogs"]}
+    assert dogs[str(dog[0])]["lat"] == 52.25
+    assert response.json()["total"] >= 1
+
+    client.post("/dogs/update", json={"accessDogToken": dog[1], "dogid": dog[0], "coordinates": "52.35, 104.26"})
+    response = client.post("/dogs/stationary", json={"accessToken": getAccessToken()})
+    assert str(dog[0]) not in {item["dogid"] for item in response.json()["dogs"]}
+
+    response = client.post("/dogs/stationary", json={"accessToken": getAccessTokennotAdmin()})
+    assert response.status_code == 400
+
+# Отложенная запись координат
+
+def getDogCoordinates(dogid):
+    with DBSession() as db:
+        dog = db.query(models.DogsUser).filter_by(dogid=dogid).first()
+        track = db.query(models.DogsTrack).filter_by(dogid=dogid).count()
+        return dog.coordinates, track
+
+def test_writebehind_coalesce(monkeypatch):
+    monkeypatch.setattr(config, "WRITE_BEHIND", True)
+    monkeypatch.setattr(config, "WRITE_BEHIND_INTERVAL_MS", 60000)
+    buffer = writebehind.WriteBehindBuffer()
+    monkeypatch.setattr(writebehind, "buffer", buffer)
+    buffer.start()
+    dog = getDogID_AND_accessDogToken()
+    try:
+        for i in range(3):
+            response = client.post("/dogs/update", json={"accessDogToken": dog[1], "dogid": dog[0], "coordinates": f"52.2{i}, 104.26"})
+            assert response.status_code == 200
+            time.sleep(0.002)
+        # До сброса координаты только в буфере
+        assert len(buffer) == 3
+        assert getDogCoordinates(dog[0]) == ("", 0)
+    finally:
+        buffer.stop()
+    # При остановке буфер сброшен: у собаки последняя точка, в треке все три
+    assert len(buffer) == 0
+    assert getDogCoordinates(dog[0]) == ("52.22, 104.26", 3)
+
+    # Остановленный буфер не принимает координаты, они пишутся сразу
+    client.post("/dogs/update", json={"accessDogToken": dog[1], "dogid": dog[0], "coordinates": "52.3, 104.26"})
+    assert getDogCoordinates(dog[0])[0] == "52.3, 104.26"
+
+def test_writebehind_flushentries(monkeypatch):
+    monkeypatch.setattr(config, "WRITE_BEHIND_INTERVAL_MS", 60000)
+    monkeypatch.setattr(config, "WRITE_BEHIND_MAX_ENTRIES", 2)
+    buffer = writebehind.WriteBehindBuffer()
+    buffer.start()
+    dogs = [getDogID_AND_accessDogToken() for _ in range(2)]
+    try:
+        buffer.put([schemas.DogsUpdate(accessDogToken=dog[1], dogid=dog[0], coordinates="52.25, 104.26") for dog in dogs])
+        for _ in range(100):
+            if getDogCoordinates(dogs[1][0])[0]:
+                break
+            time.sleep(0.02)
+        assert getDogCoordinates(dogs[1][0])[0] == "52.25, 104.26"
+    finally:
+        buffer.stop()
+
+def test_writebehind_backpressure(monkeypatch):
+    monkeypatch.setattr(config, "WRITE_BEHIND_MAX_PENDING", 2)
+    monkeypatch.setattr(config, "WRITE_BEHIND_PUT_TIMEOUT", 0)
+    flushing, release = threading.Event(), threading.Event()
+    write = crud.write_dogsusers_coordinates
+
+    def slow_write(db, fixes):
+        flushing.set()
+        release.wait(10)
+        write(db, fixes)
+    monkeypatch.setattr(crud, "write_dogsusers_coordinates", slow_write)
+
+    buffer = writebehind.WriteBehindBuffer()
+    buffer.start()
+    dog = getDogID_AND_accessDogToken()
+    fix = schemas.DogsUpdate(accessDogToken=dog[1], dogid=dog[0], coordinates="52.25, 104.26")
+    try:
+        assert buffer.put([fix, fix])
+        # Поток записи занят первым сбросом, буфер снова заполняется
+        assert flushing.wait(10)
+        assert buffer.put([fix, fix])
+        with pytest.raises(exceptions.IngestOverloaded):
+            buffer.put([fix])
+    finally:
+        release.set()
+        buffer.stop()
+    assert len(buffer) == 0